@@ -1,25 +1,93 @@
+import os
 import joblib
 import json
+import threading
 import numpy as np
-import re
-from typing import Tuple, Optional
+import pandas as pd
+from typing import Optional
 
 from langchain_core.tools import tool
+from langchain_core.runnables import RunnableConfig
 from langgraph.prebuilt import create_react_agent
 from sqlalchemy.orm import Session
 
 from database import SessionLocal
 import models
-from graph_setup import memory
+from user_cache import user_cache
+from metrics import instrument_tools
+from parallel_tools import create_tool_node
+
+PLANNER_MODEL_PATH = os.getenv("PLANNER_MODEL_PATH", "./Agents/investment_portfolio_model.joblib")
+PLANNER_MIN_AGE = int(os.getenv("PLANNER_MIN_AGE", "18"))
+PLANNER_MAX_AGE = int(os.getenv("PLANNER_MAX_AGE", "100"))
+RISK_LEVELS = range(1, 6)
 
 _loaded_model = None
+# Model output for every (age, risk) pair: shape (ages, risk levels, 3) as [equity, gold, debt]
+_allocation_table: Optional[np.ndarray] = None
+_model_lock = threading.Lock()
 _planner_agent_llm = None
 planner_agent_prompt = None
 
+
+def _model_input(ages: np.ndarray, risks: np.ndarray):
+    """Builds the model's feature matrix, keeping the feature names it was fitted with."""
+    features = np.column_stack([ages, risks])
+    names = getattr(_loaded_model, "feature_names_in_", None)
+    if names is None:
+        return features
+    return pd.DataFrame(features, columns=list(names))
+
+
+def _load_model():
+    """Loads the allocation model on first use and precomputes the (age, risk) lookup table."""
+    global _loaded_model, _allocation_table
+    if _allocation_table is not None:
+        return
+    with _model_lock:
+        if _allocation_table is not None:
+            return
+        print(f"Loading planner model from {PLANNER_MODEL_PATH}")
+        # Memory-map the model's arrays so worker processes share the pages
+        _loaded_model = joblib.load(PLANNER_MODEL_PATH, mmap_mode="r")
+
+        ages, risks = np.meshgrid(np.arange(PLANNER_MIN_AGE, PLANNER_MAX_AGE + 1), np.array(RISK_LEVELS), indexing="ij")
+        predictions = _loaded_model.predict(_model_input(ages.ravel(), risks.ravel()))
+        _allocation_table = np.asarray(predictions, dtype=np.float32).reshape(ages.shape + (-1,))
+
+
+def predict_allocation(age: int, risk: int) -> np.ndarray:
+    """Returns [equity, gold, debt] percentages; an O(1) table lookup inside the precomputed grid."""
+    _load_model()
+    if PLANNER_MIN_AGE <= age <= PLANNER_MAX_AGE and risk in RISK_LEVELS:
+        return _allocation_table[age - PLANNER_MIN_AGE, risk - RISK_LEVELS.start]
+    return _loaded_model.predict(_model_input(np.array([age]), np.array([risk])))[0]
+
+
+def predict_allocations(ages: np.ndarray, risks: np.ndarray) -> np.ndarray:
+    """
+    Vectorised `predict_allocation` for many users: returns an (n, 3) array of
+    [equity, gold, debt]. Rows inside the grid are gathered from the table in
+    one indexing operation; the rest go through a single model call.
+    """
+    _load_model()
+    ages = np.asarray(ages, dtype=np.int64)
+    risks = np.asarray(risks, dtype=np.int64)
+    result = np.empty((len(ages), _allocation_table.shape[-1]), dtype=np.float32)
+
+    in_grid = (
+        (ages >= PLANNER_MIN_AGE) & (ages <= PLANNER_MAX_AGE)
+        & (risks >= RISK_LEVELS.start) & (risks < RISK_LEVELS.stop)
+    )
+    result[in_grid] = _allocation_table[ages[in_grid] - PLANNER_MIN_AGE, risks[in_grid] - RISK_LEVELS.start]
+    if not in_grid.all():
+        result[~in_grid] = _loaded_model.predict(_model_input(ages[~in_grid], risks[~in_grid]))
+    return result
+
+
 def init_planner_agent(planner_agent_llm):
-    """Initializes the Planner Agent by loading the joblib model and setting the LLM."""
-    global _loaded_model, _planner_agent_llm, planner_agent_prompt
-    _loaded_model = joblib.load('./Agents/investment_model.joblib')
+    """Initializes the Planner Agent's LLM. The allocation model is loaded lazily on first use."""
+    global _planner_agent_llm, planner_agent_prompt
     _planner_agent_llm = planner_agent_llm
     planner_agent_prompt = """
     You are PlannerAgent, an AI assistant that creates personalized investment plans for new Indian investors.
@@ -41,70 +109,29 @@ def init_planner_agent(planner_agent_llm):
     - Be encouraging and clear, as you are guiding a new investor.
     """
 
-def _extract_info_from_history(thread_id: str) -> Tuple[Optional[int], Optional[int]]:
-    """Parses the last few messages in the conversation history to find age and risk tolerance."""
-    age = None
-    risk = None
-    
-    config = {"configurable": {"thread_id": thread_id}}
-    checkpoint_tuple = memory.get_tuple(config)
-    
-    if not checkpoint_tuple:
-        return None, None
-        
-    messages = checkpoint_tuple.checkpoint.get("channel_values", {}).get("messages", [])
-    if not messages:
-        return None, None
-
-    # Check the last 6 messages
-    for msg in reversed(messages[-6:]):
-        content = getattr(msg, "content", "")
-        if not isinstance(content, str):
-            continue
-        content = content.lower()
-        age_match = re.search(r'\b(\d{2})\b', content)
-        if age_match and not age:
-            age = int(age_match.group(1))
-
-        risk_match = re.search(r'\b([1-5])\b', content)
-        if risk_match and not risk:
-            risk = int(risk_match.group(1))
-            
-    return age, risk
-
 @tool
-def get_investment_plan(config: dict) -> str:
+def get_investment_plan(config: RunnableConfig) -> str:
     """
-    Generates a personalized investment plan. It intelligently retrieves the user's
-    age and risk tolerance from their saved profile or the recent conversation history,
-    and saves any new information back to their profile.
+    Generates a personalized investment plan from the user's age and risk tolerance.
+    Both are read from their saved profile, which is kept up to date from the
+    conversation as messages arrive.
     """
     print("--- PLANNER AGENT: GENERATING STATE-AWARE PLAN ---")
-    db: Session = SessionLocal()
     try:
         thread_id = config["configurable"]["thread_id"]
         
-        user = db.query(models.User).filter(models.User.thread_id == thread_id).first()
+        # Shared with the auth dependency, so a steady-state turn skips the database
+        user = user_cache.get_by_thread_id(thread_id)
+        if user is None:
+            db: Session = SessionLocal()
+            try:
+                db_user = db.query(models.User).filter(models.User.thread_id == thread_id).first()
+                user = user_cache.put(db_user) if db_user else None
+            finally:
+                db.close()
         if not user:
             return json.dumps({"status": "error", "message": "Critical error: User not found for this session."})
 
-        if not user.age or not user.risk_tolerance:
-            print("User profile incomplete in DB. Parsing conversation history...")
-            extracted_age, extracted_risk = _extract_info_from_history(thread_id)
-            
-            profile_updated = False
-            if extracted_age and not user.age:
-                user.age = extracted_age
-                profile_updated = True
-            if extracted_risk and not user.risk_tolerance:
-                user.risk_tolerance = str(extracted_risk) 
-                profile_updated = True
-            
-            if profile_updated:
-                db.commit()
-                db.refresh(user)
-                print(f"User profile for {user.email} updated from conversation.")
-
         if not user.age or not user.risk_tolerance:
             return json.dumps({
                 "status": "error", 
@@ -112,15 +139,14 @@ def get_investment_plan(config: dict) -> str:
             })
 
         print(f"Running prediction for Age: {user.age}, Risk: {user.risk_tolerance}")
-        params = np.array([[int(user.age), int(user.risk_tolerance)]])
-        prediction = _loaded_model.predict(params)
+        prediction = predict_allocation(int(user.age), int(user.risk_tolerance))
         
         result = {
             "status": "success",
             "data": {
-                'equity_pct': round(prediction[0][0], 2),
-                'gold_pct': round(prediction[0][1], 2),
-                'debt_pct': round(prediction[0][2], 2)
+                'equity_pct': round(float(prediction[0]), 2),
+                'gold_pct': round(float(prediction[1]), 2),
+                'debt_pct': round(float(prediction[2]), 2)
             }
         }
         return json.dumps(result)
@@ -128,15 +154,13 @@ def get_investment_plan(config: dict) -> str:
     except Exception as e:
         print(f"An error occurred in get_investment_plan: {e}")
         return json.dumps({"status": "error", "message": f"An unexpected error occurred: {str(e)}"})
-    finally:
-        db.close()
 
 
 def create_planner_agent():
     """Creates the LangGraph ReAct agent for financial planning."""
     planner_agent = create_react_agent(
         model=_planner_agent_llm,
-        tools=[get_investment_plan],
+        tools=create_tool_node(instrument_tools([get_investment_plan])),
         prompt=planner_agent_prompt,
         name='planner_agent'
     )
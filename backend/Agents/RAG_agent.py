@@ -94,6 +94,9 @@ from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.tools import tool
 from langgraph.prebuilt import create_react_agent
 
+from metrics import instrument_tools
+from parallel_tools import create_tool_node
+
 _RAG_llm = None
 _embedding = None
 _ZILLIZ_CLOUD_URI = None
@@ -170,7 +173,7 @@ def create_rag_agent():
     # and tool calling logic automatically.
     return create_react_agent(
         model=_RAG_llm,
-        tools=[retrieve_financial_documents],
+        tools=create_tool_node(instrument_tools([retrieve_financial_documents])),
         prompt=_rag_agent_prompt,
         name='RAG_agent'
     )
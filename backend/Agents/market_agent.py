@@ -9,6 +9,9 @@ from Agents.types import TopType
 from yfinance.const import SECTOR_INDUSTY_MAPPING
 from typing import Annotated
 from pydantic import Field
+from metrics import instrument_tools
+from parallel_tools import create_tool_node
+from market_data import market_data
 
 class FinancialType(str, Enum):
     income_stmt = "income_stmt"
@@ -89,15 +92,14 @@ class RecommendationType(str, Enum):
 @tool
 def get_stock_info(ticker: str) -> str:
     """Get stock information for a given ticker symbol. Use National Stock Exchange Ticker."""
-    company = yf.Ticker(ticker)
     try:
-        if company.isin is None:
+        if market_data.isin(ticker) is None:
             print(f"Company ticker {ticker} not found.")
             return f"Company ticker {ticker} not found."
     except Exception as e:
         print(f"Error: getting stock information for {ticker}: {e}")
         return f"Error: getting stock information for {ticker}: {e}"
-    info = company.info
+    info = market_data.info(ticker)
     return json.dumps(info)
 
 @tool
@@ -120,7 +122,7 @@ def get_historical_stock_prices(
     """
     company = yf.Ticker(ticker)
     try:
-        if company.isin is None:
+        if market_data.isin(ticker) is None:
             print(f"Company ticker {ticker} not found.")
             return f"Company ticker {ticker} not found."
     except Exception as e:
@@ -143,7 +145,7 @@ def get_yahoo_finance_news(ticker: str) -> str:
     """
     company = yf.Ticker(ticker)
     try:
-        if company.isin is None:
+        if market_data.isin(ticker) is None:
             print(f"Company ticker {ticker} not found.")
             return f"Company ticker {ticker} not found."
     except Exception as e:
@@ -189,7 +191,7 @@ def get_financial_statement(ticker: str, financial_type: str) -> str:
 
     company = yf.Ticker(ticker)
     try:
-        if company.isin is None:
+        if market_data.isin(ticker) is None:
             print(f"Company ticker {ticker} not found.")
             return f"Company ticker {ticker} not found."
     except Exception as e:
@@ -239,7 +241,7 @@ def get_holder_info(ticker: str, holder_type: str) -> str:
 
     company = yf.Ticker(ticker)
     try:
-        if company.isin is None:
+        if market_data.isin(ticker) is None:
             print(f"Company ticker {ticker} not found.")
             return f"Company ticker {ticker} not found."
     except Exception as e:
@@ -267,7 +269,7 @@ def get_option_expiration_dates(ticker: str) -> str:
 
     company = yf.Ticker(ticker)
     try:
-        if company.isin is None:
+        if market_data.isin(ticker) is None:
             print(f"Company ticker {ticker} not found.")
             return f"Company ticker {ticker} not found."
     except Exception as e:
@@ -290,7 +292,7 @@ def get_option_chain(ticker: str, expiration_date: str, option_type: str) -> str
 
     company = yf.Ticker(ticker)
     try:
-        if company.isin is None:
+        if market_data.isin(ticker) is None:
             print(f"Company ticker {ticker} not found.")
             return f"Company ticker {ticker} not found."
     except Exception as e:
@@ -319,7 +321,7 @@ def get_recommendations(ticker: str, recommendation_type: str, months_back: int
     """Get recommendations or upgrades/downgrades for a given ticker symbol"""
     company = yf.Ticker(ticker)
     try:
-        if company.isin is None:
+        if market_data.isin(ticker) is None:
             print(f"Company ticker {ticker} not found.")
             return f"Company ticker {ticker} not found."
     except Exception as e:
@@ -490,6 +492,7 @@ def init_market_agent(market_llm):
             
         Note:
         - For getting top performing, top growth of companies use the tool get_top
+        - When a question needs several tools (e.g. price, news and analyst view), call them together in one step; they run in parallel.
         Each tool returns structured JSON data and is optimized for real-time financial insights.
 
         Behavior rules:
@@ -508,7 +511,7 @@ def init_market_agent(market_llm):
 def create_market_agent():
     market_agent = create_react_agent(
         model = _market_llm,
-        tools = [get_top, get_stock_info, get_historical_stock_prices, get_financial_statement, get_yahoo_finance_news, get_recommendations],
+        tools = create_tool_node(instrument_tools([get_top, get_stock_info, get_historical_stock_prices, get_financial_statement, get_yahoo_finance_news, get_recommendations])),
         prompt = market_agent_prompt,
         name = 'market_agent'
     )
@@ -91,27 +91,42 @@
 
 
 import os
+import json
 import pandas as pd
-from typing import Dict
+from typing import Optional
 from langchain_core.tools import tool
 from langchain_core.runnables import RunnableConfig
 from langgraph.prebuilt import create_react_agent
 
+from statement_store import statement_store
+from metrics import instrument_tools
+from parallel_tools import create_tool_node
+from Agents.tax_analysis import (
+    RULES_VERSION,
+    fy_section_totals,
+    fy_summary,
+    get_cached_analysis,
+    select_section,
+)
+
 # -------------------------------------------------------
-# In-memory storage (per thread_id)
+# Statement storage (per thread_id)
 # -------------------------------------------------------
 
-_user_bank_data: Dict[str, pd.DataFrame] = {}
-
-
-def store_bank_data(thread_id: str, df: pd.DataFrame):
-    """Store uploaded bank statement using thread_id as key."""
-    _user_bank_data[thread_id] = df
-
 
 def get_bank_data(thread_id: str) -> pd.DataFrame:
     """Retrieve stored bank statement using thread_id."""
-    return _user_bank_data.get(thread_id)
+    return statement_store.get(thread_id)
+
+
+def get_fy_aggregates(thread_id: str) -> Optional[dict]:
+    """Per financial year 80C/80D utilisation, read from the stored aggregates without rescanning rows."""
+    statement = statement_store.get_statement(thread_id)
+    if statement is None:
+        return None
+    if statement.metadata.get("rules_version") != RULES_VERSION:
+        return fy_summary(fy_section_totals(statement.df))
+    return fy_summary(statement.metadata.get("fy_totals", {}))
 
 
 # -------------------------------------------------------
@@ -119,51 +134,53 @@ def get_bank_data(thread_id: str) -> pd.DataFrame:
 # -------------------------------------------------------
 
 @tool
-def analyze_bank_statement(config: RunnableConfig) -> str:
+def analyze_bank_statement(config: RunnableConfig, section: Optional[str] = None) -> str:
     """
     Analyze the uploaded bank statement CSV to identify
     tax saving gaps and recommend options.
+
+    Args:
+        section: Optional. "80C" or "80D" to return only that section,
+            e.g. for follow-up questions about a single section.
     """
 
     # 🔥 Get thread_id from LangGraph runtime config
     thread_id = config["configurable"]["thread_id"]
 
-    df = get_bank_data(thread_id)
+    statement = statement_store.get_statement(thread_id)
 
-    if df is None:
+    if statement is None:
         return "No bank statement data found. Please upload a CSV file first."
 
-    df = df.copy()
-
-    # Ensure Amount column is numeric
-    df["Amount"] = pd.to_numeric(df["Amount"], errors="coerce")
+    # Computed once per uploaded statement; follow-ups are served from the cache
+    result = get_cached_analysis(thread_id, statement.content_hash, statement.df)
 
-    # Identify debit transactions (negative amounts)
-    debits = df[df["Amount"] < 0].copy()
-    debits["Amount"] = debits["Amount"].abs()
-
-    if debits.empty:
+    if result["debit_count"] == 0:
         return "No debit transactions found in the uploaded statement."
 
-    summary = "Here is a summary of the debit transactions found:\n\n"
-
-    for _, row in debits.iterrows():
-        date = row.get("Date", "Unknown Date")
-        desc = row.get("Description", "No Description")
-        amt = row.get("Amount", 0)
-
-        summary += f"- {date} | {desc} | ₹{amt}\n"
-
-    summary += "\nNow categorize the above transactions into:\n"
-    summary += "- Section 80C eligible investments\n"
-    summary += "- Section 80D eligible investments\n\n"
-
-    summary += "Then calculate:\n"
-    summary += "- Total utilized under 80C (Limit: ₹1,50,000)\n"
-    summary += "- Total utilized under 80D (Limit: ₹25,000)\n"
-    summary += "- Remaining gap under each section\n\n"
-
-    summary += "Finally, suggest specific investment options to maximize tax savings."
+    try:
+        result = select_section(result, section)
+    except KeyError:
+        return f"Unknown section '{section}'. Use 80C or 80D."
+
+    # The sections cover the latest financial year only; every year's utilisation and gap comes from
+    # the stored aggregates, so earlier years' transaction lists are left out of the prompt
+    financial_years = get_fy_aggregates(thread_id)
+    if section:
+        financial_years = {fy: {key: totals[key] for key in result["sections"]} for fy, totals in financial_years.items()}
+    result = {key: value for key, value in result.items() if key != "other_financial_years"}
+    result["financial_years"] = financial_years
+
+    summary = "Here is the computed tax analysis of the uploaded statement (amounts in ₹):\n\n"
+    if result["financial_year"] and len(financial_years) > 1:
+        summary += (
+            f"The statement spans {len(financial_years)} financial years. `sections` covers the latest, "
+            f"{result['financial_year']}; `financial_years` lists utilisation and gap for each year. "
+            "Limits apply per financial year, so never add years together.\n\n"
+        )
+    summary += json.dumps(result, ensure_ascii=False, indent=1)
+    summary += "\n\nThe categorisation, utilized amounts and gaps above are final; do not recalculate them.\n"
+    summary += "Present them as a report and turn the listed recommendations into specific, actionable advice for each remaining gap."
 
     return summary
 
@@ -188,7 +205,12 @@ Do NOT ask the user to upload before checking.
 Workflow:
 1. ALWAYS call `analyze_bank_statement` tool.
 2. If the tool returns "No bank statement data found" → THEN ask user to upload CSV.
-3. If data is returned → analyze and generate full tax report.
+3. If data is returned → generate the full tax report from the computed figures.
+4. For follow-up questions about one section (e.g. "what about 80D only?"),
+   call the tool again with `section` set to "80C" or "80D".
+
+The tool already categorises transactions and calculates utilized amounts and gaps.
+Never recalculate or contradict those figures.
 
 Never skip calling the tool.
 
@@ -206,12 +228,12 @@ Be professional, structured, and easy to read.
 
     global tax_llm
     if "tax_llm" not in globals():
-        from langchain_openai import ChatOpenAI
-        tax_llm = ChatOpenAI(model="gpt-4o", temperature=0.1)
+        from llm_client import create_chat_model
+        tax_llm = create_chat_model("agent", model="gpt-4o", temperature=0.1, stream_usage=True)
 
     tax_agent = create_react_agent(
         model=tax_llm,
-        tools=[analyze_bank_statement],
+        tools=create_tool_node(instrument_tools([analyze_bank_statement])),
         prompt=tax_system_prompt,
         name="tax_agent",
     )
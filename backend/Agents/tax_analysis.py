@@ -0,0 +1,377 @@
+import io
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from statement_store import statement_store
+
+# -------------------------------------------------------
+# Classification rules
+# -------------------------------------------------------
+
+# Bump whenever the rules below change so cached analyses are recomputed.
+RULES_VERSION = "2024.1"
+
+SECTION_LIMITS = {
+    "80C": 150000,
+    "80D": 25000,
+}
+
+# Sub-limit for preventive health check-ups, counted inside 80D.
+PREVENTIVE_CHECKUP_LIMIT = 5000
+
+# (section, category, description regex). Order matters: the first match wins,
+# so health insurance is tested before the generic life-insurance rule.
+CATEGORY_RULES: List[Tuple[str, str, str]] = [
+    ("80D", "Preventive Health Check-up", r"health\s*check|preventive|full\s*body\s*check"),
+    ("80D", "Health Insurance", r"health\s*insurance|mediclaim|medical\s*insurance|star\s*health|care\s*health|niva\s*bupa|apollo\s*munich"),
+    ("80C", "Life Insurance (LIC)", r"\blic\b|life\s*insurance|term\s*(?:plan|insurance)"),
+    ("80C", "ELSS Mutual Fund", r"\belss\b|tax\s*saver\s*(?:mutual\s*)?fund"),
+    ("80C", "PPF", r"\bppf\b|public\s*provident"),
+    ("80C", "EPF / VPF", r"\bepf\b|\bvpf\b|employee\s*provident"),
+    ("80C", "NPS", r"\bnps\b|national\s*pension"),
+    ("80C", "NSC", r"\bnsc\b|national\s*savings\s*certificate"),
+    ("80C", "Tax-saving FD", r"tax\s*saver\s*fd|tax\s*saving\s*(?:fd|deposit)"),
+    ("80C", "Sukanya Samriddhi", r"sukanya"),
+    ("80C", "Home Loan Principal", r"home\s*loan|housing\s*loan"),
+    ("80C", "Tuition Fees", r"tuition|school\s*fee"),
+]
+
+RECOMMENDATIONS = {
+    "80C": [
+        "ELSS mutual funds (3-year lock-in, market-linked returns)",
+        "Public Provident Fund (15-year, government-backed, tax-free returns)",
+        "NPS Tier-1 (extra ₹50,000 under 80CCD(1B) beyond the 80C limit)",
+        "Tax-saving fixed deposits (5-year lock-in, fixed returns)",
+    ],
+    "80D": [
+        "Health insurance for self and family",
+        "Separate health insurance for parents (additional deduction)",
+        "Preventive health check-up (up to ₹5,000 within 80D)",
+    ],
+}
+
+
+def classify_transactions(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Returns the debit rows of a statement with positive `Amount`, plus
+    `Section` and `Category` columns (None when no rule matches).
+    """
+    amounts = pd.to_numeric(df["Amount"], errors="coerce")
+    debits = pd.DataFrame({
+        "Date": df["Date"].astype(str) if "Date" in df else "Unknown Date",
+        "Description": df["Description"].astype(str) if "Description" in df else "",
+        "Amount": amounts.abs(),
+    })[(amounts < 0).to_numpy()]
+
+    description = debits["Description"].str.lower()
+    matches = [description.str.contains(pattern, regex=True).to_numpy() for _, _, pattern in CATEGORY_RULES]
+    debits["Section"] = np.select(matches, [section for section, _, _ in CATEGORY_RULES], default=None) if matches else None
+    debits["Category"] = np.select(matches, [category for _, category, _ in CATEGORY_RULES], default=None) if matches else None
+    return debits
+
+
+def compute_tax_analysis(df: pd.DataFrame, debits: Optional[pd.DataFrame] = None) -> dict:
+    """
+    Deterministic 80C/80D analysis of a statement: totals per category, gaps
+    and recommendation inputs. Pass `debits` if the statement is already classified.
+
+    Section limits are annual, so the sections cover one financial year:
+    the latest one in the statement, named in `financial_year`. A statement
+    that spans several years (e.g. after appends) has the other years listed
+    in `other_financial_years`, each with the same per-section figures.
+    Debits with an unparseable date belong to no year; only when no date
+    parses at all is the whole statement analysed as a single year.
+    """
+    if debits is None:
+        debits = classify_transactions(df)
+
+    fy = financial_year(debits["Date"])
+    years = sorted(fy.dropna().unique())
+    latest = years[-1] if years else None
+
+    unclassified = debits[debits["Section"].isna()]
+    return {
+        "rules_version": RULES_VERSION,
+        "total_debits": round(float(debits["Amount"].sum()), 2),
+        "debit_count": int(len(debits)),
+        "unclassified_debit_count": int(len(unclassified)),
+        "financial_year": latest,
+        "sections": _section_analysis(debits[(fy == latest).to_numpy()] if latest else debits),
+        "other_financial_years": {year: _section_analysis(debits[(fy == year).to_numpy()]) for year in years[:-1]},
+    }
+
+
+def _section_analysis(debits: pd.DataFrame) -> dict:
+    """Utilized amount, eligible deduction, gap, categories and transactions per section, for one year's debits."""
+    sections = {}
+    for section, limit in SECTION_LIMITS.items():
+        rows = debits[debits["Section"] == section]
+        categories = {category: round(float(total), 2) for category, total in rows.groupby("Category")["Amount"].sum().items()}
+
+        utilized = float(rows["Amount"].sum())
+        if section == "80D" and "Preventive Health Check-up" in categories:
+            checkup = categories["Preventive Health Check-up"]
+            utilized -= max(checkup - PREVENTIVE_CHECKUP_LIMIT, 0)
+
+        eligible = min(utilized, limit)
+        gap = max(limit - utilized, 0)
+        sections[section] = {
+            "limit": limit,
+            "utilized": round(utilized, 2),
+            "eligible_deduction": round(eligible, 2),
+            "gap": round(gap, 2),
+            "categories": categories,
+            "transactions": [
+                {"date": date, "description": desc, "amount": round(float(amount), 2), "category": category}
+                for date, desc, amount, category in rows[["Date", "Description", "Amount", "Category"]].itertuples(index=False)
+            ],
+            "recommendations": RECOMMENDATIONS[section] if gap > 0 else [],
+        }
+    return sections
+
+
+# -------------------------------------------------------
+# Statement parsing
+# -------------------------------------------------------
+
+REQUIRED_COLUMNS = ("Date", "Description", "Amount")
+
+
+def read_statement(content: bytes) -> pd.DataFrame:
+    """
+    Parses and validates an uploaded CSV statement. Raises ValueError with
+    a user-facing message when the file is unusable.
+    """
+    try:
+        df = pd.read_csv(io.BytesIO(content))
+    except (pd.errors.ParserError, pd.errors.EmptyDataError, UnicodeDecodeError) as e:
+        raise ValueError(f"Could not parse CSV: {e}")
+
+    df.columns = [str(column).strip() for column in df.columns]
+    missing = [column for column in REQUIRED_COLUMNS if column not in df.columns]
+    if missing:
+        raise ValueError(f"Missing required column(s): {', '.join(missing)}")
+    return df
+
+
+def statement_report(df: pd.DataFrame, debits: pd.DataFrame) -> dict:
+    """Row counts and rows per tax section, reported back for an upload."""
+    amounts = pd.to_numeric(df["Amount"], errors="coerce")
+    sections = debits["Section"].value_counts()
+    report = {
+        "rows": int(len(df)),
+        "invalid_amount_rows": int(amounts.isna().sum()),
+        "debit_rows": int((amounts < 0).sum()),
+        "section_rows": {section: int(sections.get(section, 0)) for section in SECTION_LIMITS},
+    }
+    return report
+
+
+# -------------------------------------------------------
+# Transaction keys and financial-year aggregates
+# -------------------------------------------------------
+
+TXN_KEY_COLUMN = "TxnKey"
+
+
+def transaction_keys(df: pd.DataFrame) -> pd.Series:
+    """
+    Hashes every row on its normalised (date, description, amount).
+
+    Identical transactions inside one statement (two coffees on the same
+    day) are told apart by their occurrence number, so re-uploading an
+    overlapping statement dedupes cleanly without collapsing real repeats.
+    """
+    dates = parse_statement_dates(df["Date"])
+    normalised = pd.DataFrame({
+        "date": dates.dt.strftime("%Y-%m-%d").fillna(df["Date"].astype(str)),
+        "description": df["Description"].astype(str).str.lower().str.split().str.join(" "),
+        "amount": pd.to_numeric(df["Amount"], errors="coerce").round(2),
+    })
+    normalised["occurrence"] = normalised.groupby(["date", "description", "amount"], dropna=False).cumcount()
+    return pd.util.hash_pandas_object(normalised, index=False)
+
+
+def parse_statement_dates(values: pd.Series) -> pd.Series:
+    """
+    Parses statement dates: ISO (2024-04-05) first, anything else day-first
+    (05/04/2024), as Indian banks write them. Unparseable dates become NaT.
+    """
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values
+    text = values.astype(str).str.strip()
+    dates = pd.to_datetime(text, format="ISO8601", errors="coerce")
+    rest = dates.isna()
+    if rest.any():
+        dates[rest] = pd.to_datetime(text[rest], format="mixed", dayfirst=True, errors="coerce")
+    return dates
+
+
+def financial_year(dates: pd.Series) -> pd.Series:
+    """Maps dates to Indian financial-year labels (April–March), e.g. "FY2024-25"; NaN where the date is unparseable."""
+    dates = parse_statement_dates(dates)
+    # Int64 keeps the year an integer even when some dates are NaT
+    start = dates.dt.year.astype("Int64") - (dates.dt.month < 4).astype("Int64")
+    return ("FY" + start.astype(str) + "-" + ((start + 1) % 100).astype(str).str.zfill(2)).where(dates.notna())
+
+
+def fy_section_totals(df: pd.DataFrame, debits: Optional[pd.DataFrame] = None) -> Dict[str, Dict[str, float]]:
+    """Totals per financial year and tax section for the given rows."""
+    if debits is None:
+        debits = classify_transactions(df)
+    debits = debits[debits["Section"].notna()]
+    debits = debits.assign(FY=financial_year(debits["Date"])).dropna(subset=["FY"])
+    totals: Dict[str, Dict[str, float]] = {}
+    for (fy, section), amount in debits.groupby(["FY", "Section"])["Amount"].sum().items():
+        totals.setdefault(fy, {})[section] = round(float(amount), 2)
+    return totals
+
+
+def merge_fy_totals(base: Dict[str, Dict[str, float]], delta: Dict[str, Dict[str, float]]) -> Dict[str, Dict[str, float]]:
+    """Adds the totals of newly appended rows onto the running aggregates."""
+    merged = {fy: dict(sections) for fy, sections in base.items()}
+    for fy, sections in delta.items():
+        for section, amount in sections.items():
+            merged.setdefault(fy, {})[section] = round(merged.get(fy, {}).get(section, 0.0) + amount, 2)
+    return merged
+
+
+def fy_summary(totals: Dict[str, Dict[str, float]]) -> Dict[str, Dict[str, dict]]:
+    """Utilized amount and remaining gap per section for each financial year."""
+    return {
+        fy: {
+            section: {
+                "utilized": sections.get(section, 0.0),
+                "gap": round(max(limit - sections.get(section, 0.0), 0), 2),
+            }
+            for section, limit in SECTION_LIMITS.items()
+        }
+        for fy, sections in sorted(totals.items())
+    }
+
+
+# -------------------------------------------------------
+# Statement ingestion (runs in a worker process)
+# -------------------------------------------------------
+
+def merge_statement(thread_id: str, df: pd.DataFrame, append: bool, debits: Optional[pd.DataFrame] = None) -> dict:
+    """
+    Stores an uploaded statement for a thread and returns its row counts.
+
+    With `append=True` the rows are merged into the thread's existing
+    statement; rows already seen (same date, description and amount) are
+    skipped and the financial-year aggregates are updated from the new
+    rows only. Pass `debits` if the statement is already classified.
+    The read, merge and write hold the statement's cross-process lock, so
+    concurrent uploads from any worker never lose each other's rows.
+    """
+    df = df.drop(columns=[TXN_KEY_COLUMN], errors="ignore")
+    df[TXN_KEY_COLUMN] = transaction_keys(df).to_numpy()
+    df = df.drop_duplicates(subset=[TXN_KEY_COLUMN])
+    if debits is None:
+        debits = classify_transactions(df)
+    debits = debits[debits.index.isin(df.index)]
+
+    with statement_store.locked(thread_id):
+        return _merge_locked(thread_id, df, append, debits)
+
+
+def _merge_locked(thread_id: str, df: pd.DataFrame, append: bool, debits: pd.DataFrame) -> dict:
+    existing = statement_store.get_statement(thread_id, cache=False) if append else None
+    if existing is None:
+        new_rows = combined = df
+        fy_totals = fy_section_totals(df, debits)
+    else:
+        old = existing.df
+        old_keys = old[TXN_KEY_COLUMN] if TXN_KEY_COLUMN in old else transaction_keys(old)
+        new_rows = df[~df[TXN_KEY_COLUMN].isin(old_keys)]
+        combined = pd.concat([old.assign(**{TXN_KEY_COLUMN: old_keys.to_numpy()}), new_rows], ignore_index=True)
+
+        if existing.metadata.get("rules_version") == RULES_VERSION:
+            new_debits = debits[debits.index.isin(new_rows.index)]
+            fy_totals = merge_fy_totals(existing.metadata.get("fy_totals", {}), fy_section_totals(new_rows, new_debits))
+        else:
+            fy_totals = fy_section_totals(combined)
+
+    statement_store.put(thread_id, combined, {"rules_version": RULES_VERSION, "fy_totals": fy_totals}, cache=False)
+    return {
+        "rows_received": len(df),
+        "rows_added": len(new_rows),
+        "duplicates_skipped": len(df) - len(new_rows),
+        "total_rows": len(combined),
+    }
+
+
+def ingest_statement(thread_id: str, content: bytes, append: bool) -> Tuple[dict, dict]:
+    """
+    Parses, validates and classifies an uploaded statement, merges it into
+    the thread's stored statement and writes it. Runs in a worker process so
+    none of the pandas work holds the API process's GIL; returns only the
+    `statement_report` and the `merge_statement` counts.
+    """
+    df = read_statement(content)
+    debits = classify_transactions(df)
+    return statement_report(df, debits), merge_statement(thread_id, df, append, debits)
+
+
+# -------------------------------------------------------
+# Memoized analysis (per thread, statement hash and rules version)
+# -------------------------------------------------------
+
+TAX_ANALYSIS_CACHE_SIZE = int(os.getenv("TAX_ANALYSIS_CACHE_SIZE", "1024"))
+
+_analysis_cache: "OrderedDict[Tuple[str, str, str], dict]" = OrderedDict()
+_analysis_cache_lock = threading.Lock()
+_analysis_cache_stats: Dict[str, int] = {"hits": 0, "misses": 0}
+
+
+def get_cached_analysis(thread_id: str, content_hash: str, df: pd.DataFrame) -> dict:
+    """Returns the analysis for this exact statement, computing it only on a cache miss."""
+    key = (thread_id, content_hash, RULES_VERSION)
+    with _analysis_cache_lock:
+        result = _analysis_cache.get(key)
+        if result is not None:
+            _analysis_cache.move_to_end(key)
+            _analysis_cache_stats["hits"] += 1
+            return result
+        _analysis_cache_stats["misses"] += 1
+
+    result = compute_tax_analysis(df)
+    result["statement_hash"] = content_hash
+
+    with _analysis_cache_lock:
+        _analysis_cache[key] = result
+        while len(_analysis_cache) > TAX_ANALYSIS_CACHE_SIZE:
+            _analysis_cache.popitem(last=False)
+    return result
+
+
+def invalidate_analysis(thread_id: str) -> None:
+    """Drops every cached analysis for a thread (called on re-upload)."""
+    with _analysis_cache_lock:
+        for key in [key for key in _analysis_cache if key[0] == thread_id]:
+            del _analysis_cache[key]
+
+
+def analysis_cache_stats() -> Dict[str, int]:
+    with _analysis_cache_lock:
+        return {**_analysis_cache_stats, "entries": len(_analysis_cache)}
+
+
+def select_section(result: dict, section: Optional[str]) -> dict:
+    """Narrows a cached analysis to a single section, e.g. for "what about 80D only?"."""
+    if not section:
+        return result
+    key = section.upper().replace("SECTION", "").strip()
+    if key not in result["sections"]:
+        raise KeyError(section)
+    return {
+        **result,
+        "sections": {key: result["sections"][key]},
+        "other_financial_years": {fy: {key: sections[key]} for fy, sections in result["other_financial_years"].items()},
+    }
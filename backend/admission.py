@@ -0,0 +1,204 @@
+import os
+import time
+import asyncio
+import threading
+from collections import Counter, deque
+from typing import AsyncIterator, Dict, Optional
+
+# -------------------------------------------------------
+# Configuration
+# -------------------------------------------------------
+
+# Chat turns running at once across all threads (each thread runs at most one)
+CHAT_MAX_IN_FLIGHT = int(os.getenv("CHAT_MAX_IN_FLIGHT", "32"))
+# Turns allowed to wait for a slot; beyond this /chat-stream answers 429 straight away
+CHAT_MAX_QUEUED = int(os.getenv("CHAT_MAX_QUEUED", "64"))
+CHAT_QUEUE_TIMEOUT_SECONDS = float(os.getenv("CHAT_QUEUE_TIMEOUT_SECONDS", "30"))
+CHAT_RETRY_AFTER_SECONDS = int(os.getenv("CHAT_RETRY_AFTER_SECONDS", "5"))
+
+
+class AdmissionRejected(Exception):
+    """Raised when every slot is busy and the wait queue is full."""
+
+    def __init__(self, retry_after: int):
+        super().__init__("Chat is at capacity.")
+        self.retry_after = retry_after
+
+
+class Ticket:
+    """One chat turn's claim on a slot. A newer message on the same thread supersedes it."""
+
+    def __init__(self, controller: "AdmissionController", thread_id: str):
+        self._controller = controller
+        self.thread_id = thread_id
+        self.created = time.monotonic()
+        self.admitted = False
+        self.superseded = False
+        self.released = False
+        self.run = None  # the ChatRun started under this ticket, so a newer message can preempt it
+
+    def supersede(self) -> None:
+        self.superseded = True
+        if self.run is not None:
+            self.run.cancel("preempted")
+        self._controller._notify()
+
+    def position(self) -> int:
+        return self._controller._position(self)
+
+    async def wait(self, heartbeat_seconds: float) -> AsyncIterator[Optional[int]]:
+        """
+        Yields the queue position each time it changes, and None when it has
+        not changed for `heartbeat_seconds`, until the ticket is admitted.
+        Returns early if the ticket is superseded; raises TimeoutError after
+        CHAT_QUEUE_TIMEOUT_SECONDS.
+        """
+        deadline = self.created + self._controller.queue_timeout
+        last_position = None
+        while not self.admitted and not self.superseded:
+            position = self.position()
+            if position != last_position:
+                last_position = position
+                yield position
+            changed = self._controller._changed
+            timeout = min(heartbeat_seconds, deadline - time.monotonic())
+            if timeout <= 0:
+                raise TimeoutError
+            waiter = asyncio.ensure_future(changed.wait())
+            done, _ = await asyncio.wait({waiter}, timeout=timeout)
+            if not done:
+                waiter.cancel()
+                if time.monotonic() < deadline:
+                    yield None
+
+    def release_unless_running(self) -> None:
+        """Releases the ticket unless a run was started under it; that run releases it when it ends."""
+        if self.run is None:
+            self.release()
+
+    def release(self) -> None:
+        """Frees the slot, or leaves the queue; safe to call more than once."""
+        if not self.released:
+            self.released = True
+            self._controller._release(self)
+
+
+class AdmissionController:
+    """
+    Bounds concurrent chat turns. Each thread holds at most one slot: a new
+    message on a busy thread preempts the running turn and takes the slot
+    over once it has unwound, ahead of the global queue. Other turns wait
+    in a FIFO queue of bounded length for one of `max_in_flight` slots and
+    are told their position; when the queue is full they are rejected, so
+    overload shows up as fast 429s instead of ever longer tail latencies.
+
+    Runs on the event loop only; the lock guards the counters read by stats().
+    """
+
+    def __init__(self, max_in_flight: int, max_queued: int, queue_timeout: float, retry_after: int):
+        self.max_in_flight = max_in_flight
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self._holders: Dict[str, Ticket] = {}
+        # The newest message for a thread whose slot is still held by an older turn
+        self._thread_waiters: Dict[str, Ticket] = {}
+        self._queue: deque = deque()
+        self._changed = asyncio.Event()
+        self._lock = threading.Lock()
+        self._counts: Counter = Counter()
+        self._wait_seconds = 0.0
+
+    def admit(self, thread_id: str) -> Ticket:
+        """Claims a slot for a new turn: granted now, queued, or AdmissionRejected."""
+        ticket = Ticket(self, thread_id)
+        holder = self._holders.get(thread_id)
+        if holder is not None:
+            previous = self._thread_waiters.get(thread_id)
+            if previous is not None:
+                previous.supersede()
+            self._thread_waiters[thread_id] = ticket
+            holder.supersede()
+            self._count("queued")
+            return ticket
+
+        for i, queued in enumerate(self._queue):
+            if queued.thread_id == thread_id:
+                # Keeps the older message's place in line
+                self._queue[i] = ticket
+                queued.supersede()
+                self._count("queued")
+                return ticket
+
+        if len(self._holders) < self.max_in_flight and not self._queue:
+            self._grant(ticket)
+            self._count("admitted_immediately")
+            return ticket
+        if len(self._queue) >= self.max_queued:
+            self._count("rejected")
+            raise AdmissionRejected(self.retry_after)
+        self._queue.append(ticket)
+        self._count("queued")
+        self._notify()
+        return ticket
+
+    def _grant(self, ticket: Ticket) -> None:
+        ticket.admitted = True
+        self._holders[ticket.thread_id] = ticket
+        waited = time.monotonic() - ticket.created
+        with self._lock:
+            self._counts["admitted"] += 1
+            self._wait_seconds += waited
+
+    def _release(self, ticket: Ticket) -> None:
+        thread_id = ticket.thread_id
+        if self._holders.get(thread_id) is ticket:
+            del self._holders[thread_id]
+            waiter = self._thread_waiters.pop(thread_id, None)
+            if waiter is not None:
+                self._grant(waiter)
+        elif self._thread_waiters.get(thread_id) is ticket:
+            del self._thread_waiters[thread_id]
+        elif ticket in self._queue:
+            self._queue.remove(ticket)
+
+        if ticket.superseded:
+            self._count("superseded")
+        elif not ticket.admitted:
+            self._count("abandoned")
+
+        while self._queue and len(self._holders) < self.max_in_flight:
+            self._grant(self._queue.popleft())
+        self._notify()
+
+    def _position(self, ticket: Ticket) -> int:
+        if self._thread_waiters.get(ticket.thread_id) is ticket:
+            return 1
+        try:
+            return self._queue.index(ticket) + 1
+        except ValueError:
+            return 0
+
+    def _notify(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def record_timeout(self) -> None:
+        self._count("timed_out")
+
+    def stats(self) -> dict:
+        with self._lock:
+            counts = dict(self._counts)
+            admitted = counts.get("admitted", 0)
+            counts["queue_wait_ms_avg"] = round(self._wait_seconds / admitted * 1000, 2) if admitted else None
+        counts["in_flight"] = len(self._holders)
+        counts["queued_now"] = len(self._queue) + len(self._thread_waiters)
+        counts["max_in_flight"] = self.max_in_flight
+        return counts
+
+    def _count(self, key: str) -> None:
+        with self._lock:
+            self._counts[key] += 1
+
+
+admission = AdmissionController(CHAT_MAX_IN_FLIGHT, CHAT_MAX_QUEUED, CHAT_QUEUE_TIMEOUT_SECONDS, CHAT_RETRY_AFTER_SECONDS)
@@ -0,0 +1,112 @@
+import os
+import re
+import time
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+# -------------------------------------------------------
+# Configuration
+# -------------------------------------------------------
+
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "5000"))
+ANSWER_CACHE_TTL_SECONDS = float(os.getenv("ANSWER_CACHE_TTL_SECONDS", str(24 * 3600)))
+# Bump whenever the RAG collection is re-indexed; every cached answer from older versions is ignored
+KNOWLEDGE_BASE_VERSION = os.getenv("KNOWLEDGE_BASE_VERSION", "1")
+ANSWER_CACHE_MIN_CHARS = int(os.getenv("ANSWER_CACHE_MIN_CHARS", "40"))
+
+CACHEABLE_AGENT = "RAG_agent"
+
+# Questions about the user themselves ("should I", "my salary") are never shared between users
+_PERSONAL = re.compile(r"\b(?:i|i'm|im|i've|me|my|mine|myself|we|our|us)\b")
+# Answers that go stale well within the TTL (prices, "current" rates, this year's limits) are never cached
+_TIME_SENSITIVE = re.compile(
+    r"\b(?:current(?:ly)?|today'?s?|now|latest|live|recent(?:ly)?|news|yesterday|tomorrow|"
+    r"this\s+(?:year|month|week|quarter)|prices?|quotes?|nav|trading|20\d\d|fy\s?\d{2})\b"
+)
+_POLITE_PREFIX = re.compile(r"^(?:(?:hi|hello|hey|please|kindly|can you|could you|would you|tell me)\s+)+")
+_ARTICLES = re.compile(r"\b(?:a|an|the)\b")
+_PUNCTUATION = re.compile(r"[^\w\s]")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalise_question(message: str) -> str:
+    """Lower-cases, drops punctuation, articles and polite openers, and collapses whitespace."""
+    text = _ARTICLES.sub(" ", _PUNCTUATION.sub(" ", message.lower()))
+    text = _WHITESPACE.sub(" ", text).strip()
+    return _POLITE_PREFIX.sub("", text)
+
+
+def is_shareable(message: str) -> bool:
+    """True if the question carries nothing about the asking user and its answer does not date quickly."""
+    text = message.lower()
+    return not _PERSONAL.search(text) and not _TIME_SENSITIVE.search(text)
+
+
+class AnswerCache:
+    """
+    TTL + LRU cache of complete educational answers, keyed by knowledge-base
+    version and normalised question. Only the final answer of a RAG agent
+    run on the bare question (no thread history), for questions with no
+    personal or conversational context, is stored, so a hit is safe to
+    serve to any user.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float, kb_version: str):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.kb_version = kb_version
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[str, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._stores = 0
+
+    def _key(self, message: str) -> Tuple[str, str]:
+        return self.kb_version, normalise_question(message)
+
+    def get(self, message: str) -> Optional[str]:
+        key = self._key(message)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return entry[0]
+
+    def put(self, message: str, answer: str) -> None:
+        if len(answer) < ANSWER_CACHE_MIN_CHARS:
+            return
+        key = self._key(message)
+        with self._lock:
+            self._entries[key] = (answer, time.monotonic() + self.ttl_seconds)
+            self._entries.move_to_end(key)
+            self._stores += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def set_kb_version(self, kb_version: str) -> None:
+        """Switches to a new knowledge-base version and drops every answer from the old one."""
+        with self._lock:
+            self.kb_version = kb_version
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "hits": self._hits,
+                "misses": self._misses,
+                "stores": self._stores,
+                "entries": len(self._entries),
+                "hit_rate": round(self._hits / lookups, 3) if lookups else None,
+                "kb_version": self.kb_version,
+            }
+
+
+answer_cache = AnswerCache(ANSWER_CACHE_MAX_ENTRIES, ANSWER_CACHE_TTL_SECONDS, KNOWLEDGE_BASE_VERSION)
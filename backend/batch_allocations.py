@@ -0,0 +1,87 @@
+import os
+import json
+import time
+from typing import Iterator
+
+import pandas as pd
+from sqlalchemy import select
+
+import models
+from database import SessionLocal
+from Agents.Planner_agent import predict_allocations
+
+BATCH_ALLOCATION_CHUNK_SIZE = int(os.getenv("BATCH_ALLOCATION_CHUNK_SIZE", "1000"))
+
+
+def stream_batch_allocations(chunk_size: int = BATCH_ALLOCATION_CHUNK_SIZE) -> Iterator[str]:
+    """
+    Yields one NDJSON line per user with their planner allocation, followed by
+    a summary line with throughput metrics.
+
+    Users are read from the `users` table in id order, one chunk at a time
+    (keyset pagination), and each chunk is scored with a single vectorised
+    planner call. This is a plain generator, so StreamingResponse runs it in
+    the threadpool and the DB and NumPy work stays off the event loop.
+    """
+    started = time.perf_counter()
+    db_seconds = model_seconds = 0.0
+    totals = {"users": 0, "allocated": 0, "incomplete": 0, "chunks": 0}
+    last_id = 0
+
+    db = SessionLocal()
+    try:
+        while True:
+            t0 = time.perf_counter()
+            rows = db.execute(
+                select(models.User.id, models.User.age, models.User.risk_tolerance)
+                .where(models.User.id > last_id)
+                .order_by(models.User.id)
+                .limit(chunk_size)
+            ).all()
+            db_seconds += time.perf_counter() - t0
+            if not rows:
+                break
+            last_id = rows[-1].id
+
+            chunk = pd.DataFrame(rows, columns=["id", "age", "risk_tolerance"])
+            ages = pd.to_numeric(chunk["age"], errors="coerce")
+            risks = pd.to_numeric(chunk["risk_tolerance"], errors="coerce")
+            complete = (ages.notna() & risks.notna()).to_numpy()
+
+            t0 = time.perf_counter()
+            allocations = predict_allocations(ages[complete].to_numpy(), risks[complete].to_numpy())
+            model_seconds += time.perf_counter() - t0
+
+            complete_ids = chunk["id"].to_numpy()[complete]
+            lines = [
+                json.dumps({
+                    "user_id": int(user_id),
+                    "status": "ok",
+                    "equity_pct": round(float(equity), 2),
+                    "gold_pct": round(float(gold), 2),
+                    "debt_pct": round(float(debt), 2),
+                })
+                for user_id, (equity, gold, debt) in zip(complete_ids, allocations)
+            ]
+            lines.extend(
+                json.dumps({"user_id": int(user_id), "status": "incomplete", "message": "age or risk_tolerance not set"})
+                for user_id in chunk["id"].to_numpy()[~complete]
+            )
+
+            totals["users"] += len(chunk)
+            totals["allocated"] += int(complete.sum())
+            totals["incomplete"] += int((~complete).sum())
+            totals["chunks"] += 1
+            yield "\n".join(lines) + "\n"
+    finally:
+        db.close()
+
+    elapsed = time.perf_counter() - started
+    yield json.dumps({
+        "type": "summary",
+        **totals,
+        "elapsed_ms": round(elapsed * 1000, 2),
+        "db_ms": round(db_seconds * 1000, 2),
+        "model_ms": round(model_seconds * 1000, 2),
+        "users_per_second": round(totals["users"] / elapsed, 1) if elapsed > 0 else None,
+    }) + "\n"
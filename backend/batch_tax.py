@@ -0,0 +1,176 @@
+"""
+Batch 80C/80D analysis of many bank statements without the LLM.
+
+Used by the `/tax/batch-analysis` endpoint and as a CLI:
+
+    python batch_tax.py statements/*.csv --format csv --output report.csv
+"""
+import os
+import csv
+import io
+import sys
+import json
+import asyncio
+import argparse
+from concurrent.futures import Executor
+from typing import Iterable, List, Sequence, Tuple
+
+from workers import WORKER_PROCESSES
+from Agents.tax_analysis import (
+    classify_transactions,
+    compute_tax_analysis,
+    fy_section_totals,
+    fy_summary,
+    read_statement,
+    statement_report,
+)
+
+# Statements handed to a worker process per task, to amortise pickling overhead.
+BATCH_CHUNK_SIZE = int(os.getenv("BATCH_CHUNK_SIZE", "16"))
+# Statements accepted in one /tax/batch-analysis request
+BATCH_MAX_FILES = int(os.getenv("BATCH_MAX_FILES", "500"))
+# Total size of those statements; the request holds all of them in memory until its analysis is done
+BATCH_MAX_TOTAL_BYTES = int(os.getenv("BATCH_MAX_TOTAL_BYTES", str(200 * 1024 * 1024)))
+# Chunks all batches together may have queued on the shared process pool; the rest of the pool
+# stays free for interactive uploads, which would otherwise wait behind a whole batch.
+BATCH_MAX_POOL_TASKS = int(os.getenv("BATCH_MAX_POOL_TASKS", str(max(WORKER_PROCESSES // 2, 1))))
+
+_pool_slots = asyncio.Semaphore(BATCH_MAX_POOL_TASKS)
+
+CSV_FIELDS = ["client_id", "status", "financial_year", "section", "limit", "utilized", "eligible_deduction", "gap", "rows", "error"]
+
+
+def analyze_statement(client_id: str, content: bytes, include_transactions: bool = False) -> dict:
+    """Full deterministic report for one client's statement."""
+    try:
+        df = read_statement(content)
+        # Classify once and share it between the report, analysis and FY totals
+        debits = classify_transactions(df)
+        report = statement_report(df, debits)
+        analysis = compute_tax_analysis(df, debits)
+    except ValueError as e:
+        return {"client_id": client_id, "status": "error", "error": str(e)}
+    except Exception as e:
+        return {"client_id": client_id, "status": "error", "error": f"Error processing statement: {e}"}
+
+    if not include_transactions:
+        for sections in (analysis["sections"], *analysis["other_financial_years"].values()):
+            for section in sections.values():
+                section.pop("transactions")
+
+    return {
+        "client_id": client_id,
+        "status": "ok",
+        "rows": report["rows"],
+        "invalid_amount_rows": report["invalid_amount_rows"],
+        **analysis,
+        "financial_years": fy_summary(fy_section_totals(df, debits)),
+    }
+
+
+def _analyze_chunk(items: Sequence[Tuple[str, bytes]], include_transactions: bool) -> List[dict]:
+    return [analyze_statement(client_id, content, include_transactions) for client_id, content in items]
+
+
+def _chunks(items: Sequence[Tuple[str, bytes]], size: int) -> Iterable[Sequence[Tuple[str, bytes]]]:
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+async def run_batch_async(
+    items: Sequence[Tuple[str, bytes]],
+    executor: Executor,
+    include_transactions: bool = False,
+) -> List[dict]:
+    """
+    Analyses (client_id, csv bytes) pairs across the executor without
+    blocking the event loop, with at most BATCH_MAX_POOL_TASKS chunks
+    submitted at a time across all batches.
+    """
+    loop = asyncio.get_running_loop()
+
+    async def run_chunk(chunk):
+        async with _pool_slots:
+            return await loop.run_in_executor(executor, _analyze_chunk, chunk, include_transactions)
+
+    chunks = await asyncio.gather(*(run_chunk(chunk) for chunk in _chunks(items, BATCH_CHUNK_SIZE)))
+    return [result for chunk in chunks for result in chunk]
+
+
+def run_batch(
+    items: Sequence[Tuple[str, bytes]],
+    executor: Executor,
+    include_transactions: bool = False,
+) -> List[dict]:
+    """Blocking variant of `run_batch_async` for the CLI."""
+    futures = [executor.submit(_analyze_chunk, chunk, include_transactions) for chunk in _chunks(items, BATCH_CHUNK_SIZE)]
+    return [result for future in futures for result in future.result()]
+
+
+def to_csv(results: Iterable[dict]) -> str:
+    """Flattens batch results to one CSV row per client, financial year and tax section, latest year first."""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=CSV_FIELDS)
+    writer.writeheader()
+    for result in results:
+        if result["status"] != "ok":
+            writer.writerow({"client_id": result["client_id"], "status": result["status"], "error": result["error"]})
+            continue
+        years = [(result["financial_year"], result["sections"])]
+        years += sorted(result["other_financial_years"].items(), reverse=True)
+        for fy, sections in years:
+            for section, totals in sections.items():
+                writer.writerow({
+                    "client_id": result["client_id"],
+                    "status": result["status"],
+                    "financial_year": fy,
+                    "section": section,
+                    "limit": totals["limit"],
+                    "utilized": totals["utilized"],
+                    "eligible_deduction": totals["eligible_deduction"],
+                    "gap": totals["gap"],
+                    "rows": result["rows"],
+                })
+    return buffer.getvalue()
+
+
+def main(argv: Sequence[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Run the 80C/80D analysis over many bank statements.")
+    parser.add_argument("paths", nargs="+", help="CSV statements, or directories containing them. The file name (without .csv) is used as the client id.")
+    parser.add_argument("--format", choices=["json", "csv"], default="json")
+    parser.add_argument("--output", help="Write the report here instead of stdout.")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (defaults to WORKER_PROCESSES).")
+    parser.add_argument("--include-transactions", action="store_true")
+    args = parser.parse_args(argv)
+
+    files = []
+    for path in args.paths:
+        if os.path.isdir(path):
+            files.extend(os.path.join(path, name) for name in sorted(os.listdir(path)) if name.endswith(".csv"))
+        else:
+            files.append(path)
+
+    items = []
+    for path in files:
+        with open(path, "rb") as f:
+            items.append((os.path.splitext(os.path.basename(path))[0], f.read()))
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    with ProcessPoolExecutor(max_workers=args.workers or WORKER_PROCESSES) as executor:
+        results = run_batch(items, executor, args.include_transactions)
+
+    report = to_csv(results) if args.format == "csv" else json.dumps(results, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8", newline="") as f:
+            f.write(report)
+    else:
+        sys.stdout.write(report)
+
+    failed = sum(1 for result in results if result["status"] != "ok")
+    print(f"Analysed {len(results)} statements ({failed} failed).", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
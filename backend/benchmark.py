@@ -0,0 +1,511 @@
+"""
+Offline end-to-end load test of the API.
+
+Boots `main.app` under uvicorn in a subprocess with every external service
+replaced: a scripted chat model (deterministic handoffs and tool calls,
+configurable time to first token and token rate), a deterministic embedder,
+an in-memory vector store seeded with finance snippets, and a replay market
+provider in place of Yahoo Finance. It then drives concurrent sessions of
+
+    /signup -> /upload-bank-statement (polled until parsed) -> /chat-stream x N
+
+and reports throughput and p50/p95/p99 latencies, including time to first
+token and full-turn latency per scenario.
+
+    python benchmark.py run --sessions 50 --concurrency 10 --turns 3
+    python benchmark.py run --url http://127.0.0.1:8000   # an already running server
+    python benchmark.py serve --port 8765                  # only the fake-backed server
+
+The server inherits the environment, so any setting (ANSWER_CACHE_ENABLED,
+PRE_ROUTER_MODE, DB_POOL_SIZE, ...) can be varied between runs.
+"""
+import os
+import re
+import sys
+import json
+import math
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import subprocess
+from collections import defaultdict
+from typing import Dict, List, Optional, Sequence
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+SAMPLE_STATEMENT = os.path.join(BACKEND_DIR, "sample_bank_statement.csv")
+
+# (scenario, message); each session walks the list starting at its own offset
+SCENARIOS = [
+    ("rag", "What is an index fund?"),
+    ("market", "What is the latest price of RELIANCE.NS?"),
+    ("tax", "How much more can I save in taxes under 80C?"),
+    ("planner", "I am 30 years old with a moderate risk tolerance. Create a plan for me."),
+]
+
+# -------------------------------------------------------
+# Fakes
+# -------------------------------------------------------
+
+_CORPUS = [
+    "An index fund tracks a market index such as the Nifty 50 and charges a low expense ratio.",
+    "A systematic investment plan invests a fixed amount in a mutual fund at regular intervals.",
+    "ELSS funds qualify for deduction under section 80C and have a three year lock-in.",
+    "The Public Provident Fund has a fifteen year tenure and tax-free interest.",
+    "Sovereign Gold Bonds pay 2.5 percent interest a year on top of gold price returns.",
+    "Section 80D allows a deduction for health insurance premiums paid for the family.",
+    "Compounding means returns earn further returns, so time in the market matters.",
+    "Diversification spreads investments across asset classes to reduce risk.",
+]
+
+_ANSWER_WORDS = (
+    "Based on the information available, here is a clear summary. Diversify across equity, debt and gold, "
+    "review your allocation once a year, and keep an emergency fund of six months of expenses before "
+    "investing. Index funds keep costs low, PPF adds safety, and gold bonds hedge against inflation."
+).split()
+
+_TOOL_PRIORITY = ["retrieve_financial_documents", "get_stock_info", "analyze_bank_statement", "get_investment_plan"]
+_TICKER = re.compile(r"\b[A-Z0-9&-]{2,20}\.(?:NS|BO)\b")
+
+
+def _build_chat_model_class():
+    from langchain_core.language_models.chat_models import BaseChatModel
+    from langchain_core.messages import AIMessage, AIMessageChunk, HumanMessage, ToolMessage
+    from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+    from pre_router import route_message
+
+    class ScriptedChatModel(BaseChatModel):
+        """
+        Plays the supervisor and every agent. With handoff tools bound it
+        transfers the latest message to the agent the pre-router rules pick
+        (planner for plans, else RAG), then closes the turn once an agent has
+        answered; with agent tools bound it calls its main tool once and then
+        streams an answer.
+        """
+        model_name: str = "scripted"
+        tool_names: List[str] = []
+        first_token_ms: float = 300
+        tokens_per_second: float = 50
+        answer_tokens: int = 60
+
+        @property
+        def _llm_type(self) -> str:
+            return "scripted"
+
+        def bind_tools(self, tools, **kwargs):
+            names = [getattr(tool, "name", None) or tool.get("name") for tool in tools]
+            return self.model_copy(update={"tool_names": names})
+
+        def _next_message(self, messages) -> AIMessage:
+            last_human = max((i for i, message in enumerate(messages) if isinstance(message, HumanMessage)), default=-1)
+            question = messages[last_human].content if last_human >= 0 else ""
+            since = messages[last_human + 1:]
+            handoffs = [name for name in self.tool_names if name.startswith("transfer_to_")]
+
+            if handoffs:
+                answered = any(isinstance(message, AIMessage) and message.name and not message.tool_calls for message in since)
+                if not answered:
+                    target = route_message(question) or ("planner_agent" if "plan" in question.lower() else "RAG_agent")
+                    return self._tool_call(f"transfer_to_{target.lower()}", {})
+                return AIMessage(content=" ".join(_ANSWER_WORDS[:12]))
+
+            called = any(isinstance(message, ToolMessage) and message.name in self.tool_names for message in since)
+            tool_name = next((name for name in _TOOL_PRIORITY if name in self.tool_names), None)
+            if tool_name and not called:
+                match = _TICKER.search(question)
+                args = {
+                    "retrieve_financial_documents": {"question": question},
+                    "get_stock_info": {"ticker": match.group(0) if match else "RELIANCE.NS"},
+                }.get(tool_name, {})
+                return self._tool_call(tool_name, args)
+            words = [_ANSWER_WORDS[i % len(_ANSWER_WORDS)] for i in range(self.answer_tokens)]
+            return AIMessage(content=" ".join(words))
+
+        def _tool_call(self, name: str, args: dict) -> AIMessage:
+            return AIMessage(content="", tool_calls=[{"name": name, "args": args, "id": f"call_{random.getrandbits(48):x}"}])
+
+        def _usage(self, messages, message: AIMessage) -> dict:
+            input_tokens = sum(len(str(m.content).split()) for m in messages)
+            output_tokens = max(1, len(str(message.content).split()))
+            return {"input_tokens": input_tokens, "output_tokens": output_tokens, "total_tokens": input_tokens + output_tokens}
+
+        def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+            message = self._next_message(messages)
+            time.sleep(self.first_token_ms / 1000)
+            message.usage_metadata = self._usage(messages, message)
+            return ChatResult(generations=[ChatGeneration(message=message)])
+
+        async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+            message = self._next_message(messages)
+            await asyncio.sleep(self.first_token_ms / 1000)
+            if message.tool_calls:
+                call = message.tool_calls[0]
+                chunk = AIMessageChunk(
+                    content="",
+                    tool_call_chunks=[{"name": call["name"], "args": json.dumps(call["args"]), "id": call["id"], "index": 0}],
+                )
+                yield ChatGenerationChunk(message=chunk)
+            else:
+                for i, word in enumerate(str(message.content).split()):
+                    if i:
+                        await asyncio.sleep(1 / self.tokens_per_second)
+                    chunk = ChatGenerationChunk(message=AIMessageChunk(content=word if i == 0 else " " + word))
+                    if run_manager:
+                        await run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+                    yield chunk
+            yield ChatGenerationChunk(message=AIMessageChunk(content="", usage_metadata=self._usage(messages, message)))
+
+    return ScriptedChatModel
+
+
+class ReplayTicker:
+    """
+    Stands in for `yfinance.Ticker`. Serves recorded responses from a JSON
+    fixture ({ticker: {"info": {...}, "history": [...]}}) when one is given,
+    and deterministic synthetic data otherwise; `latency_ms` emulates Yahoo.
+    """
+
+    fixtures: Dict[str, dict] = {}
+    latency_ms: float = 0
+
+    def __init__(self, ticker: str, *args, **kwargs):
+        self.ticker = ticker
+        self._recorded = self.fixtures.get(ticker, {})
+        self._rng = random.Random(ticker)
+
+    def _wait(self):
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+
+    @property
+    def isin(self):
+        self._wait()
+        return self._recorded.get("isin", f"INE{abs(hash(self.ticker)) % 10**9:09d}")
+
+    @property
+    def info(self):
+        self._wait()
+        if "info" in self._recorded:
+            return self._recorded["info"]
+        price = round(self._rng.uniform(100, 3000), 2)
+        return {
+            "symbol": self.ticker, "shortName": self.ticker.split(".")[0], "currency": "INR",
+            "currentPrice": price, "previousClose": round(price * 0.99, 2), "marketCap": int(price * 1e9),
+            "sector": "Energy", "industry": "Oil & Gas Refining & Marketing", "trailingPE": 24.5,
+        }
+
+    def history(self, period: str = "1mo", interval: str = "1d", *args, **kwargs):
+        import pandas as pd
+        self._wait()
+        if "history" in self._recorded:
+            frame = pd.DataFrame(self._recorded["history"])
+            return frame.set_index(pd.to_datetime(frame.pop("Date")))
+        dates = pd.bdate_range(end=pd.Timestamp("2025-01-31"), periods=22)
+        close = pd.Series([1000 + self._rng.uniform(-50, 50) for _ in dates], index=dates)
+        return pd.DataFrame({"Open": close * 0.99, "High": close * 1.01, "Low": close * 0.98, "Close": close, "Volume": 1_000_000})
+
+    @property
+    def news(self):
+        self._wait()
+        return self._recorded.get("news", [])
+
+    @property
+    def actions(self):
+        import pandas as pd
+        self._wait()
+        return pd.DataFrame({"Dividends": [], "Stock Splits": []}, index=pd.DatetimeIndex([]))
+
+    @property
+    def recommendations(self):
+        import pandas as pd
+        self._wait()
+        return pd.DataFrame({"period": ["0m"], "strongBuy": [5], "buy": [10], "hold": [6], "sell": [1], "strongSell": [0]})
+
+
+def install_fakes(args) -> None:
+    """Points the app at local state and swaps every external client for its fake. Must run before `import main`."""
+    data_dir = args.data_dir or tempfile.mkdtemp(prefix="nivara-bench-")
+    os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(data_dir, 'bench.db')}")
+    os.environ.setdefault("CHECKPOINT_SQLITE_PATH", os.path.join(data_dir, "checkpoints.sqlite"))
+    os.environ.setdefault("STATEMENT_STORE_DIR", os.path.join(data_dir, "statements"))
+    os.environ.setdefault("TRACE_EXPORT_PATH", os.path.join(data_dir, "traces.jsonl"))
+    os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+    os.environ.setdefault("NVIDIA_API_KEY", "nvapi-benchmark")
+    print(f"Benchmark server state in {data_dir}")
+
+    import langchain_openai
+    import langchain_milvus
+    import langchain_nvidia_ai_endpoints
+    import yfinance
+    from langchain_core.embeddings import DeterministicFakeEmbedding
+    from langchain_core.vectorstores import InMemoryVectorStore
+
+    ScriptedChatModel = _build_chat_model_class()
+
+    def chat_model(model: str = "gpt-4o", **kwargs):
+        return ScriptedChatModel(
+            model_name=model,
+            first_token_ms=args.first_token_ms,
+            tokens_per_second=args.tokens_per_second,
+            answer_tokens=args.answer_tokens,
+        )
+
+    def vector_store(embedding_function, **kwargs):
+        store = InMemoryVectorStore(embedding_function)
+        store.add_texts(_CORPUS)
+        return store
+
+    langchain_openai.ChatOpenAI = chat_model
+    langchain_nvidia_ai_endpoints.NVIDIAEmbeddings = lambda **kwargs: DeterministicFakeEmbedding(size=256)
+    langchain_milvus.Milvus = vector_store
+
+    if args.market_fixtures:
+        with open(args.market_fixtures, encoding="utf-8") as f:
+            ReplayTicker.fixtures = json.load(f)
+    ReplayTicker.latency_ms = args.market_latency_ms
+    yfinance.Ticker = ReplayTicker
+
+
+def serve(args) -> None:
+    os.chdir(BACKEND_DIR)
+    sys.path.insert(0, BACKEND_DIR)
+    install_fakes(args)
+
+    import uvicorn
+    import main
+
+    uvicorn.run(main.app, host=args.host, port=args.port, log_level="warning")
+
+
+# -------------------------------------------------------
+# Load driver
+# -------------------------------------------------------
+
+def percentile(values: Sequence[float], p: float) -> Optional[float]:
+    """Nearest-rank percentile."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(p / 100 * len(ordered)) - 1))]
+
+
+class Results:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.turns = 0
+        self.sessions = 0
+
+    def record(self, name: str, seconds: float) -> None:
+        self.latencies[name].append(seconds * 1000)
+
+    def error(self, name: str) -> None:
+        self.errors[name] += 1
+
+    def summary(self, elapsed: float) -> dict:
+        return {
+            "elapsed_s": round(elapsed, 2),
+            "sessions": self.sessions,
+            "turns": self.turns,
+            "turns_per_s": round(self.turns / elapsed, 2) if elapsed else None,
+            "latency_ms": {
+                name: {
+                    "count": len(values),
+                    "p50": percentile(values, 50),
+                    "p95": percentile(values, 95),
+                    "p99": percentile(values, 99),
+                    "max": max(values),
+                }
+                for name, values in sorted(self.latencies.items())
+            },
+            "errors": dict(self.errors),
+        }
+
+
+async def chat_turn(client, headers: dict, scenario: str, message: str, results: Results) -> None:
+    started = time.perf_counter()
+    first_token = None
+    finished = False
+    async with client.stream("POST", "/chat-stream", json={"message": message}, headers=headers) as response:
+        if response.status_code != 200:
+            results.error(f"chat_{response.status_code}")
+            return
+        async for line in response.aiter_lines():
+            if not line.startswith("data: "):
+                continue
+            event = json.loads(line[len("data: "):])
+            if event["type"] == "content" and first_token is None:
+                first_token = time.perf_counter() - started
+            elif event["type"] == "end":
+                finished = True
+            elif event["type"] == "cancelled":
+                results.error("chat_cancelled")
+                return
+    if not finished:
+        results.error("chat_incomplete")
+        return
+    elapsed = time.perf_counter() - started
+    results.turns += 1
+    results.record("turn", elapsed)
+    results.record(f"turn[{scenario}]", elapsed)
+    if first_token is not None:
+        results.record("ttft", first_token)
+        results.record(f"ttft[{scenario}]", first_token)
+
+
+async def run_session(client, index: int, tag: str, args, results: Results) -> None:
+    started = time.perf_counter()
+    response = await client.post("/signup", json={
+        "username": f"bench{index}", "email": f"bench-{tag}-{index}@example.com", "password": "benchmark-password",
+    })
+    if response.status_code != 200:
+        results.error(f"signup_{response.status_code}")
+        return
+    results.record("signup", time.perf_counter() - started)
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+    if not args.skip_upload:
+        started = time.perf_counter()
+        with open(SAMPLE_STATEMENT, "rb") as f:
+            response = await client.post(
+                "/upload-bank-statement", files={"file": ("statement.csv", f.read(), "text/csv")}, headers=headers
+            )
+        if response.status_code != 202:
+            results.error(f"upload_{response.status_code}")
+        else:
+            results.record("upload_accept", time.perf_counter() - started)
+            status_url = response.json()["status_url"]
+            while True:
+                job = (await client.get(status_url, headers=headers)).json()
+                if job.get("status") in ("done", "failed"):
+                    break
+                await asyncio.sleep(0.05)
+            if job["status"] == "failed":
+                results.error("upload_failed")
+            results.record("upload_parsed", time.perf_counter() - started)
+
+    for turn in range(args.turns):
+        scenario, message = SCENARIOS[(index + turn) % len(SCENARIOS)]
+        try:
+            await chat_turn(client, headers, scenario, message, results)
+        except Exception as e:
+            results.error(f"chat_{type(e).__name__}")
+    results.sessions += 1
+
+
+async def drive(base_url: str, args) -> dict:
+    import httpx
+
+    results = Results()
+    tag = f"{int(time.time())}-{random.getrandbits(16):x}"
+    limits = httpx.Limits(max_connections=args.concurrency * 2, max_keepalive_connections=args.concurrency * 2)
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def session(index: int):
+        async with semaphore:
+            try:
+                await run_session(client, index, tag, args, results)
+            except Exception as e:
+                results.error(f"session_{type(e).__name__}")
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout, limits=limits) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(session(i) for i in range(args.sessions)))
+        elapsed = time.perf_counter() - started
+    return results.summary(elapsed)
+
+
+def _wait_until_up(base_url: str, server: subprocess.Popen, timeout: float) -> None:
+    import httpx
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"Benchmark server exited with code {server.returncode}")
+        try:
+            if httpx.get(base_url + "/", timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.25)
+    raise RuntimeError(f"Benchmark server did not start within {timeout:.0f}s")
+
+
+def print_report(summary: dict, args) -> None:
+    print(f"\n{summary['sessions']} sessions ({args.concurrency} concurrent), {summary['turns']} chat turns "
+          f"in {summary['elapsed_s']} s -> {summary['turns_per_s']} turns/s")
+    print(f"{'latency (ms)':<22}{'count':>7}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}")
+    for name, row in summary["latency_ms"].items():
+        print(f"{name:<22}{row['count']:>7}" + "".join(f"{row[key]:>10.1f}" for key in ("p50", "p95", "p99", "max")))
+    if summary["errors"]:
+        print(f"errors: {summary['errors']}")
+
+
+def run(args) -> int:
+    server = None
+    base_url = args.url
+    if base_url is None:
+        base_url = f"http://127.0.0.1:{args.port}"
+        command = [
+            sys.executable, os.path.abspath(__file__), "serve", "--port", str(args.port),
+            "--first-token-ms", str(args.first_token_ms), "--tokens-per-second", str(args.tokens_per_second),
+            "--answer-tokens", str(args.answer_tokens), "--market-latency-ms", str(args.market_latency_ms),
+        ]
+        if args.market_fixtures:
+            command += ["--market-fixtures", os.path.abspath(args.market_fixtures)]
+        if args.data_dir:
+            command += ["--data-dir", os.path.abspath(args.data_dir)]
+        server = subprocess.Popen(command, cwd=BACKEND_DIR)
+
+    try:
+        if server is not None:
+            _wait_until_up(base_url, server, args.startup_timeout)
+        summary = asyncio.run(drive(base_url, args))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=30)
+
+    print_report(summary, args)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+    return 1 if summary["errors"] else 0
+
+
+def main(argv: Sequence[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Offline end-to-end load test of the Nivara API.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    fakes = argparse.ArgumentParser(add_help=False)
+    fakes.add_argument("--first-token-ms", type=float, default=300, help="Scripted model latency before its first token.")
+    fakes.add_argument("--tokens-per-second", type=float, default=50, help="Scripted model streaming rate.")
+    fakes.add_argument("--answer-tokens", type=int, default=60, help="Length of each scripted agent answer.")
+    fakes.add_argument("--market-latency-ms", type=float, default=0, help="Added to every replayed market data call.")
+    fakes.add_argument("--market-fixtures", help="JSON of recorded market responses, keyed by ticker.")
+    fakes.add_argument("--data-dir", help="Where the server keeps its database and stores (a temp dir by default).")
+    fakes.add_argument("--port", type=int, default=8765)
+
+    serve_parser = commands.add_parser("serve", parents=[fakes], help="Run the app on the fakes.")
+    serve_parser.add_argument("--host", default="127.0.0.1")
+
+    run_parser = commands.add_parser("run", parents=[fakes], help="Start the fake-backed server and drive sessions against it.")
+    run_parser.add_argument("--url", help="Drive this server instead of starting one.")
+    run_parser.add_argument("--sessions", type=int, default=20)
+    run_parser.add_argument("--concurrency", type=int, default=5)
+    run_parser.add_argument("--turns", type=int, default=3, help="Chat turns per session.")
+    run_parser.add_argument("--skip-upload", action="store_true")
+    run_parser.add_argument("--timeout", type=float, default=120, help="Per-request timeout in seconds.")
+    run_parser.add_argument("--startup-timeout", type=float, default=120)
+    run_parser.add_argument("--output", help="Also write the summary as JSON here.")
+
+    args = parser.parse_args(argv)
+    if args.command == "serve":
+        serve(args)
+        return 0
+    return run(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
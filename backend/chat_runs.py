@@ -0,0 +1,265 @@
+"""
+Chat runs: each chat turn is driven in its own task and streamed to its
+subscribers from a numbered replay buffer, so a dropped client can resume.
+
+Deployment: runs, their replay buffers, preemption by a newer message and
+admission (admission.py) all live in the memory of the worker process that
+accepted the message. With more than one worker, every request of a
+conversation must reach the same worker, i.e. the load balancer needs
+sticky routing keyed on the user (the `Authorization` header, e.g. nginx
+`hash $http_authorization consistent;`). Otherwise `/chat-stream/resume`
+answers 404 for a run that is still going on another worker, and a new
+message does not preempt the old run.
+"""
+import os
+import time
+import asyncio
+import threading
+from collections import Counter, deque
+from typing import AsyncIterator, Awaitable, Callable, Dict, Optional, Tuple
+from uuid import uuid4
+
+from sse import HEARTBEAT, SSE_HEARTBEAT_SECONDS, StreamStats, coalesce, format_event, stream_totals
+
+# -------------------------------------------------------
+# Configuration
+# -------------------------------------------------------
+
+# How often an idle stream (e.g. waiting on a tool) checks whether the client is still there
+CHAT_DISCONNECT_POLL_SECONDS = float(os.getenv("CHAT_DISCONNECT_POLL_SECONDS", "1"))
+# How long a new message waits for the run it preempts to unwind
+CHAT_PREEMPT_WAIT_SECONDS = float(os.getenv("CHAT_PREEMPT_WAIT_SECONDS", "5"))
+# A run nobody is reading is kept going this long, so a dropped client can reconnect to it
+CHAT_RESUME_GRACE_SECONDS = float(os.getenv("CHAT_RESUME_GRACE_SECONDS", "30"))
+# Frames kept per run for replay, and how long a finished run stays resumable
+CHAT_REPLAY_BUFFER_FRAMES = int(os.getenv("CHAT_REPLAY_BUFFER_FRAMES", "2048"))
+CHAT_RESUME_TTL_SECONDS = float(os.getenv("CHAT_RESUME_TTL_SECONDS", "120"))
+
+# uvicorn and gunicorn read their worker count from WEB_CONCURRENCY
+if int(os.getenv("WEB_CONCURRENCY", "1") or 1) > 1:
+    print("Chat runs are kept per worker process: route each user to one worker (sticky sessions) so streams can resume.")
+
+
+def parse_event_id(value: Optional[str]) -> Optional[Tuple[str, int]]:
+    """Splits a `Last-Event-ID` of the form `<run_id>:<seq>`; None if absent or malformed."""
+    if not value:
+        return None
+    run_id, _, seq = value.strip().partition(":")
+    if not run_id or not seq.isdigit():
+        return None
+    return run_id, int(seq)
+
+
+class ChatRun:
+    """
+    One chat turn driven in its own task. Its frames are numbered and kept in
+    a bounded ring buffer; SSE responses subscribe to the run rather than
+    drive it, so a client that drops can reconnect with `Last-Event-ID` and
+    pick up where it left off without the graph running again.
+
+    A run with no subscribers is cancelled after `CHAT_RESUME_GRACE_SECONDS`,
+    and a newer message on the same thread preempts it. `after` runs once
+    the answer has been streamed (history upkeep) and is never cancelled;
+    a newer message waits for it instead.
+    """
+
+    def __init__(self, thread_id: str, events: AsyncIterator[dict], after: Optional[Callable[[], Awaitable[None]]] = None):
+        self.thread_id = thread_id
+        self.run_id = uuid4().hex[:12]
+        self.stats = StreamStats()
+        self.cancel_reason: Optional[str] = None
+        self.answered = False
+        self.closed = False
+        self.finished_at: Optional[float] = None
+        self.subscribers = 0
+        self._log: deque = deque(maxlen=CHAT_REPLAY_BUFFER_FRAMES)
+        self._seq = 0
+        self._changed = asyncio.Event()
+        self._grace_timer: Optional[asyncio.TimerHandle] = None
+        self.task = asyncio.create_task(self._run(events, after))
+
+    async def _run(self, events: AsyncIterator[dict], after) -> None:
+        try:
+            # Heartbeats are written per subscriber, not stored
+            async for frame in coalesce(events, self.stats, heartbeat_seconds=None):
+                self._append(frame)
+            self.answered = True
+        except asyncio.CancelledError:
+            self._append(format_event({"type": "cancelled", "reason": self.cancel_reason}))
+            raise
+        finally:
+            self.closed = True
+            self.finished_at = time.monotonic()
+            self._notify()
+            stream_totals.record(self.stats)
+        if after is not None:
+            await after()
+
+    def _append(self, frame: str) -> None:
+        self._seq += 1
+        self._log.append((self._seq, f"id: {self.run_id}:{self._seq}\n{frame}"))
+        self._notify()
+
+    def _notify(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def done(self) -> bool:
+        return self.task.done()
+
+    def cancel(self, reason: str) -> bool:
+        # Once the answer is out only `after` is left, and it must not be cut short
+        if self.task.done() or self.answered:
+            return False
+        self.cancel_reason = reason
+        return self.task.cancel()
+
+    async def frames(self, after_seq: int = 0, disconnected: Optional[asyncio.Event] = None) -> AsyncIterator[str]:
+        """
+        Yields the run's frames numbered above `after_seq`, then follows the
+        live run until it closes or `disconnected` is set. Writes a heartbeat
+        comment when nothing has been sent for SSE_HEARTBEAT_SECONDS.
+        """
+        self._attach()
+        next_seq = after_seq + 1
+        try:
+            while True:
+                if self._log:
+                    first_seq = self._log[0][0]
+                    if first_seq > next_seq:
+                        yield format_event({"type": "gap", "missed": first_seq - next_seq})
+                        next_seq = first_seq
+                    for seq, frame in list(self._log)[next_seq - first_seq:]:
+                        yield frame
+                        next_seq = seq + 1
+                if self.closed and (not self._log or self._log[-1][0] < next_seq):
+                    break
+
+                waiters = {asyncio.ensure_future(self._changed.wait())}
+                if disconnected is not None:
+                    waiters.add(asyncio.ensure_future(disconnected.wait()))
+                done, pending = await asyncio.wait(waiters, timeout=SSE_HEARTBEAT_SECONDS, return_when=asyncio.FIRST_COMPLETED)
+                for waiter in pending:
+                    waiter.cancel()
+                if disconnected is not None and disconnected.is_set():
+                    return
+                if not done:
+                    self.stats.heartbeats += 1
+                    yield HEARTBEAT
+        finally:
+            self._detach()
+
+        # Surface a failure of the graph run to the response, as before
+        if self.task.done() and not self.task.cancelled() and self.task.exception() is not None:
+            raise self.task.exception()
+
+    def _attach(self) -> None:
+        self.subscribers += 1
+        if self._grace_timer is not None:
+            self._grace_timer.cancel()
+            self._grace_timer = None
+
+    def _detach(self) -> None:
+        self.subscribers -= 1
+        if self.subscribers == 0 and not self.closed:
+            self._grace_timer = asyncio.get_running_loop().call_later(
+                CHAT_RESUME_GRACE_SECONDS, self.cancel, "disconnected"
+            )
+
+
+class ChatRunRegistry:
+    """
+    Tracks the latest run per thread: active runs so a new message can
+    preempt them, and recently finished ones so they can still be replayed.
+    """
+
+    def __init__(self):
+        self._runs: Dict[str, ChatRun] = {}
+        self._lock = threading.Lock()
+        self._counts: Counter = Counter()
+        self._last_sweep = time.monotonic()
+
+    async def start(self, thread_id: str, events: AsyncIterator[dict], after=None) -> ChatRun:
+        self._sweep()
+        previous = self._runs.get(thread_id)
+        if previous is not None and not previous.done():
+            previous.cancel("preempted")
+            # Let the old run unwind, or finish compacting history, first so the two never write the same thread's checkpoints at once
+            await asyncio.wait({previous.task}, timeout=CHAT_PREEMPT_WAIT_SECONDS)
+
+        run = ChatRun(thread_id, events, after)
+        self._runs[thread_id] = run
+        run.task.add_done_callback(lambda _task: self._finished(run))
+        self._count("started")
+        return run
+
+    def get(self, thread_id: str) -> Optional[ChatRun]:
+        run = self._runs.get(thread_id)
+        if run is not None and self._expired(run, time.monotonic()):
+            return None
+        return run
+
+    def record_abandoned_tools(self, count: int) -> None:
+        """Tool calls still running when their turn was cancelled (thread-pool tools finish, but are discarded)."""
+        if count:
+            self._count("tools_abandoned", count)
+
+    def record_resume(self, found: bool) -> None:
+        self._count("resumed" if found else "resume_missed")
+
+    def stats(self) -> dict:
+        with self._lock:
+            counts = dict(self._counts)
+        runs = list(self._runs.values())
+        counts["active"] = sum(1 for run in runs if not run.done())
+        counts["resumable"] = len(runs)
+        return counts
+
+    def _finished(self, run: ChatRun) -> None:
+        if run.task.cancelled():
+            self._count(f"cancelled.{run.cancel_reason or 'unknown'}")
+            # Output generated for a client that never read the rest of it
+            self._count("tokens_before_cancel", run.stats.tokens)
+        elif run.task.exception() is not None:
+            self._count("failed")
+        else:
+            self._count("completed")
+        print(f"Chat run for thread {run.thread_id} finished "
+              f"({run.cancel_reason or 'completed'}): {run.stats.as_dict()}")
+
+    def _expired(self, run: ChatRun, now: float) -> bool:
+        return run.finished_at is not None and now - run.finished_at > CHAT_RESUME_TTL_SECONDS
+
+    def _sweep(self) -> None:
+        now = time.monotonic()
+        if now - self._last_sweep < CHAT_RESUME_TTL_SECONDS:
+            return
+        self._last_sweep = now
+        for thread_id, run in list(self._runs.items()):
+            if self._expired(run, now):
+                del self._runs[thread_id]
+
+    def _count(self, key: str, amount: int = 1) -> None:
+        with self._lock:
+            self._counts[key] += amount
+
+
+chat_runs = ChatRunRegistry()
+
+
+async def watch_disconnect(request, disconnected: asyncio.Event) -> None:
+    """Sets `disconnected` once the HTTP client behind `request` has gone away."""
+    while not await request.is_disconnected():
+        await asyncio.sleep(CHAT_DISCONNECT_POLL_SECONDS)
+    disconnected.set()
+
+
+async def stream_run(request, run: ChatRun, after_seq: int = 0) -> AsyncIterator[str]:
+    """SSE body for one subscriber of `run`; stops following it when the client disconnects."""
+    disconnected = asyncio.Event()
+    watcher = asyncio.create_task(watch_disconnect(request, disconnected))
+    try:
+        async for frame in run.frames(after_seq, disconnected):
+            yield frame
+    finally:
+        watcher.cancel()
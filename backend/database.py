@@ -2,7 +2,9 @@ import os
 from dotenv import load_dotenv
 import sys
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.exc import OperationalError
 
@@ -13,7 +15,51 @@ DATABASE_URL = os.getenv("DATABASE_URL")
 if not DATABASE_URL:
     raise ValueError("No DATABASE_URL found in environment variables. Please set it in your .env file.")
 
-engine = create_engine(DATABASE_URL)
+# --- Pool and timeout settings (shared by the sync and async engines) ---
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "5000"))
+
+_url = make_url(DATABASE_URL)
+_is_sqlite = _url.get_backend_name() == "sqlite"
+_pool_args = {} if _is_sqlite else {
+    "pool_size": DB_POOL_SIZE,
+    "max_overflow": DB_MAX_OVERFLOW,
+    "pool_timeout": DB_POOL_TIMEOUT,
+    "pool_recycle": DB_POOL_RECYCLE,
+}
+
+
+def _sync_connect_args() -> dict:
+    if _is_sqlite:
+        return {"check_same_thread": False}
+    if _url.get_backend_name() == "postgresql":
+        return {"options": f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}"}
+    return {}
+
+
+def _async_url_and_connect_args():
+    """Maps DATABASE_URL onto its async driver: asyncpg for Postgres, aiosqlite for SQLite."""
+    if _is_sqlite:
+        return _url.set(drivername="sqlite+aiosqlite"), {"timeout": DB_STATEMENT_TIMEOUT_MS / 1000}
+    if _url.get_backend_name() == "postgresql":
+        # asyncpg does not understand libpq-only query parameters such as sslmode
+        query = dict(_url.query)
+        sslmode = query.pop("sslmode", None)
+        query.pop("channel_binding", None)
+        connect_args = {
+            "server_settings": {"statement_timeout": str(DB_STATEMENT_TIMEOUT_MS)},
+            "command_timeout": DB_STATEMENT_TIMEOUT_MS / 1000,
+        }
+        if sslmode and sslmode != "disable":
+            connect_args["ssl"] = sslmode
+        return _url.set(drivername="postgresql+asyncpg", query=query), connect_args
+    return _url, {}
+
+
+engine = create_engine(DATABASE_URL, pool_pre_ping=True, connect_args=_sync_connect_args(), **_pool_args)
 
 try:
     connection = engine.connect()
@@ -35,3 +81,13 @@ def get_db():
     finally:
         db.close()
 
+# --- Async engine for request handlers running on the event loop ---
+_async_url, _async_connect_args = _async_url_and_connect_args()
+async_engine = create_async_engine(_async_url, pool_pre_ping=True, connect_args=_async_connect_args, **_pool_args)
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, expire_on_commit=False, autoflush=False)
+
+# Async dependency: database latency no longer blocks other requests on the loop
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
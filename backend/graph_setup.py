@@ -1,3 +1,160 @@
+import os
+import zlib
+from typing import Any, Optional, Tuple
+
+from sqlalchemy.engine import make_url
+from langgraph.checkpoint.base import BaseCheckpointSaver
 from langgraph.checkpoint.memory import MemorySaver
+from langgraph.checkpoint.serde.base import SerializerProtocol
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+
+from database import DATABASE_URL
+
+# -------------------------------------------------------
+# Configuration
+# -------------------------------------------------------
+
+_db_backend = make_url(DATABASE_URL).get_backend_name()
+
+# "postgres" shares DATABASE_URL, "sqlite" writes a local file, "memory" keeps the old process-local saver
+CHECKPOINT_BACKEND = os.getenv("CHECKPOINT_BACKEND", "postgres" if _db_backend == "postgresql" else "sqlite")
+CHECKPOINT_SQLITE_PATH = os.getenv("CHECKPOINT_SQLITE_PATH", "./data/checkpoints.sqlite")
+CHECKPOINT_POOL_SIZE = int(os.getenv("CHECKPOINT_POOL_SIZE", "10"))
+# Root checkpoints kept per thread; older ones (and their writes/blobs) are deleted after each turn
+CHECKPOINT_KEEP_LAST = int(os.getenv("CHECKPOINT_KEEP_LAST", "10"))
+CHECKPOINT_COMPRESS_MIN_BYTES = int(os.getenv("CHECKPOINT_COMPRESS_MIN_BYTES", "512"))
+CHECKPOINT_COMPRESSION_LEVEL = int(os.getenv("CHECKPOINT_COMPRESSION_LEVEL", "6"))
+
+
+class CompressedSerializer(SerializerProtocol):
+    """
+    Wraps the default serializer and zlib-compresses payloads above a size
+    threshold. Compressed values carry a "+zlib" suffix on their type tag, so
+    rows written before compression was enabled still load.
+    """
+
+    SUFFIX = "+zlib"
+
+    def __init__(self, inner: SerializerProtocol, min_bytes: int, level: int):
+        self.inner = inner
+        self.min_bytes = min_bytes
+        self.level = level
+
+    def dumps_typed(self, obj: Any) -> Tuple[str, bytes]:
+        type_, data = self.inner.dumps_typed(obj)
+        if data is not None and len(data) >= self.min_bytes:
+            return type_ + self.SUFFIX, zlib.compress(data, self.level)
+        return type_, data
+
+    def loads_typed(self, data: Tuple[str, bytes]) -> Any:
+        type_, payload = data
+        if type_.endswith(self.SUFFIX):
+            return self.inner.loads_typed((type_[: -len(self.SUFFIX)], zlib.decompress(payload)))
+        return self.inner.loads_typed(data)
+
+
+serde = CompressedSerializer(JsonPlusSerializer(), CHECKPOINT_COMPRESS_MIN_BYTES, CHECKPOINT_COMPRESSION_LEVEL)
+
+
+# Built by open_checkpointer(): the async savers bind to the running event loop, so they
+# cannot be created at import time. main.py attaches it to the compiled graph on startup.
+memory: Optional[BaseCheckpointSaver] = None
+
+
+async def open_checkpointer() -> BaseCheckpointSaver:
+    """Creates the configured saver, opens its connection(s) and creates the checkpoint tables."""
+    global memory
+    if CHECKPOINT_BACKEND == "postgres":
+        from psycopg.rows import dict_row
+        from psycopg_pool import AsyncConnectionPool
+        from langgraph.checkpoint.postgres.aio import AsyncPostgresSaver
+
+        conninfo = make_url(DATABASE_URL).set(drivername="postgresql").render_as_string(hide_password=False)
+        pool = AsyncConnectionPool(
+            conninfo,
+            max_size=CHECKPOINT_POOL_SIZE,
+            open=False,
+            kwargs={"autocommit": True, "prepare_threshold": 0, "row_factory": dict_row},
+        )
+        await pool.open()
+        memory = AsyncPostgresSaver(pool, serde=serde)
+        await memory.setup()
+    elif CHECKPOINT_BACKEND == "sqlite":
+        import aiosqlite
+        from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+
+        os.makedirs(os.path.dirname(CHECKPOINT_SQLITE_PATH) or ".", exist_ok=True)
+        memory = AsyncSqliteSaver(await aiosqlite.connect(CHECKPOINT_SQLITE_PATH), serde=serde)
+        await memory.setup()
+    else:
+        memory = MemorySaver()
+
+    print(f"Checkpointer ready ({CHECKPOINT_BACKEND}, keeping last {CHECKPOINT_KEEP_LAST} per thread).")
+    return memory
+
+
+async def close_checkpointer() -> None:
+    if memory is not None and CHECKPOINT_BACKEND in ("postgres", "sqlite"):
+        await memory.conn.close()
+
+
+async def prune_checkpoints(thread_id: str, keep_last: int = CHECKPOINT_KEEP_LAST) -> int:
+    """
+    Deletes every checkpoint of `thread_id` older than its `keep_last` newest
+    root checkpoints, together with their pending writes (and, on Postgres,
+    channel blobs no remaining checkpoint refers to). Checkpoint ids are
+    time-ordered, so subgraph checkpoints from earlier turns go with them.
+    Returns the number of checkpoints removed.
+    """
+    if memory is None or keep_last <= 0 or CHECKPOINT_BACKEND not in ("postgres", "sqlite"):
+        return 0
+
+    if CHECKPOINT_BACKEND == "sqlite":
+        async with memory.lock:
+            conn = memory.conn
+            async with conn.execute(
+                "SELECT checkpoint_id FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = '' "
+                "ORDER BY checkpoint_id DESC LIMIT 1 OFFSET ?",
+                (thread_id, keep_last - 1),
+            ) as cur:
+                row = await cur.fetchone()
+            if row is None:
+                return 0
+            cutoff = row[0]
+            await conn.execute("DELETE FROM writes WHERE thread_id = ? AND checkpoint_id < ?", (thread_id, cutoff))
+            async with conn.execute(
+                "DELETE FROM checkpoints WHERE thread_id = ? AND checkpoint_id < ?", (thread_id, cutoff)
+            ) as cur:
+                removed = cur.rowcount
+            await conn.commit()
+            return removed
 
-memory = MemorySaver()
\ No newline at end of file
+    async with memory.conn.connection() as conn:
+        async with conn.transaction():
+            row = await (await conn.execute(
+                "SELECT checkpoint_id FROM checkpoints WHERE thread_id = %s AND checkpoint_ns = '' "
+                "ORDER BY checkpoint_id DESC LIMIT 1 OFFSET %s",
+                (thread_id, keep_last - 1),
+            )).fetchone()
+            if row is None:
+                return 0
+            cutoff = row["checkpoint_id"]
+            await conn.execute(
+                "DELETE FROM checkpoint_writes WHERE thread_id = %s AND checkpoint_id < %s", (thread_id, cutoff)
+            )
+            removed = (await conn.execute(
+                "DELETE FROM checkpoints WHERE thread_id = %s AND checkpoint_id < %s", (thread_id, cutoff)
+            )).rowcount
+            await conn.execute(
+                """
+                DELETE FROM checkpoint_blobs b
+                WHERE b.thread_id = %s AND NOT EXISTS (
+                    SELECT 1 FROM checkpoints c
+                    WHERE c.thread_id = b.thread_id
+                      AND c.checkpoint_ns = b.checkpoint_ns
+                      AND c.checkpoint -> 'channel_versions' ->> b.channel = b.version
+                )
+                """,
+                (thread_id,),
+            )
+            return removed
@@ -0,0 +1,176 @@
+import os
+from typing import List, Optional
+
+from langchain_core.messages import (
+    AIMessage,
+    BaseMessage,
+    HumanMessage,
+    RemoveMessage,
+    SystemMessage,
+    ToolMessage,
+)
+from langgraph.graph.message import REMOVE_ALL_MESSAGES
+
+# -------------------------------------------------------
+# Configuration
+# -------------------------------------------------------
+
+HISTORY_SUMMARY_MODEL = os.getenv("HISTORY_SUMMARY_MODEL", "gpt-4o-mini")
+# Most recent user turns kept verbatim
+HISTORY_KEEP_TURNS = int(os.getenv("HISTORY_KEEP_TURNS", "6"))
+# Older turns are folded into the summary this many at a time, so the summariser runs every few turns, not every turn
+HISTORY_FOLD_BATCH = int(os.getenv("HISTORY_FOLD_BATCH", "4"))
+HISTORY_TOOL_MAX_CHARS = int(os.getenv("HISTORY_TOOL_MAX_CHARS", "1500"))
+HISTORY_SUMMARY_MAX_WORDS = int(os.getenv("HISTORY_SUMMARY_MAX_WORDS", "250"))
+
+SUMMARY_MESSAGE_ID = "nivara-history-summary"
+_TRUNCATION_NOTE = "\n…[truncated]"
+
+summary_prompt = """
+You maintain the running memory of a conversation between an Indian retail investor and Nivara, a financial assistant.
+Update the existing summary with the new messages. Keep facts the assistant may need later: the user's age, risk
+tolerance, goals, income and tax details, stocks or funds discussed, plans or numbers already given, and open questions.
+Drop greetings and filler. Write plain sentences, at most {max_words} words.
+
+Existing summary:
+{summary}
+
+New messages:
+{transcript}
+"""
+
+
+def _split_turns(messages: List[BaseMessage]) -> List[List[BaseMessage]]:
+    """Groups messages into turns, each starting at a user message."""
+    turns: List[List[BaseMessage]] = []
+    for message in messages:
+        if isinstance(message, HumanMessage) or not turns:
+            turns.append([])
+        turns[-1].append(message)
+    return turns
+
+
+def _truncate_tool_output(message: BaseMessage, max_chars: int) -> BaseMessage:
+    if not isinstance(message, ToolMessage) or not isinstance(message.content, str) or len(message.content) <= max_chars:
+        return message
+    # Same id, so the add_messages reducer replaces the stored message in place
+    return message.model_copy(update={"content": message.content[: max_chars - len(_TRUNCATION_NOTE)] + _TRUNCATION_NOTE})
+
+
+def _checkpoint_id(state) -> Optional[str]:
+    return (state.config or {}).get("configurable", {}).get("checkpoint_id")
+
+
+def _render(messages: List[BaseMessage], max_chars: int) -> str:
+    lines = []
+    for message in messages:
+        text = message.content if isinstance(message.content, str) else str(message.content)
+        if not text.strip():
+            continue
+        if isinstance(message, HumanMessage):
+            speaker = "User"
+        elif isinstance(message, ToolMessage):
+            speaker, text = "Tool result", text[:max_chars]
+        elif isinstance(message, AIMessage):
+            speaker = f"Assistant ({message.name})" if message.name else "Assistant"
+        else:
+            continue
+        lines.append(f"{speaker}: {text}")
+    return "\n".join(lines)
+
+
+class HistoryManager:
+    """
+    Keeps a thread's stored history bounded. After each turn the last
+    `keep_turns` turns stay verbatim, older turns are folded into a single
+    summary message (updated incrementally from the previous summary) and
+    long tool outputs are truncated, so every supervisor / agent call sees
+    a roughly constant number of input tokens.
+
+    The rewrite replaces every stored message, so it is only written if
+    the thread is still at the checkpoint it was computed from; a turn
+    checkpointed during the summariser call (from another worker, or a
+    resumed run) makes it skip, and the next turn compacts instead.
+    """
+
+    def __init__(self, summary_llm, keep_turns: int, fold_batch: int, tool_max_chars: int):
+        self.summary_llm = summary_llm
+        self.keep_turns = keep_turns
+        self.fold_batch = max(1, fold_batch)
+        self.tool_max_chars = tool_max_chars
+        self.compactions = 0
+        self.summaries = 0
+        self.stale_skips = 0
+
+    async def compact(self, graph, config: dict) -> bool:
+        """Rewrites the thread's messages if they outgrew the window. Returns True if state changed."""
+        state = await graph.aget_state(config)
+        messages: List[BaseMessage] = state.values.get("messages", [])
+        if not messages or state.next:
+            return False
+
+        summary: Optional[SystemMessage] = None
+        if messages[0].id == SUMMARY_MESSAGE_ID:
+            summary, messages = messages[0], messages[1:]
+
+        turns = _split_turns(messages)
+        fold: List[BaseMessage] = []
+        if len(turns) > self.keep_turns + self.fold_batch:
+            for turn in turns[: len(turns) - self.keep_turns]:
+                fold.extend(turn)
+            turns = turns[len(turns) - self.keep_turns:]
+
+        kept = [_truncate_tool_output(m, self.tool_max_chars) for turn in turns for m in turn]
+        truncated = any(new is not old for new, old in zip(kept, (m for turn in turns for m in turn)))
+        if not fold and not truncated:
+            return False
+
+        if fold:
+            try:
+                summary = await self._summarise(summary, fold)
+            except Exception as e:
+                # Keep the full history rather than lose it; the next turn retries
+                print(f"History summarisation failed for {config['configurable'].get('thread_id')}: {e}")
+                if not truncated:
+                    return False
+                kept = [_truncate_tool_output(m, self.tool_max_chars) for m in messages]
+
+        # Re-read right before the write: REMOVE_ALL would wipe anything checkpointed since the snapshot
+        latest = await graph.aget_state(config)
+        if _checkpoint_id(latest) != _checkpoint_id(state):
+            self.stale_skips += 1
+            print(f"History compaction skipped for {config['configurable'].get('thread_id')}: the thread moved on")
+            return False
+
+        new_messages = [RemoveMessage(id=REMOVE_ALL_MESSAGES)]
+        if summary is not None:
+            new_messages.append(summary)
+        new_messages.extend(kept)
+        await graph.aupdate_state(config, {"messages": new_messages}, as_node="supervisor")
+        self.compactions += 1
+        return True
+
+    async def _summarise(self, previous: Optional[SystemMessage], messages: List[BaseMessage]) -> SystemMessage:
+        previous_text = previous.content.split("\n", 1)[-1] if previous is not None else "(none)"
+        response = await self.summary_llm.ainvoke(summary_prompt.format(
+            max_words=HISTORY_SUMMARY_MAX_WORDS,
+            summary=previous_text,
+            transcript=_render(messages, self.tool_max_chars),
+        ))
+        self.summaries += 1
+        return SystemMessage(
+            content=f"Summary of the earlier conversation with this user:\n{response.content.strip()}",
+            id=SUMMARY_MESSAGE_ID,
+        )
+
+    def stats(self) -> dict:
+        return {"compactions": self.compactions, "summaries": self.summaries, "stale_skips": self.stale_skips}
+
+
+history_manager: Optional[HistoryManager] = None
+
+
+def init_history_manager(summary_llm) -> HistoryManager:
+    global history_manager
+    history_manager = HistoryManager(summary_llm, HISTORY_KEEP_TURNS, HISTORY_FOLD_BATCH, HISTORY_TOOL_MAX_CHARS)
+    return history_manager
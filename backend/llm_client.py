@@ -0,0 +1,309 @@
+import os
+import json
+import time
+import heapq
+import random
+import asyncio
+import itertools
+import importlib.util
+import threading
+from collections import Counter
+from typing import Dict, Optional
+
+import httpx
+from langchain_openai import ChatOpenAI
+
+# httpx negotiates HTTP/2 only when h2 is installed
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+# -------------------------------------------------------
+# Configuration
+# -------------------------------------------------------
+
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "50"))
+LLM_MAX_KEEPALIVE = int(os.getenv("LLM_MAX_KEEPALIVE", "20"))
+LLM_KEEPALIVE_SECONDS = float(os.getenv("LLM_KEEPALIVE_SECONDS", "60"))
+LLM_HTTP2 = os.getenv("LLM_HTTP2", "true").lower() == "true" and HTTP2_AVAILABLE
+# Per-process budgets (divide the account's limits by the number of workers); 0, the default, disables a budget
+LLM_RPM_LIMIT = int(os.getenv("LLM_RPM_LIMIT", "0"))
+LLM_TPM_LIMIT = int(os.getenv("LLM_TPM_LIMIT", "0"))
+# Completion tokens assumed when a request sets no max_tokens; providers count them against TPM up front
+LLM_EXPECTED_COMPLETION_TOKENS = int(os.getenv("LLM_EXPECTED_COMPLETION_TOKENS", "500"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+LLM_BACKOFF_BASE_SECONDS = float(os.getenv("LLM_BACKOFF_BASE_SECONDS", "0.5"))
+LLM_BACKOFF_MAX_SECONDS = float(os.getenv("LLM_BACKOFF_MAX_SECONDS", "20"))
+# Longest a provider's Retry-After may hold back this request (and, for a 429, every other caller)
+LLM_RETRY_AFTER_MAX_SECONDS = float(os.getenv("LLM_RETRY_AFTER_MAX_SECONDS", "30"))
+
+# Lower runs first: the supervisor gates every chat turn, agents answer it, summaries can wait
+PRIORITIES = {"supervisor": 0, "agent": 1, "background": 2}
+RETRY_STATUSES = {408, 409, 429, 500, 502, 503, 504}
+# Everything the OpenAI SDK itself retried before its retries were moved here; TimeoutException covers
+# connect, read, write and pool timeouts
+RETRY_ERRORS = (httpx.TimeoutException, httpx.ConnectError, httpx.ReadError, httpx.WriteError, httpx.RemoteProtocolError)
+
+
+class _Bucket:
+    """A budget per minute, refilled continuously."""
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.available = float(per_minute)
+        self.rate = per_minute / 60
+        self.updated = time.monotonic()
+
+    def refill(self, now: float) -> None:
+        self.available = min(self.capacity, self.available + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_for(self, amount: float) -> float:
+        # A request larger than the whole budget waits for a full bucket rather than forever
+        amount = min(amount, self.capacity)
+        return 0.0 if self.available >= amount else (amount - self.available) / self.rate
+
+
+class RateScheduler:
+    """
+    Shares request- and token-per-minute budgets between every LLM call in
+    the process. Callers wait in one queue ordered by priority, then arrival;
+    only the head may take from the buckets, so a large background request
+    cannot be starved and can never jump ahead of a supervisor call.
+
+    Both budgets are off unless configured. When they are on, the provider's
+    `x-ratelimit-remaining-*` headers reset the buckets to what the account
+    really has left (never above the configured budget), so neither a busy
+    account nor an over-estimate of request sizes drifts the buckets away
+    from the provider's view. A 429 pauses every caller for its
+    Retry-After, capped at LLM_RETRY_AFTER_MAX_SECONDS.
+    """
+
+    def __init__(self, rpm: int, tpm: int):
+        self._requests = _Bucket(rpm) if rpm > 0 else None
+        self._tokens = _Bucket(tpm) if tpm > 0 else None
+        self._waiters: list = []
+        self._sequence = itertools.count()
+        self._wake: Optional[asyncio.TimerHandle] = None
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+        self._counts: Counter = Counter()
+        self._wait_seconds: Dict[str, float] = Counter()
+
+    def _buckets(self):
+        return [bucket for bucket in (self._requests, self._tokens) if bucket is not None]
+
+    def _delay(self, tokens: float, now: float) -> float:
+        delay = max(0.0, self._paused_until - now)
+        if self._requests is not None:
+            delay = max(delay, self._requests.wait_for(1))
+        if self._tokens is not None:
+            delay = max(delay, self._tokens.wait_for(tokens))
+        return delay
+
+    def _take(self, tokens: float) -> None:
+        if self._requests is not None:
+            self._requests.available -= 1
+        if self._tokens is not None:
+            self._tokens.available -= min(tokens, self._tokens.capacity)
+
+    async def acquire(self, priority: str, tokens: float) -> None:
+        started = time.monotonic()
+        for bucket in self._buckets():
+            bucket.refill(started)
+        if not self._waiters and self._delay(tokens, started) == 0:
+            self._take(tokens)
+            self._record(priority, 0.0)
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        entry = (PRIORITIES.get(priority, len(PRIORITIES)), next(self._sequence), tokens, future)
+        heapq.heappush(self._waiters, entry)
+        self._drain()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if entry in self._waiters:
+                self._waiters.remove(entry)
+                heapq.heapify(self._waiters)
+                self._drain()
+            raise
+        self._record(priority, time.monotonic() - started)
+
+    def _drain(self) -> None:
+        if self._wake is not None:
+            self._wake.cancel()
+            self._wake = None
+        now = time.monotonic()
+        for bucket in self._buckets():
+            bucket.refill(now)
+        while self._waiters:
+            _, _, tokens, future = self._waiters[0]
+            if future.done():
+                heapq.heappop(self._waiters)
+                continue
+            delay = self._delay(tokens, now)
+            if delay > 0:
+                self._wake = asyncio.get_running_loop().call_later(delay, self._drain)
+                return
+            heapq.heappop(self._waiters)
+            self._take(tokens)
+            future.set_result(None)
+
+    def observe(self, headers: httpx.Headers) -> None:
+        """Syncs the buckets with the provider's view of the remaining budget, up or down."""
+        now = time.monotonic()
+        for bucket, header in ((self._requests, "x-ratelimit-remaining-requests"), (self._tokens, "x-ratelimit-remaining-tokens")):
+            value = headers.get(header)
+            if bucket is not None and value is not None and value.isdigit():
+                bucket.refill(now)
+                bucket.available = min(bucket.capacity, float(value))
+        if self._waiters:
+            self._drain()
+
+    def pause(self, seconds: float) -> None:
+        """Holds every caller back, e.g. for a 429's Retry-After."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._count("paused")
+
+    def record_retry(self, rate_limited: bool) -> None:
+        self._count("retried")
+        if rate_limited:
+            self._count("rate_limited")
+
+    def _record(self, priority: str, waited: float) -> None:
+        with self._lock:
+            self._counts[f"acquired.{priority}"] += 1
+            self._wait_seconds[priority] += waited
+
+    def _count(self, key: str) -> None:
+        with self._lock:
+            self._counts[key] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._counts)
+            for priority, waited in self._wait_seconds.items():
+                acquired = self._counts.get(f"acquired.{priority}", 0)
+                stats[f"wait_ms_avg.{priority}"] = round(waited / acquired * 1000, 2) if acquired else None
+        stats["waiting"] = len(self._waiters)
+        if self._requests is not None:
+            stats["requests_available"] = round(self._requests.available, 1)
+        if self._tokens is not None:
+            stats["tokens_available"] = round(self._tokens.available)
+        return stats
+
+
+def estimate_tokens(body: bytes) -> float:
+    """Prompt tokens (about four bytes each) plus the completion budget the request reserves."""
+    try:
+        payload = json.loads(body) if body else {}
+    except ValueError:
+        payload = {}
+    completion = payload.get("max_completion_tokens") or payload.get("max_tokens") or LLM_EXPECTED_COMPLETION_TOKENS
+    return len(body) / 4 + completion
+
+
+def _backoff(attempt: int) -> float:
+    """Exponential backoff with full jitter."""
+    return random.uniform(0, min(LLM_BACKOFF_MAX_SECONDS, LLM_BACKOFF_BASE_SECONDS * 2 ** attempt))
+
+
+def _retry_after(response: httpx.Response) -> Optional[float]:
+    for header in ("retry-after-ms", "retry-after"):
+        value = response.headers.get(header)
+        try:
+            if value is not None:
+                seconds = float(value) / (1000 if header == "retry-after-ms" else 1)
+                return min(max(seconds, 0.0), LLM_RETRY_AFTER_MAX_SECONDS)
+        except ValueError:
+            pass
+    return None
+
+
+class ScheduledTransport(httpx.AsyncBaseTransport):
+    """
+    Sends each request through the shared connection pool once the
+    scheduler admits it, retrying throttled and failed requests with
+    jittered backoff. Retries live here instead of in the OpenAI SDK so
+    that every attempt is scheduled and counted against the budgets.
+    """
+
+    def __init__(self, pool: httpx.AsyncBaseTransport, scheduler: RateScheduler, priority: str):
+        self._pool = pool
+        self._scheduler = scheduler
+        self.priority = priority
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        tokens = estimate_tokens(await request.aread())
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            await self._scheduler.acquire(self.priority, tokens)
+            last_attempt = attempt == LLM_MAX_RETRIES
+            try:
+                response = await self._pool.handle_async_request(request)
+            except RETRY_ERRORS:
+                if last_attempt:
+                    raise
+                self._scheduler.record_retry(False)
+                await asyncio.sleep(_backoff(attempt))
+                continue
+
+            self._scheduler.observe(response.headers)
+            if response.status_code not in RETRY_STATUSES or last_attempt:
+                return response
+
+            await response.aclose()
+            delay = _retry_after(response)
+            if delay is None:
+                delay = _backoff(attempt)
+            if response.status_code == 429:
+                self._scheduler.pause(delay)
+            self._scheduler.record_retry(response.status_code == 429)
+            await asyncio.sleep(delay)
+
+    async def aclose(self) -> None:
+        # The pool is shared between priorities and closed once, by close_llm_clients()
+        pass
+
+
+# -------------------------------------------------------
+# Shared clients
+# -------------------------------------------------------
+
+_limits = httpx.Limits(
+    max_connections=LLM_MAX_CONNECTIONS,
+    max_keepalive_connections=LLM_MAX_KEEPALIVE,
+    keepalive_expiry=LLM_KEEPALIVE_SECONDS,
+)
+llm_scheduler = RateScheduler(LLM_RPM_LIMIT, LLM_TPM_LIMIT)
+_async_pool = httpx.AsyncHTTPTransport(limits=_limits, http2=LLM_HTTP2)
+_async_clients: Dict[str, httpx.AsyncClient] = {}
+# Synchronous calls (rare: everything on the chat path is async) share their own pool and are not scheduled
+_sync_client = httpx.Client(limits=_limits, http2=LLM_HTTP2)
+
+
+def _async_client(priority: str) -> httpx.AsyncClient:
+    if priority not in _async_clients:
+        _async_clients[priority] = httpx.AsyncClient(transport=ScheduledTransport(_async_pool, llm_scheduler, priority))
+    return _async_clients[priority]
+
+
+def create_chat_model(priority: str = "agent", **kwargs) -> ChatOpenAI:
+    """A ChatOpenAI on the shared connection pool whose async calls go through the rate scheduler."""
+    if priority not in PRIORITIES:
+        raise ValueError(f"Unknown LLM priority {priority!r}; expected one of {sorted(PRIORITIES)}")
+    return ChatOpenAI(
+        http_client=_sync_client,
+        http_async_client=_async_client(priority),
+        max_retries=0,
+        **kwargs,
+    )
+
+
+async def close_llm_clients() -> None:
+    _sync_client.close()
+    await _async_pool.aclose()
+
+
+def llm_client_stats() -> dict:
+    stats = llm_scheduler.stats()
+    stats["http2"] = int(LLM_HTTP2)
+    return stats
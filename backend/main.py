@@ -1,33 +1,55 @@
 import os
 from dotenv import load_dotenv
-import json
+import time
+import asyncio
+import secrets
 from typing import List, Optional
 from uuid import uuid4
 from datetime import datetime, timedelta
 
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
 import models
 import schemas
-from database import get_db, engine
+from database import get_async_db, engine, async_engine
+from user_cache import user_cache, CachedUser
 
-from graph_setup import memory
-from langchain_openai import ChatOpenAI
+from graph_setup import open_checkpointer, close_checkpointer, prune_checkpoints
+from llm_client import create_chat_model, close_llm_clients, llm_client_stats
+from parallel_tools import configure_tool_executor, tool_step_limiter
 from langchain_nvidia_ai_endpoints import NVIDIAEmbeddings
-from langchain_core.messages import HumanMessage
+from langchain_core.messages import AIMessage, HumanMessage
 from langgraph_supervisor import create_supervisor
+from langgraph.types import Command
 
 from Agents.market_agent import init_market_agent, create_market_agent
 from Agents.RAG_agent import init_rag_agent, create_rag_agent
 from Agents.Planner_agent import init_planner_agent, create_planner_agent
-from Agents.tax_agent import init_tax_agent, create_tax_agent, store_bank_data
-
-from fastapi import FastAPI, Depends, HTTPException, status, UploadFile, File
-from fastapi.responses import StreamingResponse
+from Agents.tax_agent import init_tax_agent, create_tax_agent
+from profile_extractor import profile_tracker, save_profile_facts
+from upload_jobs import submit_upload_job, get_upload_job, UploadQueueFull
+from workers import get_process_pool, shutdown_process_pool
+from batch_tax import run_batch_async, to_csv, BATCH_MAX_FILES, BATCH_MAX_TOTAL_BYTES
+from batch_allocations import stream_batch_allocations, BATCH_ALLOCATION_CHUNK_SIZE
+from password_hashing import password_hasher, PasswordPoolBusy
+from history_manager import init_history_manager, HISTORY_SUMMARY_MODEL
+from chat_runs import chat_runs, stream_run, parse_event_id
+from answer_cache import answer_cache, is_shareable, ANSWER_CACHE_ENABLED, CACHEABLE_AGENT
+from pre_router import PRE_ROUTER_MODE, route_message, supervisor_choice, routing_stats
+from sse import stream_totals, format_event, ClosingStreamingResponse, HEARTBEAT, SSE_HEARTBEAT_SECONDS
+from admission import admission, AdmissionRejected, Ticket
+from statement_store import statement_store
+from market_data import market_data
+from Agents.tax_analysis import analysis_cache_stats
+import metrics
+from tracing import tracer, TurnTrace
+
+from fastapi import FastAPI, Depends, HTTPException, Request, status, UploadFile, File, Header
+from fastapi.responses import StreamingResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from jose import JWTError, jwt
-from passlib.context import CryptContext
 
 load_dotenv(dotenv_path=".env")
 
@@ -40,15 +62,21 @@ SECRET_KEY = os.getenv("SECRET_KEY", "a_super_secret_key_for_dev_please_change_m
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
 
 # --- Password and Token Utilities ---
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+# bcrypt runs on a bounded worker pool (see password_hashing.py) so it never blocks the event loop
+async def verify_password(plain_password, hashed_password):
+    try:
+        return await password_hasher.verify(plain_password, hashed_password)
+    except PasswordPoolBusy:
+        raise HTTPException(status_code=503, detail="Too many sign-in requests. Please try again shortly.")
 
-def get_password_hash(password):
-    return pwd_context.hash(password)
+async def get_password_hash(password):
+    try:
+        return await password_hasher.hash(password)
+    except PasswordPoolBusy:
+        raise HTTPException(status_code=503, detail="Too many sign-in requests. Please try again shortly.")
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
@@ -58,7 +86,8 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     return encoded_jwt
 
 # --- Dependency to get current user from JWT ---
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+async def get_current_user(request: Request, token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_async_db)):
+    started = time.perf_counter()
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -72,17 +101,49 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = De
     except JWTError:
         raise credentials_exception
     
-    user = db.query(models.User).filter(models.User.email == email).first()
-    if user is None:
-        raise credentials_exception
-    return user
+    cached = user_cache.get_by_email(email)
+    cache_hit = cached is not None
+    if cached is None:
+        user = (await db.execute(select(models.User).where(models.User.email == email))).scalars().first()
+        if user is None:
+            raise credentials_exception
+        cached = user_cache.put(user)
+
+    # Becomes the auth span of the chat turn's trace
+    request.state.auth_timing = (started, time.perf_counter(), cache_hit)
+    return cached
+
+
+# --- Dependency for advisor / batch endpoints ---
+BATCH_API_KEY = os.getenv("BATCH_API_KEY")
+
+async def require_batch_access(x_api_key: Optional[str] = Header(None)):
+    """Batch endpoints are keyed by BATCH_API_KEY and disabled when it is not set."""
+    if not BATCH_API_KEY:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Batch API is not enabled.")
+    if not x_api_key or not secrets.compare_digest(x_api_key, BATCH_API_KEY):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid API key.")
+
+# --- Dependency for /metrics ---
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+async def require_metrics_access(authorization: Optional[str] = Header(None)):
+    """/metrics takes `Authorization: Bearer <METRICS_TOKEN>` (Prometheus `bearer_token`) and is disabled when it is not set."""
+    if not METRICS_TOKEN:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Metrics are not enabled.")
+    scheme, _, token = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer" or not secrets.compare_digest(token.strip(), METRICS_TOKEN):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid metrics token.")
 
 
 # --- Initialize Agents and Supervisor ---
-rag_llm = ChatOpenAI(model='gpt-4o', temperature=0)
-market_llm = ChatOpenAI(model='gpt-4o', temperature=0)
-planner_llm = ChatOpenAI(model='gpt-4o', temperature=0.5)
-supervisor_llm = ChatOpenAI(model='gpt-4o', temperature=0)
+# stream_usage makes streamed calls report token counts, which feed /metrics.
+# All models share one connection pool and rate budget (see llm_client.py); the priority orders them when it runs low.
+rag_llm = create_chat_model("agent", model='gpt-4o', temperature=0, stream_usage=True)
+market_llm = create_chat_model("agent", model='gpt-4o', temperature=0, stream_usage=True)
+planner_llm = create_chat_model("agent", model='gpt-4o', temperature=0.5, stream_usage=True)
+supervisor_llm = create_chat_model("supervisor", model='gpt-4o', temperature=0, stream_usage=True)
+summary_llm = create_chat_model("background", model=HISTORY_SUMMARY_MODEL, temperature=0)
 embedding = NVIDIAEmbeddings(model="nvidia/llama-3.2-nv-embedqa-1b-v2")
 ZILLIZ_CLOUD_URI = os.getenv("ZILLIZ_CLOUD_URI")
 ZILLIZ_CLOUD_USERNAME = os.getenv("ZILLIZ_CLOUD_USERNAME")
@@ -92,6 +153,7 @@ init_rag_agent(rag_llm, embedding, ZILLIZ_CLOUD_URI, ZILLIZ_CLOUD_USERNAME, ZILL
 init_market_agent(market_llm)
 init_planner_agent(planner_llm)
 init_tax_agent(planner_llm) # Resuing planner_llm for simplicity
+history_manager = init_history_manager(summary_llm)
 
 rag_agent_obj = create_rag_agent()
 market_agent_obj = create_market_agent()
@@ -173,7 +235,7 @@ nivara_graph = create_supervisor(
     model=supervisor_llm,
     agents=[rag_agent_obj, market_agent_obj, planner_agent_obj, tax_agent_obj],
     prompt=supervisor_agent_prompt,
-).compile(name="nivara_supervisor", checkpointer=memory)
+).compile(name="nivara_supervisor")  # checkpointer attached on startup
 
 # --- FastAPI Application ---
 app = FastAPI(
@@ -187,33 +249,203 @@ app.add_middleware(
     allow_origins=["*"], allow_credentials=True, allow_methods=["*"], allow_headers=["*"],
 )
 
-async def generate_chat_response(message: str, thread_id: str):
+async def chat_events(message: str, thread_id: str, trace: TurnTrace):
+    """Runs one chat turn through the graph and yields the event payloads sent to the client."""
+    config = {"configurable": {"thread_id": thread_id}}
+    turn_started = time.perf_counter()
+
+    # Pick up age / risk tolerance once, at ingest, so the planner tool can read them from the profile
+    profile_facts = profile_tracker.observe_user_message(thread_id, message)
+    if profile_facts:
+        with trace.span("save_profile_facts", "db"):
+            await asyncio.to_thread(save_profile_facts, thread_id, profile_facts)
+
+    with trace.span("routing", "routing", mode=PRE_ROUTER_MODE) as routing:
+        predicted_agent = route_message(message)
+
+        # Self-contained educational questions share one answer across users; replay it without running the graph.
+        # On a miss the RAG agent answers from the question alone, so nothing from this thread can leak into the cache.
+        # This bypasses the supervisor, so it only happens when the pre-router is allowed to dispatch, and never for
+        # questions naming a listed company, whose answers belong to the market agent and go stale.
+        cacheable = (
+            ANSWER_CACHE_ENABLED
+            and PRE_ROUTER_MODE == "on"
+            and predicted_agent == CACHEABLE_AGENT
+            and is_shareable(message)
+            and not market_data.find_tickers(message)
+        )
+        cached_answer = answer_cache.get(message) if cacheable else None
+        routing["predicted"] = predicted_agent or "supervisor"
+        routing["answer_cache"] = ("hit" if cached_answer is not None else "miss") if cacheable else "skip"
+    if cached_answer is not None:
+        yield {"type": "content", "content": cached_answer}
+        # Keep the thread's history as if the agent had answered, for follow-up questions
+        await nivara_graph.aupdate_state(
+            config,
+            {"messages": [HumanMessage(content=message), AIMessage(content=cached_answer, name=CACHEABLE_AGENT)]},
+            as_node="supervisor",
+        )
+        profile_tracker.observe_assistant_reply(thread_id, cached_answer)
+        routing_stats.record(PRE_ROUTER_MODE, CACHEABLE_AGENT, CACHEABLE_AGENT, answer_cache="hit")
+        metrics.turn_latency.observe(time.perf_counter() - turn_started, "cached")
+        trace.finish("cached", agents=CACHEABLE_AGENT)
+        yield {"type": "end"}
+        return
+
+    # Rule-matched messages skip the supervisor's routing call and start at the agent
+    routed_to = predicted_agent if PRE_ROUTER_MODE in ("on", "shadow") and not cacheable else None
+    # On a thread with no checkpoint yet a Command input also fires START -> supervisor,
+    # which would run the supervisor next to the agent; the first turn goes through it instead
+    if routed_to and PRE_ROUTER_MODE == "on" and await nivara_graph.checkpointer.aget_tuple(config) is None:
+        routed_to = None
+    runner, run_config, entry = nivara_graph, config, "supervisor"
+    if cacheable:
+        runner, run_config, entry = rag_agent_obj, {}, f"{CACHEABLE_AGENT} (context-free)"
+        graph_input = {"messages": [HumanMessage(content=message)]}
+        agents_used = {CACHEABLE_AGENT}
+    elif routed_to and PRE_ROUTER_MODE == "on":
+        graph_input = Command(goto=routed_to, update={"messages": [HumanMessage(content=message)]})
+        agents_used = {routed_to}
+        entry = routed_to
+    else:
+        graph_input = {"messages": [HumanMessage(content=message)]}
+        agents_used = set()
+    supervisor_routed_to = None
+
+    reply_parts = []
+    final_output = None
+    tools_running = 0
+    observer = metrics.TurnObserver()
+    try:
+        with trace.span("graph", "graph", entry=entry):
+            async for event in runner.astream_events(graph_input, version="v2", config=run_config):
+                observer.observe(event)
+                trace.observe(event)
+                event_type = event["event"]
+                data = event["data"]
+                payload = {}
+                if event_type == "on_tool_start":
+                    tools_running += 1
+                    handoff = supervisor_choice(event["name"])
+                    if handoff:
+                        agents_used.add(handoff)
+                        supervisor_routed_to = supervisor_routed_to or handoff
+                    payload = {"type": "tool_start", "content": "Working..."}
+                elif event_type == "on_tool_end":
+                    tools_running -= 1
+                    payload = {"type": "tool_end"}
+                elif event_type == "on_chat_model_stream":
+                    chunk_content = data.get("chunk").content if hasattr(data.get("chunk"), 'content') else ""
+                    if chunk_content:
+                        payload = {"type": "content", "content": chunk_content}
+                        reply_parts.append(chunk_content)
+                elif event_type == "on_chain_end" and not event.get("parent_ids"):
+                    final_output = data.get("output")
+
+                if payload:
+                    yield payload
+    except asyncio.CancelledError:
+        # Cancelling the stream cancels the graph's node tasks; tools already on a worker thread run to completion unused
+        chat_runs.record_abandoned_tools(tools_running)
+        metrics.turn_latency.observe(time.perf_counter() - turn_started, "cancelled")
+        trace.finish("cancelled", agents=",".join(sorted(agents_used)) or None)
+        raise
+    except Exception as e:
+        metrics.turn_latency.observe(time.perf_counter() - turn_started, "failed")
+        trace.finish("failed", agents=",".join(sorted(agents_used)) or None, error=str(e)[:300])
+        raise
+    metrics.turn_latency.observe(time.perf_counter() - turn_started, "completed")
+    trace.finish("completed", agents=",".join(sorted(agents_used)) or None, supervisor_routed_to=supervisor_routed_to)
+
+    reply = "".join(reply_parts)
+    if cacheable:
+        # Only the agent's final message is stored, and it joins the thread's history as a cached answer would
+        answer = final_output["messages"][-1].content if final_output and final_output.get("messages") else ""
+        if answer:
+            await nivara_graph.aupdate_state(
+                config,
+                {"messages": [HumanMessage(content=message), AIMessage(content=answer, name=CACHEABLE_AGENT)]},
+                as_node="supervisor",
+            )
+            answer_cache.put(message, answer)
+        reply = answer or reply
+    profile_tracker.observe_assistant_reply(thread_id, reply)
+    if cacheable:
+        routing_stats.record(PRE_ROUTER_MODE, CACHEABLE_AGENT, CACHEABLE_AGENT, answer_cache="miss")
+    elif PRE_ROUTER_MODE in ("on", "shadow"):
+        routing_stats.record(PRE_ROUTER_MODE, routed_to, routed_to if PRE_ROUTER_MODE == "on" else supervisor_routed_to)
+    yield {"type": "end"}
+
+async def after_chat_turn(thread_id: str):
+    """History compaction and checkpoint retention, run after the client has its answer."""
     config = {"configurable": {"thread_id": thread_id}}
-    async for event in nivara_graph.astream_events({"messages": [HumanMessage(content=message)]}, version="v2", config=config):
-        event_type = event["event"]
-        data = event["data"]
-        payload = {}
-        if event_type == "on_tool_start":
-            payload = {"type": "tool_start", "content": "Working..."}
-        elif event_type == "on_tool_end":
-            payload = {"type": "tool_end"}
-        elif event_type == "on_chat_model_stream":
-            chunk_content = data.get("chunk").content if hasattr(data.get("chunk"), 'content') else ""
-            if chunk_content:
-                payload = {"type": "content", "content": chunk_content}
-        
-        if payload:
-            yield f"data: {json.dumps(payload)}\n\n"
-            
-    yield f"data: {json.dumps({'type': 'end'})}\n\n"
+    try:
+        await history_manager.compact(nivara_graph, config)
+    except Exception as e:
+        print(f"History compaction failed for thread {thread_id}: {e}")
+    try:
+        await prune_checkpoints(thread_id)
+    except Exception as e:
+        print(f"Checkpoint pruning failed for thread {thread_id}: {e}")
+
+async def generate_chat_response(http_request: Request, message: str, thread_id: str, ticket: Ticket):
+    """
+    SSE body for /chat-stream. The turn first waits for an admission slot
+    (see admission.py), reporting its queue position, then runs as its own
+    task (see chat_runs.py): a dropped client can reattach through
+    /chat-stream/resume, a run nobody reattaches to is cancelled, and a newer
+    message on the same thread preempts it.
+    """
+    # The trace starts with authentication, so the waterfall covers the whole request
+    auth_timing = getattr(http_request.state, "auth_timing", None)
+    trace = tracer.start_turn(thread_id, started=auth_timing[0] if auth_timing else None)
+    if auth_timing:
+        trace.add_span("auth", "auth", auth_timing[0], auth_timing[1], user_cache="hit" if auth_timing[2] else "miss")
+
+    # Quotes for any ticker the message names load while the turn queues and the supervisor routes it
+    prefetched = market_data.prefetch(message)
+    if prefetched:
+        trace.root["attributes"]["prefetch"] = ",".join(prefetched)
+
+    run = None
+    try:
+        if not ticket.admitted:
+            queued_at = time.perf_counter()
+            try:
+                async for position in ticket.wait(SSE_HEARTBEAT_SECONDS):
+                    yield HEARTBEAT if position is None else format_event({"type": "queued", "position": position})
+            except TimeoutError:
+                admission.record_timeout()
+                yield format_event({"type": "cancelled", "reason": "queue_timeout"})
+                return
+            finally:
+                metrics.chat_queue_wait.observe(time.perf_counter() - queued_at)
+                trace.add_span("admission_queue", "queue", queued_at, time.perf_counter())
+        if ticket.superseded:
+            yield format_event({"type": "cancelled", "reason": "preempted"})
+            return
+
+        run = await chat_runs.start(thread_id, chat_events(message, thread_id, trace), after=lambda: after_chat_turn(thread_id))
+        # The slot is held until the run, including its history upkeep, is over
+        ticket.run = run
+        run.task.add_done_callback(lambda _task: ticket.release())
+        if ticket.superseded:
+            run.cancel("preempted")
+    finally:
+        if run is None:
+            ticket.release()
+
+    trace.root["attributes"]["run_id"] = run.run_id
+    async for frame in stream_run(http_request, run):
+        yield frame
 
 @app.post("/signup", response_model=schemas.Token)
-async def signup(user: schemas.UserCreate, db: Session = Depends(get_db)):
-    db_user = db.query(models.User).filter(models.User.email == user.email).first()
+async def signup(user: schemas.UserCreate, db: AsyncSession = Depends(get_async_db)):
+    db_user = (await db.execute(select(models.User).where(models.User.email == user.email))).scalars().first()
     if db_user:
         raise HTTPException(status_code=400, detail="Email already registered")
     
-    hashed_password = get_password_hash(user.password)
+    hashed_password = await get_password_hash(user.password)
     # **NEW**: Generate a unique thread_id for the new user
     thread_id = str(uuid4())
     
@@ -224,17 +456,17 @@ async def signup(user: schemas.UserCreate, db: Session = Depends(get_db)):
         thread_id=thread_id
     )
     db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    await db.commit()
+    await db.refresh(new_user)
     
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(data={"sub": new_user.email}, expires_delta=access_token_expires)
     return {"access_token": access_token, "token_type": "bearer"}
 
 @app.post("/login", response_model=schemas.Token)
-async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = db.query(models.User).filter(models.User.email == form_data.username).first()
-    if not user or not verify_password(form_data.password, user.hashed_password):
+async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_async_db)):
+    user = (await db.execute(select(models.User).where(models.User.email == form_data.username))).scalars().first()
+    if not user or not await verify_password(form_data.password, user.hashed_password):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
@@ -247,43 +479,196 @@ async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session =
 
 # --- Protected Chat Endpoint ---
 @app.post("/chat-stream")
-async def chat_stream(request: schemas.ChatRequest, current_user: models.User = Depends(get_current_user)):
+async def chat_stream(request: schemas.ChatRequest, http_request: Request, current_user: CachedUser = Depends(get_current_user)):
     # Use the user's persistent thread_id from the database
     thread_id = current_user.thread_id
+    try:
+        ticket = admission.admit(thread_id)
+    except AdmissionRejected as e:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="The assistant is busy right now. Please try again in a few seconds.",
+            headers={"Retry-After": str(e.retry_after)},
+        )
+    # The response owns the ticket: if the client leaves before the body starts, the generator never runs
+    return ClosingStreamingResponse(
+        generate_chat_response(http_request, request.message, thread_id, ticket),
+        on_close=ticket.release_unless_running,
+        media_type="text/event-stream"
+    )
+
+@app.get("/chat-stream/resume")
+async def resume_chat_stream(
+    http_request: Request,
+    last_event_id: Optional[str] = Header(None),
+    current_user: CachedUser = Depends(get_current_user),
+):
+    """
+    Reattaches to the thread's latest chat run: replays the frames after
+    `Last-Event-ID` from the run's buffer, then follows it live. Without
+    the header the run is replayed from the start.
+
+    The buffer lives in the worker that runs the turn, so with several
+    workers this needs sticky routing per user (see chat_runs.py).
+    """
+    run = chat_runs.get(current_user.thread_id)
+    event_id = parse_event_id(last_event_id)
+    if run is None or (event_id is not None and event_id[0] != run.run_id):
+        chat_runs.record_resume(False)
+        raise HTTPException(status_code=404, detail="No chat stream to resume for this conversation.")
+
+    chat_runs.record_resume(True)
     return StreamingResponse(
-        generate_chat_response(request.message, thread_id),
+        stream_run(http_request, run, after_seq=event_id[1] if event_id else 0),
         media_type="text/event-stream"
     )
 
 # --- CSV File Upload for Tax Agent ---
-import pandas as pd
-import io
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(20 * 1024 * 1024)))
 
-@app.post("/upload-bank-statement")
+@app.post("/upload-bank-statement", status_code=status.HTTP_202_ACCEPTED)
 async def upload_bank_statement(
     file: UploadFile = File(...), 
-    current_user: models.User = Depends(get_current_user)
+    append: bool = False,
+    current_user: CachedUser = Depends(get_current_user)
 ):
-    """Endpoint to upload a CSV bank statement and store the pandas dataframe in memory keyed by thread_id."""
+    """
+    Endpoint to upload a CSV bank statement. The file is accepted immediately and
+    parsed, validated and stored in the background; poll the returned `status_url`.
+
+    Pass `append=true` to add a further (e.g. monthly) statement to the existing one;
+    transactions already uploaded are skipped instead of being double-counted.
+    """
     if not file.filename.endswith('.csv'):
         raise HTTPException(status_code=400, detail="Only CSV files are supported.")
     
+    content = await file.read()
+    if len(content) > MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail=f"File too large. The limit is {MAX_UPLOAD_BYTES // (1024 * 1024)} MB.")
+
     try:
+        job = submit_upload_job(current_user.thread_id, file.filename, content, append)
+    except UploadQueueFull:
+        raise HTTPException(status_code=503, detail="Too many uploads are being processed. Please try again shortly.")
+
+    return {
+        "job_id": job.job_id,
+        "filename": file.filename,
+        "status": job.status,
+        "status_url": f"/upload-bank-statement/{job.job_id}",
+        "message": "Bank statement received and is being processed.",
+    }
+
+@app.get("/upload-bank-statement/{job_id}")
+async def upload_bank_statement_status(job_id: str, current_user: CachedUser = Depends(get_current_user)):
+    """Progress and row counts of a bank statement upload."""
+    job = get_upload_job(job_id)
+    if job is None or job["thread_id"] != current_user.thread_id:
+        raise HTTPException(status_code=404, detail="Upload job not found.")
+
+    job = {key: value for key, value in job.items() if key != "thread_id"}
+    if job["status"] == "done":
+        job["message"] = "Successfully uploaded and parsed bank statement. You can now prompt the chatbot to analyze your tax recommendations."
+    elif job["status"] == "failed":
+        job["message"] = f"Error parsing CSV: {job['error']}"
+    return job
+
+# --- Batch Tax Analysis for Advisors ---
+@app.post("/tax/batch-analysis", dependencies=[Depends(require_batch_access)])
+async def batch_tax_analysis(
+    files: List[UploadFile] = File(...),
+    format: str = "json",
+    include_transactions: bool = False,
+):
+    """
+    Runs the deterministic 80C/80D analysis over many client statements at once,
+    without involving the LLM. Each file name (without .csv) is used as the client id.
+    Returns a JSON list of per-client reports, or one CSV row per client and section.
+    """
+    if format not in ("json", "csv"):
+        raise HTTPException(status_code=400, detail="format must be 'json' or 'csv'.")
+    if len(files) > BATCH_MAX_FILES:
+        raise HTTPException(status_code=413, detail=f"At most {BATCH_MAX_FILES} statements per batch.")
+
+    batch_too_large = HTTPException(
+        status_code=413, detail=f"The batch is too large. The limit is {BATCH_MAX_TOTAL_BYTES // (1024 * 1024)} MB in total."
+    )
+    items = []
+    total_bytes = 0
+    for file in files:
+        # The multipart parser has spooled the files to disk; check the running total before
+        # reading each one into memory, so an oversized batch is refused without loading the rest
+        if file.size is not None and total_bytes + file.size > BATCH_MAX_TOTAL_BYTES:
+            raise batch_too_large
         content = await file.read()
-        df = pd.read_csv(io.BytesIO(content))
-        
-        # Store in memory using thread_id as the key
-        thread_id = current_user.thread_id
-        store_bank_data(thread_id, df)
-        
-        return {"filename": file.filename, "message": "Successfully uploaded and parsed bank statement. You can now prompt the chatbot to analyze your tax recommendations.", "rows": len(df)}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error parsing CSV: {str(e)}")
+        if len(content) > MAX_UPLOAD_BYTES:
+            raise HTTPException(status_code=413, detail=f"{file.filename} is too large.")
+        total_bytes += len(content)
+        if total_bytes > BATCH_MAX_TOTAL_BYTES:
+            raise batch_too_large
+        items.append((os.path.splitext(file.filename or f"client_{len(items)}")[0], content))
+
+    results = await run_batch_async(items, get_process_pool(), include_transactions)
+
+    if format == "csv":
+        return Response(content=to_csv(results), media_type="text/csv")
+    return {"count": len(results), "failed": sum(1 for r in results if r["status"] != "ok"), "results": results}
+
+# --- Batch Allocations over the Planner Model ---
+@app.get("/planner/batch-allocations", dependencies=[Depends(require_batch_access)])
+def batch_allocations(chunk_size: int = BATCH_ALLOCATION_CHUNK_SIZE):
+    """
+    Streams planner allocations for every user as NDJSON, for advisors and the
+    nightly rebalancing job. The last line is a summary with throughput metrics.
+    """
+    if not 1 <= chunk_size <= 10000:
+        raise HTTPException(status_code=400, detail="chunk_size must be between 1 and 10000.")
+    return StreamingResponse(stream_batch_allocations(chunk_size), media_type="application/x-ndjson")
+
+# --- Metrics ---
+
+metrics.instrument_engine(engine, "sync")
+metrics.instrument_engine(async_engine.sync_engine, "async")
+for _name, _stats in {
+    "user_cache": user_cache.stats,
+    "answer_cache": answer_cache.stats,
+    "routing": routing_stats.stats,
+    "chat_runs": chat_runs.stats,
+    "streams": stream_totals.stats,
+    "password_hasher": password_hasher.stats,
+    "history": history_manager.stats,
+    "statement_store": statement_store.stats,
+    "tax_analysis_cache": analysis_cache_stats,
+    "tracing": tracer.stats,
+    "admission": admission.stats,
+    "llm_client": llm_client_stats,
+    "tool_steps": tool_step_limiter.stats,
+    "market_data": market_data.stats,
+}.items():
+    metrics.register_component(_name, _stats)
+
+@app.get("/metrics", dependencies=[Depends(require_metrics_access)])
+def read_metrics():
+    """Prometheus text exposition of agent, LLM, tool and DB latencies plus component counters."""
+    return Response(content=metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.on_event("startup")
+async def start_checkpointer():
+    configure_tool_executor()
+    nivara_graph.checkpointer = await open_checkpointer()
+
+@app.on_event("shutdown")
+async def stop_background_workers():
+    shutdown_process_pool()
+    password_hasher.shutdown()
+    await close_checkpointer()
+    await close_llm_clients()
+    tracer.close()
 
 # --- Add this new endpoint to your main.py file ---
 
 @app.get("/users/me", response_model=schemas.User)
-async def read_users_me(current_user: models.User = Depends(get_current_user)):
+async def read_users_me(current_user: CachedUser = Depends(get_current_user)):
     """
     Get the current logged-in user's profile information.
     """
@@ -292,8 +677,8 @@ async def read_users_me(current_user: models.User = Depends(get_current_user)):
 @app.put("/users/me", response_model=schemas.User)
 async def update_user_profile(
     profile_data: schemas.UserProfileUpdate,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
+    db: AsyncSession = Depends(get_async_db),
+    current_user: CachedUser = Depends(get_current_user)
 ):
     """
     Update the current logged-in user's profile information.
@@ -304,17 +689,23 @@ async def update_user_profile(
 
     update_data = profile_data.model_dump(exclude_unset=True)
 
+    # current_user is a cached snapshot; load the row itself to update it.
+    user = await db.get(models.User, current_user.id)
+    if user is None:
+        raise HTTPException(status_code=404, detail="User not found.")
+
     # Iterate over the provided data and update the user model attributes.
     for key, value in update_data.items():
-        setattr(current_user, key, value)
+        setattr(user, key, value)
     
     # Add the updated user object to the session and commit the transaction.
-    db.add(current_user)
-    db.commit()
+    db.add(user)
+    await db.commit()
     # Refresh the object to get the latest data from the database.
-    db.refresh(current_user)
+    await db.refresh(user)
     
-    return current_user
+    # Replace the cached snapshot so auth and agent tools see the new profile
+    return user_cache.put(user)
 
 @app.get("/")
 def read_root():
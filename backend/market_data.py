@@ -0,0 +1,264 @@
+import os
+import re
+import json
+import time
+import asyncio
+import threading
+from collections import Counter, OrderedDict
+from concurrent.futures import Future
+from typing import Dict, List, Tuple
+
+import yfinance as yf
+
+# -------------------------------------------------------
+# Configuration
+# -------------------------------------------------------
+
+MARKET_CACHE_MAX_ENTRIES = int(os.getenv("MARKET_CACHE_MAX_ENTRIES", "2000"))
+# Quotes go stale quickly; an ISIN only tells whether the ticker exists
+MARKET_INFO_TTL_SECONDS = float(os.getenv("MARKET_INFO_TTL_SECONDS", "60"))
+MARKET_ISIN_TTL_SECONDS = float(os.getenv("MARKET_ISIN_TTL_SECONDS", str(24 * 3600)))
+
+# Warm the cache for tickers named in a chat message while the supervisor is still routing it
+MARKET_PREFETCH_ENABLED = os.getenv("MARKET_PREFETCH_ENABLED", "true").lower() == "true"
+MARKET_PREFETCH_MAX_TICKERS = int(os.getenv("MARKET_PREFETCH_MAX_TICKERS", "3"))
+# Prefetches running at once across all turns; beyond this a ticker is left to the agent
+MARKET_PREFETCH_MAX_IN_FLIGHT = int(os.getenv("MARKET_PREFETCH_MAX_IN_FLIGHT", "8"))
+# Optional JSON object of extra {"company name or bare symbol": "TICKER.NS"} entries
+MARKET_SYMBOL_INDEX_PATH = os.getenv("MARKET_SYMBOL_INDEX_PATH")
+
+# -------------------------------------------------------
+# Ticker detection
+# -------------------------------------------------------
+
+# Explicit exchange tickers, as the agent is told to use them: RELIANCE.NS, HDFCBANK.BO, ^NSEI
+_EXPLICIT_TICKER = re.compile(r"(?:\b[A-Z0-9&-]{2,20}\.(?:NS|BO)\b|\^[A-Z]{3,10}\b)", re.I)
+
+# NIFTY 50 symbols, matched only when written in capitals ("ITC", "LT") so ordinary words are not taken for tickers
+_NSE_SYMBOLS = (
+    "ADANIENT", "ADANIPORTS", "APOLLOHOSP", "ASIANPAINT", "AXISBANK", "BAJAJ-AUTO", "BAJAJFINSV", "BAJFINANCE",
+    "BEL", "BHARTIARTL", "CIPLA", "COALINDIA", "DRREDDY", "EICHERMOT", "GRASIM", "HCLTECH", "HDFCBANK", "HDFCLIFE",
+    "HEROMOTOCO", "HINDALCO", "HINDUNILVR", "ICICIBANK", "INDUSINDBK", "INFY", "ITC", "JSWSTEEL", "KOTAKBANK", "LT",
+    "M&M", "MARUTI", "NESTLEIND", "NTPC", "ONGC", "POWERGRID", "RELIANCE", "SBILIFE", "SBIN", "SHRIRAMFIN",
+    "SUNPHARMA", "TATACONSUM", "TATAMOTORS", "TATASTEEL", "TCS", "TECHM", "TITAN", "TRENT", "ULTRACEMCO", "WIPRO",
+)
+
+# Company and index names as users write them, matched case-insensitively
+_NAME_INDEX = {
+    "reliance industries": "RELIANCE.NS", "reliance": "RELIANCE.NS",
+    "tata consultancy services": "TCS.NS", "infosys": "INFY.NS", "wipro": "WIPRO.NS",
+    "hcl technologies": "HCLTECH.NS", "tech mahindra": "TECHM.NS",
+    "hdfc bank": "HDFCBANK.NS", "icici bank": "ICICIBANK.NS", "state bank of india": "SBIN.NS",
+    "kotak mahindra bank": "KOTAKBANK.NS", "axis bank": "AXISBANK.NS", "indusind bank": "INDUSINDBK.NS",
+    "bajaj finance": "BAJFINANCE.NS", "bharti airtel": "BHARTIARTL.NS", "airtel": "BHARTIARTL.NS",
+    "larsen & toubro": "LT.NS", "larsen and toubro": "LT.NS", "hindustan unilever": "HINDUNILVR.NS",
+    "asian paints": "ASIANPAINT.NS", "maruti suzuki": "MARUTI.NS", "tata motors": "TATAMOTORS.NS",
+    "tata steel": "TATASTEEL.NS", "mahindra & mahindra": "M&M.NS", "sun pharma": "SUNPHARMA.NS",
+    "dr reddy's": "DRREDDY.NS", "nestle india": "NESTLEIND.NS", "ultratech cement": "ULTRACEMCO.NS",
+    "coal india": "COALINDIA.NS", "power grid": "POWERGRID.NS", "adani enterprises": "ADANIENT.NS",
+    "adani ports": "ADANIPORTS.NS", "titan": "TITAN.NS",
+    "nifty 50": "^NSEI", "nifty": "^NSEI", "bank nifty": "^NSEBANK", "sensex": "^BSESN",
+}
+
+
+def _load_name_index() -> Dict[str, str]:
+    index = dict(_NAME_INDEX)
+    if MARKET_SYMBOL_INDEX_PATH:
+        try:
+            with open(MARKET_SYMBOL_INDEX_PATH, encoding="utf-8") as f:
+                index.update({name.lower(): ticker.upper() for name, ticker in json.load(f).items()})
+        except (OSError, ValueError, AttributeError) as e:
+            print(f"Market data: could not load symbol index {MARKET_SYMBOL_INDEX_PATH}: {e}")
+    return index
+
+
+def _alternation(words) -> str:
+    # Longest first, so "bank nifty" wins over "nifty"
+    return "|".join(re.escape(word) for word in sorted(words, key=len, reverse=True))
+
+
+_name_index = _load_name_index()
+_NAMES = re.compile(rf"(?<![\w&-])(?:{_alternation(_name_index)})(?![\w&-])", re.I)
+_SYMBOLS = re.compile(rf"(?<![\w&.^-])(?:{_alternation(_NSE_SYMBOLS)})(?![\w&-]|\.\w)")
+
+
+def find_tickers(message: str) -> List[str]:
+    """Tickers a message refers to, in order of first mention: explicit ones, then symbols and names from the index."""
+    found: List[Tuple[int, str]] = [(m.start(), m.group(0).upper()) for m in _EXPLICIT_TICKER.finditer(message)]
+    found += [(m.start(), f"{m.group(0)}.NS") for m in _SYMBOLS.finditer(message)]
+    found += [(m.start(), _name_index[m.group(0).lower()]) for m in _NAMES.finditer(message)]
+    return list(dict.fromkeys(ticker for _, ticker in sorted(found)))
+
+
+# -------------------------------------------------------
+# Cache
+# -------------------------------------------------------
+
+_FETCHERS = {
+    "isin": lambda company: company.isin,
+    "info": lambda company: company.info,
+}
+_TTLS = {"isin": MARKET_ISIN_TTL_SECONDS, "info": MARKET_INFO_TTL_SECONDS}
+
+
+class _Entry:
+    __slots__ = ("future", "expires", "prefetched", "used")
+
+    def __init__(self, prefetched: bool):
+        self.future: Future = Future()
+        self.expires = float("inf")  # set once the fetch completes
+        self.prefetched = prefetched
+        self.used = False
+
+
+class MarketDataCache:
+    """
+    TTL + LRU cache of Yahoo Finance lookups (ISIN and info/quote) shared by
+    the market tools. A lookup already in flight is joined rather than
+    repeated, so an agent tool call that arrives while the prefetcher is
+    still fetching the same ticker waits for that request. Failed lookups
+    are not cached.
+
+    `prefetch(message)` starts those lookups for the tickers a chat message
+    names, in the loop's default executor, before the supervisor has decided
+    to hand off to the market agent. It is bounded per message and across
+    turns; `stats()` reports how many prefetches a tool went on to use.
+    """
+
+    def __init__(self, max_entries: int, max_tickers: int, max_in_flight: int):
+        self.max_entries = max_entries
+        self.max_tickers = max_tickers
+        self.max_in_flight = max_in_flight
+        self._entries: "OrderedDict[Tuple[str, str], _Entry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._counts: Counter = Counter()
+        self._prefetching = 0
+
+    def isin(self, ticker: str):
+        return self.get("isin", ticker)
+
+    def info(self, ticker: str) -> dict:
+        return self.get("info", ticker)
+
+    def get(self, kind: str, ticker: str):
+        """Returns the cached value, waits for a lookup in flight, or fetches it. Blocking: call from a worker thread."""
+        key = (kind, ticker.strip().upper())
+        entry, owner = self._claim(key, prefetched=False)
+        if owner:
+            self._fill(key, entry)
+        return entry.future.result()
+
+    def _claim(self, key: Tuple[str, str], prefetched: bool) -> Tuple[_Entry, bool]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires < now:
+                self._drop(key)
+                entry = None
+            if entry is None:
+                entry = self._entries[key] = _Entry(prefetched)
+                while len(self._entries) > self.max_entries:
+                    self._drop(next(iter(self._entries)))
+                self._counts["prefetch_lookups" if prefetched else "misses"] += 1
+                return entry, True
+
+            self._entries.move_to_end(key)
+            if not prefetched:
+                self._counts["hits" if entry.future.done() else "joined"] += 1
+                if entry.prefetched and not entry.used:
+                    self._counts["prefetch_used"] += 1
+                entry.used = True
+            return entry, False
+
+    def _fill(self, key: Tuple[str, str], entry: _Entry) -> None:
+        kind, ticker = key
+        try:
+            value = _FETCHERS[kind](yf.Ticker(ticker))
+        except Exception as e:
+            with self._lock:
+                if self._entries.get(key) is entry:
+                    del self._entries[key]
+                self._counts["fetch_errors"] += 1
+            entry.future.set_exception(e)
+            return
+        entry.expires = time.monotonic() + _TTLS[kind]
+        entry.future.set_result(value)
+
+    def _drop(self, key: Tuple[str, str]) -> None:
+        # Caller holds self._lock
+        entry = self._entries.pop(key)
+        if entry.prefetched and not entry.used:
+            self._counts["prefetch_wasted"] += 1
+
+    # -------------------------------------------------------
+    # Prefetch
+    # -------------------------------------------------------
+
+    def prefetch(self, message: str) -> List[str]:
+        """Starts background lookups for the tickers in `message`; returns the tickers it started. Call on the event loop."""
+        if not MARKET_PREFETCH_ENABLED:
+            return []
+        tickers = find_tickers(message)
+        if not tickers:
+            return []
+        started = []
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            self._counts["messages_with_tickers"] += 1
+            self._counts["prefetch_skipped_budget"] += max(0, len(tickers) - self.max_tickers)
+            for ticker in tickers[:self.max_tickers]:
+                entry = self._entries.get(("info", ticker))
+                if entry is not None and entry.expires >= time.monotonic():
+                    self._counts["prefetch_skipped_cached"] += 1
+                elif self._prefetching >= self.max_in_flight:
+                    self._counts["prefetch_skipped_budget"] += 1
+                else:
+                    self._prefetching += 1
+                    self._counts["prefetch_started"] += 1
+                    started.append(ticker)
+        for ticker in started:
+            loop.run_in_executor(None, self._prefetch_ticker, ticker)
+        return started
+
+    def _prefetch_ticker(self, ticker: str) -> None:
+        try:
+            # Claim both lookups up front, so a tool asking for either joins this prefetch instead of repeating it
+            isin_key, info_key = ("isin", ticker), ("info", ticker)
+            isin_entry, owns_isin = self._claim(isin_key, prefetched=True)
+            info_entry, owns_info = self._claim(info_key, prefetched=True)
+            if owns_isin:
+                self._fill(isin_key, isin_entry)
+            # Every market tool checks the ISIN first; info is only worth fetching for a real ticker
+            exists = self._result(isin_key, isin_entry) is not None
+            if owns_info and exists:
+                self._fill(info_key, info_entry)
+            elif owns_info:
+                with self._lock:
+                    if self._entries.get(info_key) is info_entry:
+                        del self._entries[info_key]
+                info_entry.future.set_exception(LookupError(f"{ticker} not found"))
+        finally:
+            with self._lock:
+                self._prefetching -= 1
+
+    @staticmethod
+    def _result(key: Tuple[str, str], entry: _Entry):
+        try:
+            return entry.future.result()
+        except Exception as e:
+            print(f"Market prefetch of {key[1]} ({key[0]}) failed: {e}")
+            return None
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._counts)
+            stats["entries"] = len(self._entries)
+            stats["prefetch_in_flight"] = self._prefetching
+        lookups = stats.get("hits", 0) + stats.get("joined", 0) + stats.get("misses", 0)
+        stats["hit_rate"] = round((stats.get("hits", 0) + stats.get("joined", 0)) / lookups, 3) if lookups else None
+        prefetched = stats.get("prefetch_lookups", 0)
+        stats["prefetch_use_rate"] = round(stats.get("prefetch_used", 0) / prefetched, 3) if prefetched else None
+        return stats
+
+
+market_data = MarketDataCache(MARKET_CACHE_MAX_ENTRIES, MARKET_PREFETCH_MAX_TICKERS, MARKET_PREFETCH_MAX_IN_FLIGHT)
@@ -0,0 +1,269 @@
+import time
+import asyncio
+import functools
+import threading
+from collections import defaultdict
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+# -------------------------------------------------------
+# Minimal Prometheus text-format registry
+# -------------------------------------------------------
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+AGENT_NAMES = ("supervisor", "RAG_agent", "market_agent", "planner_agent", "tax_agent")
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: LabelValues, extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()):
+        self.name, self.help_text, self.label_names = name, help_text, tuple(labels)
+        self._values: Dict[LabelValues, float] = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, *labels: str) -> None:
+        with self._lock:
+            self._values[tuple(labels)] += amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.label_names, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name, self.help_text, self.label_names = name, help_text, tuple(labels)
+        self.buckets = tuple(buckets)
+        # labels -> [count per bucket..., +Inf count, sum]
+        self._values: Dict[LabelValues, List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels: str) -> None:
+        with self._lock:
+            series = self._values.get(labels)
+            if series is None:
+                series = self._values[labels] = [0.0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += 1
+            series[-1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for labels, series in sorted(self._values.items()):
+                for bound, count in zip(self.buckets, series):
+                    le = f'le="{bound}"'
+                    lines.append(f"{self.name}_bucket{_labels(self.label_names, labels, le)} {count}")
+                le = 'le="+Inf"'
+                lines.append(f"{self.name}_bucket{_labels(self.label_names, labels, le)} {series[-2]}")
+                lines.append(f"{self.name}_count{_labels(self.label_names, labels)} {series[-2]}")
+                lines.append(f"{self.name}_sum{_labels(self.label_names, labels)} {series[-1]}")
+        return lines
+
+
+# -------------------------------------------------------
+# Metrics
+# -------------------------------------------------------
+
+agent_latency = Histogram("nivara_agent_duration_seconds", "Time spent in each agent hop of a chat turn.", ["agent"])
+agent_errors = Counter("nivara_agent_errors_total", "Agent hops that raised.", ["agent"])
+llm_latency = Histogram("nivara_llm_duration_seconds", "LLM call latency by calling agent and model.", ["agent", "model"])
+llm_first_token = Histogram("nivara_llm_first_token_seconds", "Time to first streamed token per LLM call.", ["agent", "model"])
+llm_tokens = Counter("nivara_llm_tokens_total", "LLM token usage.", ["agent", "model", "kind"])
+llm_errors = Counter("nivara_llm_errors_total", "LLM calls that raised.", ["agent", "model"])
+tool_latency = Histogram("nivara_tool_duration_seconds", "Tool call latency.", ["tool"])
+tool_errors = Counter("nivara_tool_errors_total", "Tool calls that raised or returned an error result.", ["tool"])
+db_latency = Histogram("nivara_db_query_duration_seconds", "SQL statement latency.", ["engine"])
+turn_latency = Histogram("nivara_chat_turn_duration_seconds", "Whole chat turn latency.", ["outcome"])
+chat_queue_wait = Histogram("nivara_chat_queue_wait_seconds", "Time chat turns waited for an admission slot.")
+
+_REGISTRY = [
+    agent_latency, agent_errors, llm_latency, llm_first_token, llm_tokens, llm_errors,
+    tool_latency, tool_errors, db_latency, turn_latency, chat_queue_wait,
+]
+
+# Components exposing a stats() dict (caches, pools, stream counters), rendered as gauges
+_components: Dict[str, Callable[[], dict]] = {}
+
+
+def register_component(name: str, stats: Callable[[], dict]) -> None:
+    _components[name] = stats
+
+
+def render() -> str:
+    lines: List[str] = []
+    for metric in _REGISTRY:
+        lines.extend(metric.render())
+
+    lines.append("# HELP nivara_component_stat Counters and sizes reported by caches, pools and stream managers.")
+    lines.append("# TYPE nivara_component_stat gauge")
+    for name, stats in sorted(_components.items()):
+        try:
+            values = stats()
+        except Exception as e:
+            print(f"Metrics: stats() failed for {name}: {e}")
+            continue
+        for key, value in sorted(values.items()):
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            lines.append(f"nivara_component_stat{_labels(('component', 'stat'), (name, key))} {value}")
+    return "\n".join(lines) + "\n"
+
+
+# -------------------------------------------------------
+# Tool wrappers
+# -------------------------------------------------------
+
+def is_error_result(result) -> bool:
+    # Tools in this repo report most failures as text rather than raising
+    return isinstance(result, str) and (result.startswith("Error") or '"status": "error"' in result[:80])
+
+
+def _timed(name: str, func: Callable) -> Callable:
+    if asyncio.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                result = await func(*args, **kwargs)
+            except Exception:
+                tool_errors.inc(1, name)
+                raise
+            finally:
+                tool_latency.observe(time.perf_counter() - started, name)
+            if is_error_result(result):
+                tool_errors.inc(1, name)
+            return result
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            result = func(*args, **kwargs)
+        except Exception:
+            tool_errors.inc(1, name)
+            raise
+        finally:
+            tool_latency.observe(time.perf_counter() - started, name)
+        if is_error_result(result):
+            tool_errors.inc(1, name)
+        return result
+    return wrapper
+
+
+def instrument_tools(tools: Iterable) -> list:
+    """Returns copies of LangChain tools whose calls record latency and errors."""
+    instrumented = []
+    for tool in tools:
+        update = {}
+        if getattr(tool, "func", None) is not None:
+            update["func"] = _timed(tool.name, tool.func)
+        if getattr(tool, "coroutine", None) is not None:
+            update["coroutine"] = _timed(tool.name, tool.coroutine)
+        instrumented.append(tool.model_copy(update=update) if update else tool)
+    return instrumented
+
+
+def instrument_engine(engine, label: str) -> None:
+    """Times every statement on a SQLAlchemy engine (pass `async_engine.sync_engine` for async engines)."""
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("nivara_query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get("nivara_query_start")
+        if starts:
+            db_latency.observe(time.perf_counter() - starts.pop(), label)
+
+
+# -------------------------------------------------------
+# astream_events observer
+# -------------------------------------------------------
+
+def _agent_of(event: dict) -> str:
+    """The top-level graph node an event belongs to: the supervisor or one of the agents."""
+    namespace = event.get("metadata", {}).get("langgraph_checkpoint_ns", "")
+    return namespace.split(":", 1)[0] if namespace else "supervisor"
+
+
+def is_agent_hop(event: dict) -> bool:
+    """
+    Chain events for a top-level graph node. A compiled agent also emits a
+    chain event under the same name one level down, which is not a new hop.
+    """
+    return event.get("name") in AGENT_NAMES and len(event.get("parent_ids", ())) <= 1
+
+
+def _model_of(event: dict) -> str:
+    metadata = event.get("metadata", {})
+    return metadata.get("ls_model_name") or event.get("name", "unknown")
+
+
+class TurnObserver:
+    """Feeds one chat turn's astream_events into the agent and LLM metrics."""
+
+    def __init__(self):
+        self._started: Dict[str, float] = {}
+        self._hops: Dict[str, Tuple[str, float]] = {}
+        self._first_token_seen: set = set()
+
+    def _end_hop(self, run_id: str) -> None:
+        name, started = self._hops.pop(run_id)
+        agent_latency.observe(time.perf_counter() - started, name)
+
+    def observe(self, event: dict) -> None:
+        kind = event["event"]
+        run_id = event.get("run_id")
+        name = event.get("name")
+
+        if kind == "on_chain_start" and is_agent_hop(event):
+            # A hop that hands off exits through a Command and emits no end event; hops never overlap
+            for open_run in list(self._hops):
+                self._end_hop(open_run)
+            self._hops[run_id] = (name, time.perf_counter())
+        elif kind in ("on_chain_end", "on_chain_error") and is_agent_hop(event):
+            if run_id in self._hops:
+                self._end_hop(run_id)
+            if kind == "on_chain_error":
+                agent_errors.inc(1, name)
+
+        elif kind == "on_chat_model_start":
+            self._started[run_id] = time.perf_counter()
+        elif kind == "on_chat_model_stream" and run_id not in self._first_token_seen:
+            started = self._started.get(run_id)
+            if started is not None:
+                self._first_token_seen.add(run_id)
+                llm_first_token.observe(time.perf_counter() - started, _agent_of(event), _model_of(event))
+        elif kind in ("on_chat_model_end", "on_chat_model_error"):
+            agent, model = _agent_of(event), _model_of(event)
+            started = self._started.pop(run_id, None)
+            self._first_token_seen.discard(run_id)
+            if started is not None:
+                llm_latency.observe(time.perf_counter() - started, agent, model)
+            if kind == "on_chat_model_error":
+                llm_errors.inc(1, agent, model)
+                return
+            usage = getattr(event["data"].get("output"), "usage_metadata", None) or {}
+            for token_kind in ("input_tokens", "output_tokens"):
+                if usage.get(token_kind):
+                    llm_tokens.inc(usage[token_kind], agent, model, token_kind.replace("_tokens", ""))
@@ -0,0 +1,121 @@
+import os
+import asyncio
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Sequence, Tuple
+
+from langchain_core.messages import AIMessage, ToolMessage
+from langgraph.prebuilt import ToolNode
+
+# -------------------------------------------------------
+# Configuration
+# -------------------------------------------------------
+
+# Tool calls from one LLM step that may run at once, and how long the step may take in total
+TOOL_STEP_CONCURRENCY = int(os.getenv("TOOL_STEP_CONCURRENCY", "4"))
+TOOL_STEP_DEADLINE_SECONDS = float(os.getenv("TOOL_STEP_DEADLINE_SECONDS", "20"))
+# Threads for synchronous tools (yfinance, pandas) and other to_thread work; the loop default is min(32, cpus + 4)
+TOOL_THREAD_WORKERS = int(os.getenv("TOOL_THREAD_WORKERS", "64"))
+
+
+class _Step:
+    __slots__ = ("semaphore", "deadline", "pending")
+
+    def __init__(self, concurrency: int, deadline: float):
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.deadline = deadline
+        self.pending = 0
+
+
+def _step_key(request) -> Tuple[str, ...]:
+    """Identifies the LLM step a tool call belongs to by all the calls that step made."""
+    call_id = request.tool_call["id"]
+    state = request.state
+    messages = state.get("messages", []) if isinstance(state, dict) else getattr(state, "messages", state)
+    for message in reversed(messages or []):
+        if isinstance(message, AIMessage) and any(call["id"] == call_id for call in message.tool_calls):
+            return tuple(call["id"] for call in message.tool_calls)
+    return (call_id,)
+
+
+class ToolStepLimiter:
+    """
+    `awrap_tool_call` hook for ToolNode. ToolNode already starts every call
+    of an LLM step together; this caps how many of them run at once and
+    gives the whole step one deadline. A call still running at the deadline
+    is answered with an error ToolMessage so the agent can go on with the
+    results it has (a synchronous tool's thread finishes in the background).
+    """
+
+    def __init__(self, concurrency: int, deadline_seconds: float):
+        self.concurrency = concurrency
+        self.deadline_seconds = deadline_seconds
+        self._steps: Dict[Tuple[str, ...], _Step] = {}
+        self._lock = threading.Lock()
+        self._counts: Counter = Counter()
+
+    async def __call__(self, request, execute):
+        loop = asyncio.get_running_loop()
+        key = _step_key(request)
+        step = self._steps.get(key)
+        if step is None:
+            step = self._steps[key] = _Step(self.concurrency, loop.time() + self.deadline_seconds)
+            self._count("steps")
+            if len(key) > 1:
+                self._count("parallel_steps")
+        step.pending += 1
+        self._count("calls")
+
+        async def run():
+            async with step.semaphore:
+                return await execute(request)
+
+        task = asyncio.ensure_future(run())
+        try:
+            done, _ = await asyncio.wait({task}, timeout=max(0.0, step.deadline - loop.time()))
+        except asyncio.CancelledError:
+            task.cancel()
+            raise
+        finally:
+            step.pending -= 1
+            if step.pending == 0:
+                self._steps.pop(key, None)
+
+        if done:
+            return task.result()
+        task.cancel()
+        self._count("timed_out")
+        name = request.tool_call["name"]
+        print(f"Tool {name} missed the {self.deadline_seconds:g}s step deadline")
+        return ToolMessage(
+            content=f"Error: {name} did not finish within {self.deadline_seconds:g} seconds.",
+            name=name,
+            tool_call_id=request.tool_call["id"],
+            status="error",
+        )
+
+    def stats(self) -> dict:
+        with self._lock:
+            counts = dict(self._counts)
+        counts["active_steps"] = len(self._steps)
+        return counts
+
+    def _count(self, key: str) -> None:
+        with self._lock:
+            self._counts[key] += 1
+
+
+tool_step_limiter = ToolStepLimiter(TOOL_STEP_CONCURRENCY, TOOL_STEP_DEADLINE_SECONDS)
+
+
+def create_tool_node(tools: Sequence) -> ToolNode:
+    """The tool node for an agent's ReAct loop: concurrent calls per step, bounded and with a deadline."""
+    return ToolNode(list(tools), awrap_tool_call=tool_step_limiter)
+
+
+def configure_tool_executor() -> None:
+    """Gives the running loop a default executor large enough for many concurrent synchronous tool calls."""
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=TOOL_THREAD_WORKERS, thread_name_prefix="tool")
+    )
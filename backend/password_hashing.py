@@ -0,0 +1,106 @@
+import os
+import time
+import asyncio
+import multiprocessing
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+
+from passlib.context import CryptContext
+
+# -------------------------------------------------------
+# Configuration
+# -------------------------------------------------------
+
+# bcrypt releases the GIL, so threads already spread the work over cores;
+# "process" is available for deployments that want full isolation.
+PASSWORD_HASH_EXECUTOR = os.getenv("PASSWORD_HASH_EXECUTOR", "thread")
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(os.cpu_count() or 2)))
+PASSWORD_HASH_MAX_QUEUE = int(os.getenv("PASSWORD_HASH_MAX_QUEUE", "256"))
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+
+def _hash(password: str) -> str:
+    return pwd_context.hash(password)
+
+
+def _verify(plain_password: str, hashed_password: str) -> bool:
+    return pwd_context.verify(plain_password, hashed_password)
+
+
+class PasswordPoolBusy(Exception):
+    """Raised when the password-hashing queue is full."""
+
+
+class PasswordHasher:
+    """
+    Runs bcrypt on a bounded worker pool so a login burst cannot stall the
+    event loop. At most `workers` hashes run at once, at most `max_queue`
+    requests wait for a slot, and the time spent waiting is recorded.
+    """
+
+    def __init__(self, executor: Executor, workers: int, max_queue: int):
+        self._executor = executor
+        self._semaphore = asyncio.Semaphore(workers)
+        self.workers = workers
+        self.max_queue = max_queue
+        self._waiting = 0
+        self._in_flight = 0
+        self._completed = 0
+        self._rejected = 0
+        self._queue_seconds_total = 0.0
+        self._queue_seconds_max = 0.0
+
+    async def hash(self, password: str) -> str:
+        return await self._run(_hash, password)
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return await self._run(_verify, plain_password, hashed_password)
+
+    async def _run(self, fn, *args):
+        if self._waiting >= self.max_queue:
+            self._rejected += 1
+            raise PasswordPoolBusy()
+
+        queued_at = time.perf_counter()
+        self._waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self._waiting -= 1
+
+        waited = time.perf_counter() - queued_at
+        self._queue_seconds_total += waited
+        self._queue_seconds_max = max(self._queue_seconds_max, waited)
+        self._in_flight += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+        finally:
+            self._in_flight -= 1
+            self._completed += 1
+            self._semaphore.release()
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> dict:
+        started = self._completed + self._in_flight
+        return {
+            "workers": self.workers,
+            "in_flight": self._in_flight,
+            "waiting": self._waiting,
+            "completed": self._completed,
+            "rejected": self._rejected,
+            "queue_time_ms_avg": round(self._queue_seconds_total / started * 1000, 2) if started else 0.0,
+            "queue_time_ms_max": round(self._queue_seconds_max * 1000, 2),
+        }
+
+
+def _build_executor() -> Executor:
+    if PASSWORD_HASH_EXECUTOR == "process":
+        # "spawn", as for the shared pool in workers.py: forking would copy the running event loop
+        # and the DB/LLM client threads into every child
+        return ProcessPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt")
+
+
+password_hasher = PasswordHasher(_build_executor(), PASSWORD_HASH_WORKERS, PASSWORD_HASH_MAX_QUEUE)
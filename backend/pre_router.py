@@ -0,0 +1,105 @@
+import os
+import re
+import threading
+from collections import Counter
+from typing import Optional
+
+# -------------------------------------------------------
+# Configuration
+# -------------------------------------------------------
+
+# "on" dispatches matched messages straight to the agent, "shadow" only logs
+# what it would have done next to the supervisor's choice, "off" disables it.
+PRE_ROUTER_MODE = os.getenv("PRE_ROUTER_MODE", "shadow")
+
+SUPERVISOR = "supervisor"
+HANDOFF_PREFIX = "transfer_to_"
+AGENT_NAMES = ("RAG_agent", "market_agent", "planner_agent", "tax_agent")
+
+# -------------------------------------------------------
+# Rules, in the order of the supervisor's decision hierarchy
+# -------------------------------------------------------
+
+# Left to the supervisor: it must answer these itself (helpline) or run the age / risk question flow.
+_DISTRESS = re.compile(r"\b(?:suicid\w*|kill myself|end my life|self[- ]harm|hopeless|can'?t go on|bankrupt)\b", re.I)
+_PLANNING = re.compile(
+    r"\b(?:invest(?:ing|ment plan)?|portfolio|create a plan|financial plan|where should i put|recommendation)\b", re.I
+)
+
+_TAX = re.compile(r"\b(?:80\s?c|80\s?d|tax(?:es)?|tax[- ]saving|bank statement|deductions?|itr)\b", re.I)
+_TICKER = re.compile(r"(?:\b[A-Z0-9&-]{2,20}\.(?:NS|BO)\b|\^[A-Z]{3,10}\b)", re.I)
+_EDUCATIONAL = re.compile(
+    r"^\s*(?:what\s+(?:is|are|does)|explain|define|how\s+(?:does|do)|difference\s+between|pros\s+and\s+cons)\b", re.I
+)
+# A question that leans on an earlier message ("explain that") needs the supervisor's reading of the history
+_CONTEXT_REFERENCE = re.compile(r"\b(?:that|this|it|those|these|them|above|previous|you mentioned)\b", re.I)
+
+
+def route_message(message: str) -> Optional[str]:
+    """
+    Returns the agent name for messages the rules identify with high
+    confidence, or None to let the supervisor LLM decide. As in the
+    supervisor prompt, tax and ticker signals outrank educational phrasing;
+    a message with both tax and ticker signals is treated as ambiguous.
+    """
+    if _DISTRESS.search(message) or _PLANNING.search(message):
+        return None
+
+    candidates = []
+    if _TAX.search(message):
+        candidates.append("tax_agent")
+    if _TICKER.search(message):
+        candidates.append("market_agent")
+    if candidates:
+        return candidates[0] if len(candidates) == 1 else None
+
+    if _EDUCATIONAL.search(message) and not _CONTEXT_REFERENCE.search(message):
+        return "RAG_agent"
+    return None
+
+
+def supervisor_choice(tool_name: str) -> Optional[str]:
+    """Maps a supervisor handoff tool call (`transfer_to_<agent>`, lower-cased) back to the agent name."""
+    if not tool_name.startswith(HANDOFF_PREFIX):
+        return None
+    target = tool_name[len(HANDOFF_PREFIX):]
+    return next((name for name in AGENT_NAMES if name.lower() == target), target)
+
+
+class RoutingStats:
+    """Counts pre-router decisions and, in shadow mode, agreement with the supervisor."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts: Counter = Counter()
+
+    def record(self, mode: str, predicted: Optional[str], actual: Optional[str] = None,
+               answer_cache: Optional[str] = None) -> None:
+        """`answer_cache` is "hit" or "miss" when the message bypassed the graph through the answer cache."""
+        with self._lock:
+            self._counts["messages"] += 1
+            if answer_cache:
+                self._counts["answer_cache_bypasses"] += 1
+                self._counts[f"answer_cache_bypasses.{answer_cache}"] += 1
+            if predicted is None:
+                self._counts["fallbacks"] += 1
+            elif mode == "on":
+                self._counts["dispatched"] += 1
+                self._counts[f"dispatched.{predicted}"] += 1
+            else:
+                self._counts["shadow_predictions"] += 1
+                self._counts["shadow_agreed" if predicted == actual else "shadow_disagreed"] += 1
+        cache_note = f" answer_cache={answer_cache}" if answer_cache else ""
+        print(f"Pre-router [{mode}]: predicted={predicted or SUPERVISOR} supervisor={actual or '-'}{cache_note}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            counts = dict(self._counts)
+        predictions = counts.get("shadow_predictions", 0)
+        counts["shadow_accuracy"] = round(counts.get("shadow_agreed", 0) / predictions, 3) if predictions else None
+        # Each dispatched message skipped one supervisor LLM call
+        counts["supervisor_calls_saved"] = counts.get("dispatched", 0)
+        return counts
+
+
+routing_stats = RoutingStats()
@@ -0,0 +1,199 @@
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from database import SessionLocal
+import models
+from user_cache import user_cache
+
+# -------------------------------------------------------
+# Patterns
+# -------------------------------------------------------
+
+MIN_AGE, MAX_AGE = 16, 100
+
+# Only statements about the user themselves count: a generic question ("can a minor under
+# the age of 18 ...", "low risk debt funds") must never overwrite the stored profile.
+_I_AM = r"\b(?:i\s+am|i'm|i’m|im)\s+"
+
+# A number followed by a unit is a quantity, not an age ("I'm 30 days late", "I am 25 minutes away")
+_QUANTITY = r"(?!\s*(?:%|percent|lakh|lac|k\b|crore|thousand|days?\b|weeks?\b|months?\b|hours?\b|hrs?\b|minutes?\b|mins?\b|seconds?\b|secs?\b|km\b|kg\b|rs\b|inr\b))"
+# "I am 30" must end there, or go on with years / old ("I'm 30 years old", "I am 30, married")
+_AGE_TAIL = (
+    r"(?=\s*(?:(?:years?|yrs?)\b(?!\s+(?:into|in|at|with|ago|back|experience|of\s+(?!age))\b)|old\b|y/?o\b|[.,;:!?)]|$)"
+    r"|\s+(?:and|but|with|now|so)\b)"
+)
+
+_AGE_PATTERNS = [
+    re.compile(r"\bmy\s+age\s*(?:is|:|=)?\s*(\d{2})\b"),
+    re.compile(_I_AM + r"(?:aged\s+|a\s+)?(\d{2})" + _AGE_TAIL),
+    re.compile(r"\bi\s+(?:just\s+)?turn(?:ed)?\s+(\d{2})\b" + _QUANTITY),
+]
+# Accepted without a first-person subject only as the answer to "what is your age?"
+_ANSWER_AGE_PATTERNS = [
+    re.compile(r"\b(\d{2})\s*(?:years?|yrs?)(?:\s*old|\s*of\s*age)\b"),
+    re.compile(r"\b(?:age|aged)\s*(?::|=|of)?\s*(\d{2})\b"),
+]
+
+_LEVEL = r"(very\s+)?(aggressive|high|conservative|cautious|low|moderate|medium|balanced)"
+_RISK_PATTERNS = [
+    re.compile(r"\bmy\s+risk(?:\s*(?:tolerance|appetite|level|profile|score))?\s*(?:is|:|=|would\s+be)\s*(?:a\s+|around\s+|about\s+)?([1-5])\b(?!\s*(?:%|years?|lakh|k\b))"),
+]
+_RISK_LEVEL_PATTERNS = [
+    re.compile(r"\bmy\s+risk(?:\s*(?:tolerance|appetite|level|profile))?\s*(?:is|:|=|would\s+be)\s*(?:a\s+|quite\s+|fairly\s+)?" + _LEVEL + r"\b"),
+    # The level must qualify a risk noun: "I'm a high earner" or "I'm low income" says nothing about risk
+    re.compile(_I_AM + r"(?:a\s+)?" + _LEVEL + r"[- ](?:risk(?:[- ]taker|\s+(?:investor|appetite|tolerance|profile))|investor)\b"),
+    re.compile(r"\bi\s+(?:have|prefer|want|can\s+(?:take|handle)|am\s+comfortable\s+with|'m\s+comfortable\s+with)\s+(?:a\s+)?" + _LEVEL + r"\s+risk\b(?!\s+of\b)"),
+]
+# Accepted without a first-person subject only as the answer to a risk-tolerance question
+_ANSWER_RISK_PATTERNS = [
+    re.compile(r"\brisk(?:\s*(?:tolerance|appetite|level|profile|score))?\s*(?:is|of|at|:|=|would\s+be|around|about)?\s*(?:a\s+)?([1-5])\b(?!\s*(?:%|years?|lakh|k\b))"),
+    re.compile(r"\b([1-5])\s*(?:/|out\s+of)\s*5\b"),
+]
+
+_RISK_WORDS = [
+    (re.compile(r"\bvery\s+(?:aggressive|high)\b"), 5),
+    (re.compile(r"\bvery\s+(?:conservative|cautious|low)\b"), 1),
+    (re.compile(r"\baggressive\b|\bhigh\b"), 4),
+    (re.compile(r"\bconservative\b|\bcautious\b|\blow\b"), 2),
+    (re.compile(r"\bmoderate\b|\bmedium\b|\bbalanced\b"), 3),
+]
+
+# A short reply to a question the assistant just asked, e.g. "26" or "I'd say a 4".
+_SHORT_REPLY_WORDS = 8
+_BARE_AGE = re.compile(r"\b(\d{2})\b" + _QUANTITY)
+_BARE_RISK = re.compile(r"\b([1-5])\b")
+
+# How we recognise that the assistant's last reply asked for age / risk tolerance.
+_ASKS_AGE = re.compile(r"\byour\s+age\b|\bhow\s+old\b")
+_ASKS_RISK = re.compile(r"\brisk\b.*\?|\bscale\s+of\s+1\b")
+
+
+def _risk_level(phrase: str) -> Optional[int]:
+    for pattern, level in _RISK_WORDS:
+        if pattern.search(phrase):
+            return level
+    return None
+
+
+def _first_age(patterns, text: str) -> Optional[int]:
+    for pattern in patterns:
+        match = pattern.search(text)
+        if match and MIN_AGE <= int(match.group(1)) <= MAX_AGE:
+            return int(match.group(1))
+    return None
+
+
+def extract_profile_facts(message: str, pending: Optional[str] = None) -> Dict[str, int]:
+    """
+    Extracts `age` and `risk_tolerance` from one user message.
+
+    Only first-person statements ("I am 30", "my risk appetite is high")
+    are taken, unless `pending` names the fact the assistant asked for in
+    its previous reply ("age" or "risk_tolerance"); then the answer may be
+    phrased more loosely, down to a bare number in a short reply.
+    """
+    text = message.lower()
+    facts: Dict[str, int] = {}
+
+    age = _first_age(_AGE_PATTERNS + (_ANSWER_AGE_PATTERNS if pending == "age" else []), text)
+    if age is not None:
+        facts["age"] = age
+
+    for pattern in _RISK_PATTERNS + (_ANSWER_RISK_PATTERNS if pending == "risk_tolerance" else []):
+        match = pattern.search(text)
+        if match:
+            facts["risk_tolerance"] = int(match.group(1))
+            break
+
+    if "risk_tolerance" not in facts:
+        for pattern in _RISK_LEVEL_PATTERNS:
+            match = pattern.search(text)
+            if match:
+                facts["risk_tolerance"] = _risk_level(match.group(0))
+                break
+
+    if "risk_tolerance" not in facts and pending == "risk_tolerance":
+        level = _risk_level(text)
+        if level is not None:
+            facts["risk_tolerance"] = level
+
+    if pending and pending not in facts and len(text.split()) <= _SHORT_REPLY_WORDS:
+        if pending == "age":
+            age = _first_age([_BARE_AGE], text)
+            if age is not None:
+                facts["age"] = age
+        elif pending == "risk_tolerance":
+            match = _BARE_RISK.search(text)
+            if match:
+                facts["risk_tolerance"] = int(match.group(1))
+
+    return facts
+
+
+def detect_pending_question(reply: str) -> Optional[str]:
+    """Which profile fact, if any, the assistant's reply is asking the user for."""
+    text = reply.lower()
+    if _ASKS_RISK.search(text):
+        return "risk_tolerance"
+    if _ASKS_AGE.search(text):
+        return "age"
+    return None
+
+
+# -------------------------------------------------------
+# Per-thread state
+# -------------------------------------------------------
+
+PROFILE_STATE_MAX_THREADS = int(os.getenv("PROFILE_STATE_MAX_THREADS", "10000"))
+
+
+class ProfileTracker:
+    """
+    Runs the extractor once per incoming message and remembers, per thread,
+    which question the assistant asked last, so history never has to be
+    re-read from the checkpointer.
+    """
+
+    def __init__(self, max_threads: int):
+        self.max_threads = max_threads
+        self._pending: "OrderedDict[str, Optional[str]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def observe_user_message(self, thread_id: str, message: str) -> Dict[str, int]:
+        with self._lock:
+            pending = self._pending.pop(thread_id, None)
+        return extract_profile_facts(message, pending)
+
+    def observe_assistant_reply(self, thread_id: str, reply: str) -> None:
+        pending = detect_pending_question(reply)
+        with self._lock:
+            self._pending.pop(thread_id, None)
+            if pending:
+                self._pending[thread_id] = pending
+                while len(self._pending) > self.max_threads:
+                    self._pending.popitem(last=False)
+
+
+profile_tracker = ProfileTracker(PROFILE_STATE_MAX_THREADS)
+
+
+def save_profile_facts(thread_id: str, facts: Dict[str, int]) -> None:
+    """Writes extracted facts onto the thread's User row, where the planner tool reads them."""
+    db = SessionLocal()
+    try:
+        user = db.query(models.User).filter(models.User.thread_id == thread_id).first()
+        if user is None:
+            return
+        if "age" in facts:
+            user.age = facts["age"]
+        if "risk_tolerance" in facts:
+            user.risk_tolerance = str(facts["risk_tolerance"])
+        db.commit()
+        db.refresh(user)
+        user_cache.put(user)
+        print(f"User profile for {user.email} updated from conversation: {facts}")
+    finally:
+        db.close()
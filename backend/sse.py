@@ -0,0 +1,218 @@
+import os
+import json
+import time
+import asyncio
+import threading
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Callable, Optional
+
+from starlette.responses import StreamingResponse
+
+try:
+    import orjson
+
+    def dumps(obj) -> str:
+        return orjson.dumps(obj).decode()
+except ImportError:  # orjson is optional; the stdlib encoder produces the same frames, only slower
+    def dumps(obj) -> str:
+        return json.dumps(obj, separators=(",", ":"))
+
+# -------------------------------------------------------
+# Configuration
+# -------------------------------------------------------
+
+# Tokens are held for at most this long (or until the buffer is full) before being written as one frame
+SSE_COALESCE_MS = float(os.getenv("SSE_COALESCE_MS", "30"))
+SSE_MAX_BUFFER_CHARS = int(os.getenv("SSE_MAX_BUFFER_CHARS", "512"))
+# Comment frames keep proxies from closing the connection while tools run
+SSE_HEARTBEAT_SECONDS = float(os.getenv("SSE_HEARTBEAT_SECONDS", "15"))
+
+HEARTBEAT = ": keep-alive\n\n"
+
+
+def format_event(payload: dict) -> str:
+    return f"data: {dumps(payload)}\n\n"
+
+
+class ClosingStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse that always calls `on_close` once the response is
+    over. The body generator's own `finally` does not run if the client is
+    gone before the first chunk (the generator is never started), so
+    resources claimed before the response must be released here.
+    """
+
+    def __init__(self, content, on_close: Callable[[], None], **kwargs):
+        super().__init__(content, **kwargs)
+        self.on_close = on_close
+
+    async def __call__(self, scope, receive, send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.on_close()
+
+
+@dataclass
+class StreamStats:
+    """Counters for one SSE response."""
+    started: float = field(default_factory=time.perf_counter)
+    frames: int = 0
+    bytes: int = 0
+    tokens: int = 0
+    heartbeats: int = 0
+    first_token_ms: Optional[float] = None
+
+    def as_dict(self) -> dict:
+        return {
+            "frames": self.frames,
+            "bytes": self.bytes,
+            "tokens": self.tokens,
+            "heartbeats": self.heartbeats,
+            "first_token_ms": self.first_token_ms,
+            "duration_ms": round((time.perf_counter() - self.started) * 1000, 2),
+        }
+
+
+class StreamTotals:
+    """Process-wide totals over finished streams."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._totals = {"streams": 0, "frames": 0, "bytes": 0, "tokens": 0, "heartbeats": 0}
+        self._first_token_ms_sum = 0.0
+        self._first_token_count = 0
+
+    def record(self, stream: StreamStats) -> None:
+        with self._lock:
+            self._totals["streams"] += 1
+            self._totals["frames"] += stream.frames
+            self._totals["bytes"] += stream.bytes
+            self._totals["tokens"] += stream.tokens
+            self._totals["heartbeats"] += stream.heartbeats
+            if stream.first_token_ms is not None:
+                self._first_token_ms_sum += stream.first_token_ms
+                self._first_token_count += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            totals = dict(self._totals)
+            count = self._first_token_count
+            totals["first_token_ms_avg"] = round(self._first_token_ms_sum / count, 2) if count else None
+        return totals
+
+
+stream_totals = StreamTotals()
+
+_DONE = object()
+
+
+class _Failed:
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+async def coalesce(
+    events: AsyncIterator[dict],
+    stats: StreamStats,
+    window_ms: float = SSE_COALESCE_MS,
+    max_chars: int = SSE_MAX_BUFFER_CHARS,
+    heartbeat_seconds: Optional[float] = SSE_HEARTBEAT_SECONDS,
+) -> AsyncIterator[str]:
+    """
+    Turns a stream of event payloads into SSE text. Consecutive `content`
+    payloads are merged into one frame per `window_ms` (or per `max_chars`),
+    any other payload flushes the buffer and is written as-is, and a comment
+    frame is written whenever nothing else has been sent for
+    `heartbeat_seconds` (never, if it is None).
+
+    `events` is consumed by a separate task so the timers never interrupt
+    the producer mid-step; the task is cancelled if the response is.
+    """
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+
+    async def pump():
+        try:
+            async for event in events:
+                queue.put_nowait(event)
+        except Exception as e:
+            queue.put_nowait(_Failed(e))
+        finally:
+            queue.put_nowait(_DONE)
+
+    producer = asyncio.create_task(pump())
+    buffer = []
+    buffered = 0
+    flush_at = None
+    last_write = loop.time()
+
+    def write(frame: str) -> str:
+        nonlocal last_write
+        stats.frames += 1
+        stats.bytes += len(frame)
+        last_write = loop.time()
+        return frame
+
+    def flush() -> str:
+        nonlocal buffer, buffered, flush_at
+        frame = format_event({"type": "content", "content": "".join(buffer)})
+        buffer, buffered, flush_at = [], 0, None
+        return write(frame)
+
+    # One pending get() is reused across timeouts; asyncio.wait (unlike wait_for) never swallows a cancellation
+    getter = None
+    try:
+        while True:
+            if flush_at is not None:
+                deadline = flush_at
+            elif heartbeat_seconds is not None:
+                deadline = last_write + heartbeat_seconds
+            else:
+                deadline = None
+            if getter is None:
+                getter = asyncio.ensure_future(queue.get())
+            timeout = max(0.0, deadline - loop.time()) if deadline is not None else None
+            done, _ = await asyncio.wait({getter}, timeout=timeout)
+            if not done:
+                if buffer:
+                    yield flush()
+                else:
+                    stats.heartbeats += 1
+                    last_write = loop.time()
+                    yield HEARTBEAT
+                continue
+            event, getter = getter.result(), None
+
+            if event is _DONE:
+                break
+            if isinstance(event, _Failed):
+                raise event.error
+
+            if event.get("type") == "content":
+                if stats.first_token_ms is None:
+                    stats.first_token_ms = round((time.perf_counter() - stats.started) * 1000, 2)
+                stats.tokens += 1
+                buffer.append(event["content"])
+                buffered += len(event["content"])
+                if flush_at is None:
+                    flush_at = loop.time() + window_ms / 1000
+                if buffered >= max_chars:
+                    yield flush()
+                continue
+
+            if buffer:
+                yield flush()
+            yield write(format_event(event))
+
+        if buffer:
+            yield flush()
+    finally:
+        if getter is not None:
+            getter.cancel()
+        if not producer.done():
+            producer.cancel()
+            try:
+                await producer
+            except asyncio.CancelledError:
+                pass
@@ -0,0 +1,228 @@
+import os
+import re
+import json
+import time
+import fcntl
+import hashlib
+import threading
+from contextlib import contextmanager
+from collections import OrderedDict
+from typing import Iterator, NamedTuple, Optional, Tuple
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+# -------------------------------------------------------
+# Configuration
+# -------------------------------------------------------
+
+STATEMENT_STORE_DIR = os.getenv("STATEMENT_STORE_DIR", "./data/statements")
+STATEMENT_CACHE_MAX_BYTES = int(os.getenv("STATEMENT_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+STATEMENT_CACHE_IDLE_SECONDS = float(os.getenv("STATEMENT_CACHE_IDLE_SECONDS", "900"))
+
+_SAFE_KEY = re.compile(r"[^A-Za-z0-9_.-]")
+_METADATA_KEY = b"nivara"
+
+
+class StoredStatement(NamedTuple):
+    """A statement frame together with its content hash and store metadata."""
+    df: pd.DataFrame
+    content_hash: str
+    metadata: dict
+
+
+def hash_statement(df: pd.DataFrame) -> str:
+    """Stable content hash of a statement (column names plus row values)."""
+    digest = hashlib.sha256("\x1f".join(map(str, df.columns)).encode())
+    digest.update(pd.util.hash_pandas_object(df, index=False).values.tobytes())
+    return digest.hexdigest()[:32]
+
+
+class _CacheEntry:
+    """A statement held in the in-memory tier, tagged with the file version it came from."""
+
+    __slots__ = ("statement", "nbytes", "mtime_ns", "last_access")
+
+    def __init__(self, statement: StoredStatement, nbytes: int, mtime_ns: int):
+        self.statement = statement
+        self.nbytes = nbytes
+        self.mtime_ns = mtime_ns
+        self.last_access = time.monotonic()
+
+
+class StatementStore:
+    """
+    Durable per-thread store for uploaded bank statements.
+
+    Every statement is persisted as an uncompressed Feather (Arrow IPC) file
+    so any worker can serve it and loads are memory-mapped instead of parsed.
+    A bounded LRU tier keeps recently used frames in memory; it is limited by
+    a byte budget and entries idle for longer than `idle_seconds` are dropped.
+
+    Read-modify-write cycles (appending an upload) hold `locked(thread_id)`,
+    an flock on a `.lock` file next to the statement, so they are serialised
+    across every worker and process that shares the directory.
+    """
+
+    def __init__(self, directory: str, max_bytes: int, idle_seconds: float):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.idle_seconds = idle_seconds
+        self._cache: "OrderedDict[str, _CacheEntry]" = OrderedDict()
+        self._cached_bytes = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    # ---------------------------------------------------
+    # Paths
+    # ---------------------------------------------------
+
+    def _path(self, thread_id: str) -> str:
+        return os.path.join(self.directory, f"{_SAFE_KEY.sub('_', thread_id)}.feather")
+
+    def _lock_path(self, thread_id: str) -> str:
+        # A separate file, since os.replace swaps the statement's inode on every write
+        return f"{self._path(thread_id)}.lock"
+
+    # ---------------------------------------------------
+    # Public API
+    # ---------------------------------------------------
+
+    def put(self, thread_id: str, df: pd.DataFrame, metadata: Optional[dict] = None, cache: bool = True) -> StoredStatement:
+        """
+        Persist the statement for a thread, replacing any previous upload.
+        `cache=False` skips the memory tier (e.g. when writing from a worker process).
+        """
+        statement = StoredStatement(df, hash_statement(df), metadata or {})
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        table = table.replace_schema_metadata({
+            **(table.schema.metadata or {}),
+            _METADATA_KEY: json.dumps(
+                {"content_hash": statement.content_hash, "metadata": statement.metadata}
+            ).encode(),
+        })
+        path = self._path(thread_id)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+        # Uncompressed so that reads can map the file without decoding it.
+        feather.write_feather(table, tmp_path, compression="uncompressed")
+        os.replace(tmp_path, path)
+
+        mtime_ns = os.stat(path).st_mtime_ns
+        with self._lock:
+            self._drop(thread_id)
+            if cache:
+                self._admit(thread_id, statement, mtime_ns)
+        return statement
+
+    def get(self, thread_id: str) -> Optional[pd.DataFrame]:
+        """Return the stored statement for a thread, or None if nothing was uploaded."""
+        statement = self.get_statement(thread_id)
+        return statement.df if statement is not None else None
+
+    def get_statement(self, thread_id: str, cache: bool = True) -> Optional[StoredStatement]:
+        """
+        Like `get`, but also returns the content hash and metadata saved with
+        the upload. `cache=False` reads the file without admitting it to the memory tier.
+        """
+        path = self._path(thread_id)
+        try:
+            mtime_ns = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            with self._lock:
+                self._drop(thread_id)
+            return None
+
+        with self._lock:
+            self._evict_idle()
+            entry = self._cache.get(thread_id)
+            # Another worker may have re-uploaded since we cached this frame.
+            if entry is not None and entry.mtime_ns == mtime_ns:
+                entry.last_access = time.monotonic()
+                self._cache.move_to_end(thread_id)
+                return entry.statement
+
+        statement, mtime_ns = self._load(path)
+        if cache:
+            with self._lock:
+                self._drop(thread_id)
+                self._admit(thread_id, statement, mtime_ns)
+        return statement
+
+    @contextmanager
+    def locked(self, thread_id: str) -> Iterator[None]:
+        """Holds the thread's statement exclusively, across processes, until the block exits."""
+        fd = os.open(self._lock_path(thread_id), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            # Closing the descriptor releases the lock, also if the block raised
+            os.close(fd)
+
+    def delete(self, thread_id: str) -> None:
+        """Remove a thread's statement from memory and disk."""
+        with self._lock:
+            self._drop(thread_id)
+        try:
+            os.remove(self._path(thread_id))
+        except FileNotFoundError:
+            pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._cache),
+                "cached_bytes": self._cached_bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+    # ---------------------------------------------------
+    # Internals
+    # ---------------------------------------------------
+
+    @staticmethod
+    def _load(path: str) -> Tuple[StoredStatement, int]:
+        mtime_ns = os.stat(path).st_mtime_ns
+        table = feather.read_table(path, memory_map=True)
+        stored = json.loads((table.schema.metadata or {}).get(_METADATA_KEY, b"{}"))
+        # Numeric columns are handed to pandas as views over the mapped buffers.
+        df = table.to_pandas(split_blocks=True)
+        content_hash = stored.get("content_hash") or hash_statement(df)
+        return StoredStatement(df, content_hash, stored.get("metadata", {})), mtime_ns
+
+    # The helpers below expect the caller to hold self._lock.
+
+    def _admit(self, thread_id: str, statement: StoredStatement, mtime_ns: int) -> None:
+        nbytes = int(statement.df.memory_usage(deep=True).sum())
+        if nbytes > self.max_bytes:
+            # Too large for the memory tier; it is still served from disk.
+            return
+        self._cache[thread_id] = _CacheEntry(statement, nbytes, mtime_ns)
+        self._cached_bytes += nbytes
+        while self._cached_bytes > self.max_bytes and self._cache:
+            _, evicted = self._cache.popitem(last=False)
+            self._cached_bytes -= evicted.nbytes
+
+    def _drop(self, thread_id: str) -> None:
+        entry = self._cache.pop(thread_id, None)
+        if entry is not None:
+            self._cached_bytes -= entry.nbytes
+
+    def _evict_idle(self) -> None:
+        cutoff = time.monotonic() - self.idle_seconds
+        # The dict is in LRU order, so idle entries are all at the front.
+        while self._cache:
+            entry = next(iter(self._cache.values()))
+            if entry.last_access >= cutoff:
+                break
+            self._cache.popitem(last=False)
+            self._cached_bytes -= entry.nbytes
+
+
+statement_store = StatementStore(
+    STATEMENT_STORE_DIR,
+    STATEMENT_CACHE_MAX_BYTES,
+    STATEMENT_CACHE_IDLE_SECONDS,
+)
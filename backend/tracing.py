@@ -0,0 +1,398 @@
+"""
+Per-turn span tracing for `/chat-stream`.
+
+Each chat turn records spans for auth, the routing decision, every agent
+hop, tool call and LLM call (with token counts). Spans are buffered for the
+turn and, if the turn is kept, written as one JSON line per span to
+TRACE_EXPORT_PATH by a background thread. A turn is kept when it is sampled
+(TRACE_SAMPLE_RATE), slower than TRACE_SLOW_TURN_SECONDS, or did not
+complete, so slow and failed turns are always available.
+
+Render a kept turn as a waterfall:
+
+    python tracing.py <thread_id>              # latest kept turn
+    python tracing.py <thread_id> --turn 2     # second kept turn (negative counts from the end)
+    python tracing.py <thread_id> --list
+"""
+import os
+import sys
+import json
+import time
+import queue
+import random
+import asyncio
+import argparse
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Sequence
+from uuid import uuid4
+
+from metrics import is_agent_hop, is_error_result
+
+# -------------------------------------------------------
+# Configuration
+# -------------------------------------------------------
+
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "true").lower() == "true"
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.1"))
+# Turns at least this slow (and every cancelled or failed turn) are kept regardless of sampling
+TRACE_SLOW_TURN_SECONDS = float(os.getenv("TRACE_SLOW_TURN_SECONDS", "10"))
+TRACE_EXPORT_PATH = os.getenv("TRACE_EXPORT_PATH", "./data/traces.jsonl")
+# The export file is rotated to `<path>.1` past this size
+TRACE_MAX_FILE_BYTES = int(os.getenv("TRACE_MAX_FILE_BYTES", str(100 * 1024 * 1024)))
+# Kept turns waiting for the writer thread; further turns are dropped
+TRACE_EXPORT_QUEUE = int(os.getenv("TRACE_EXPORT_QUEUE", "1000"))
+
+
+def _new_id() -> str:
+    return uuid4().hex[:16]
+
+
+class TurnTrace:
+    """
+    Spans for one chat turn, relative to the turn's start. `span()` nests
+    through a stack, so spans opened inside it (including the ones `observe`
+    derives from astream_events) become its children.
+    """
+
+    def __init__(self, tracer: "Tracer", thread_id: str, started: Optional[float] = None):
+        self._tracer = tracer
+        self.recording = tracer.enabled
+        self.trace_id = uuid4().hex
+        self.thread_id = thread_id
+        self.started = started if started is not None else time.perf_counter()
+        self.started_at = time.time() - (time.perf_counter() - self.started)
+        self.spans: List[dict] = []
+        self._stack: List[dict] = []
+        self._by_run: Dict[str, dict] = {}
+        self._hops: List[dict] = []
+        self.finished = False
+        self.root = self.begin("chat_turn", "request", start=self.started)
+        self._stack.append(self.root)
+
+    # --- Spans ---
+
+    def begin(self, name: str, kind: str, parent_id: Optional[str] = None, start: Optional[float] = None, **attributes) -> dict:
+        span = {
+            "span_id": _new_id(),
+            "parent_id": parent_id or (self._stack[-1]["span_id"] if self._stack else None),
+            "name": name,
+            "kind": kind,
+            "start": start if start is not None else time.perf_counter(),
+            "end": None,
+            "status": "ok",
+            "attributes": {key: value for key, value in attributes.items() if value is not None},
+        }
+        if self.recording:
+            self.spans.append(span)
+        return span
+
+    def end(self, span: dict, status: Optional[str] = None, end: Optional[float] = None) -> None:
+        if span["end"] is None:
+            span["end"] = end if end is not None else time.perf_counter()
+            if status:
+                span["status"] = status
+
+    def add_span(self, name: str, kind: str, start: float, end: float, **attributes) -> dict:
+        span = self.begin(name, kind, start=start, **attributes)
+        self.end(span, end=end)
+        return span
+
+    @contextmanager
+    def span(self, name: str, kind: str, **attributes):
+        """Times the block as a child of the innermost open span; yields the span's attributes for the block to fill in."""
+        span = self.begin(name, kind, **attributes)
+        self._stack.append(span)
+        try:
+            yield span["attributes"]
+        except BaseException as e:
+            self.end(span, "cancelled" if isinstance(e, asyncio.CancelledError) else "error")
+            raise
+        finally:
+            self._stack.remove(span)
+            self.end(span)
+
+    # --- astream_events ---
+
+    def _parent_of(self, event: dict) -> Optional[str]:
+        for run_id in reversed(event.get("parent_ids", ())):
+            span = self._by_run.get(run_id)
+            if span is not None:
+                return span["span_id"]
+        return None
+
+    def observe(self, event: dict) -> None:
+        """Derives agent-hop, tool and LLM spans from one astream_events (v2) event."""
+        if not self.recording:
+            return
+        kind = event["event"]
+        run_id = event.get("run_id")
+        data = event.get("data", {})
+
+        if kind == "on_chain_start" and is_agent_hop(event):
+            # A hop that hands off exits through a Command and emits no end event; hops never overlap
+            for hop in self._hops:
+                self.end(hop)
+            span = self.begin(event["name"], "agent", parent_id=self._parent_of(event))
+            self._hops.append(span)
+            self._by_run[run_id] = span
+        elif kind == "on_chat_model_start":
+            metadata = event.get("metadata", {})
+            self._by_run[run_id] = self.begin(
+                "llm", "llm", parent_id=self._parent_of(event), model=metadata.get("ls_model_name") or event.get("name")
+            )
+        elif kind == "on_chat_model_stream":
+            span = self._by_run.get(run_id)
+            if span is not None and "first_token_ms" not in span["attributes"]:
+                span["attributes"]["first_token_ms"] = round((time.perf_counter() - span["start"]) * 1000, 2)
+        elif kind == "on_tool_start":
+            is_handoff = event["name"].startswith("transfer_to_")
+            self._by_run[run_id] = self.begin(
+                event["name"], "handoff" if is_handoff else "tool", parent_id=self._parent_of(event)
+            )
+
+        elif kind.endswith("_end") or kind.endswith("_error"):
+            span = self._by_run.pop(run_id, None)
+            if span is None:
+                return
+            failed = kind.endswith("_error")
+            if failed:
+                span["attributes"]["error"] = str(data.get("error"))[:300]
+            elif kind == "on_chat_model_end":
+                usage = getattr(data.get("output"), "usage_metadata", None) or {}
+                for token_kind in ("input_tokens", "output_tokens"):
+                    if usage.get(token_kind) is not None:
+                        span["attributes"][token_kind] = usage[token_kind]
+            elif kind == "on_tool_end":
+                output = data.get("output")
+                content = getattr(output, "content", output)
+                failed = getattr(output, "status", None) == "error" or is_error_result(content)
+            self.end(span, "error" if failed else None)
+
+    # --- Export ---
+
+    def finish(self, outcome: str, **attributes) -> None:
+        """Closes the turn and hands it to the exporter if it is kept."""
+        if self.finished:
+            return
+        self.finished = True
+        now = time.perf_counter()
+        self.root["attributes"].update({key: value for key, value in attributes.items() if value is not None})
+        self.root["attributes"]["outcome"] = outcome
+        status = {"failed": "error", "cancelled": "cancelled"}.get(outcome)
+        for span in self.spans:
+            self.end(span, status, end=now)
+        if self.recording:
+            self._tracer.submit(self, now - self.started, outcome)
+
+    def lines(self) -> List[dict]:
+        rows = []
+        for span in self.spans:
+            row = {
+                "trace_id": self.trace_id,
+                "thread_id": self.thread_id,
+                "span_id": span["span_id"],
+                "parent_id": span["parent_id"],
+                "name": span["name"],
+                "kind": span["kind"],
+                "start_ms": round((span["start"] - self.started) * 1000, 2),
+                "duration_ms": round((span["end"] - span["start"]) * 1000, 2),
+                "status": span["status"],
+                "attributes": span["attributes"],
+            }
+            if span is self.root:
+                row["started_at"] = datetime.fromtimestamp(self.started_at, timezone.utc).isoformat()
+            rows.append(row)
+        return rows
+
+
+class Tracer:
+    """Creates turn traces, decides which are kept, and writes them from a background thread."""
+
+    def __init__(self, enabled: bool, sample_rate: float, slow_seconds: float, path: str, max_bytes: int, max_queue: int):
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.slow_seconds = slow_seconds
+        self.path = path
+        self.max_bytes = max_bytes
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max_queue)
+        self._writer: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._counts = {"turns": 0, "kept": 0, "sampled_out": 0, "dropped": 0, "write_errors": 0}
+
+    def start_turn(self, thread_id: str, started: Optional[float] = None) -> TurnTrace:
+        if self.enabled:
+            self._count("turns")
+        return TurnTrace(self, thread_id, started)
+
+    def submit(self, trace: TurnTrace, duration: float, outcome: str) -> None:
+        if outcome in ("failed", "cancelled"):
+            reason = outcome
+        elif duration >= self.slow_seconds:
+            reason = "slow"
+        elif random.random() < self.sample_rate:
+            reason = "sampled"
+        else:
+            self._count("sampled_out")
+            return
+        trace.root["attributes"]["kept"] = reason
+        try:
+            self._queue.put_nowait(trace.lines())
+        except queue.Full:
+            self._count("dropped")
+            return
+        self._count("kept")
+        self._ensure_writer()
+
+    def _ensure_writer(self) -> None:
+        with self._lock:
+            if self._writer is None or not self._writer.is_alive():
+                self._writer = threading.Thread(target=self._write_loop, name="trace-exporter", daemon=True)
+                self._writer.start()
+
+    def _write_loop(self) -> None:
+        while True:
+            rows = self._queue.get()
+            if rows is None:
+                return
+            try:
+                self._write(rows)
+            except Exception as e:
+                self._count("write_errors")
+                print(f"Trace export failed: {e}")
+
+    def _write(self, rows: List[dict]) -> None:
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        if os.path.exists(self.path) and os.path.getsize(self.path) > self.max_bytes:
+            os.replace(self.path, self.path + ".1")
+        with open(self.path, "a", encoding="utf-8") as f:
+            for row in rows:
+                f.write(json.dumps(row, ensure_ascii=False, default=str) + "\n")
+
+    def close(self, timeout: float = 5) -> None:
+        """Flushes kept turns still queued for the writer."""
+        if self._writer is not None and self._writer.is_alive():
+            self._queue.put(None)
+            self._writer.join(timeout)
+
+    def stats(self) -> dict:
+        with self._lock:
+            counts = dict(self._counts)
+        counts["queued"] = self._queue.qsize()
+        return counts
+
+    def _count(self, key: str) -> None:
+        with self._lock:
+            self._counts[key] += 1
+
+
+tracer = Tracer(
+    TRACING_ENABLED, TRACE_SAMPLE_RATE, TRACE_SLOW_TURN_SECONDS, TRACE_EXPORT_PATH, TRACE_MAX_FILE_BYTES, TRACE_EXPORT_QUEUE
+)
+
+
+# -------------------------------------------------------
+# Waterfall CLI
+# -------------------------------------------------------
+
+def load_turns(thread_id: str, path: str = TRACE_EXPORT_PATH) -> List[List[dict]]:
+    """Kept turns of a thread, oldest first, each as its list of spans."""
+    traces: Dict[str, List[dict]] = {}
+    for candidate in (path + ".1", path):
+        if not os.path.exists(candidate):
+            continue
+        with open(candidate, encoding="utf-8") as f:
+            for line in f:
+                row = json.loads(line)
+                if row.get("thread_id") == thread_id:
+                    traces.setdefault(row["trace_id"], []).append(row)
+    turns = [spans for spans in traces.values() if any(span["parent_id"] is None for span in spans)]
+    return sorted(turns, key=lambda spans: next(span["started_at"] for span in spans if span["parent_id"] is None))
+
+
+def _label(span: dict) -> str:
+    attributes = span["attributes"]
+    if span["kind"] == "llm":
+        return f"llm {attributes.get('model', '')}".strip()
+    if span["kind"] in ("tool", "handoff"):
+        return f"{span['kind']} {span['name']}"
+    return span["name"]
+
+
+def _details(span: dict) -> str:
+    attributes = dict(span["attributes"])
+    attributes.pop("model", None)
+    parts = [f"{key}={value}" for key, value in attributes.items()]
+    if span["status"] != "ok":
+        parts.insert(0, span["status"].upper())
+    return "  ".join(parts)
+
+
+def render_waterfall(spans: List[dict], width: int = 48) -> str:
+    root = next(span for span in spans if span["parent_id"] is None)
+    children: Dict[Optional[str], List[dict]] = {}
+    for span in spans:
+        children.setdefault(span["parent_id"], []).append(span)
+    total = max(root["duration_ms"], 0.001)
+
+    lines = [
+        f"trace {root['trace_id']}  thread {root['thread_id']}  {root['started_at']}  "
+        f"{root['duration_ms']:.0f} ms  {root['attributes'].get('outcome', '')} (kept: {root['attributes'].get('kept', '-')})"
+    ]
+
+    def walk(span: dict, depth: int) -> None:
+        offset = int(span["start_ms"] / total * width)
+        length = max(1, round(span["duration_ms"] / total * width))
+        bar = " " * offset + "█" * min(length, width - offset)
+        label = ("  " * depth + _label(span))[:40]
+        lines.append(f"{label:<40} |{bar:<{width}}| {span['duration_ms']:>9.1f} ms  {_details(span)}".rstrip())
+        for child in sorted(children.get(span["span_id"], []), key=lambda child: child["start_ms"]):
+            walk(child, depth + 1)
+
+    walk(root, 0)
+    return "\n".join(lines)
+
+
+def main(argv: Sequence[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Render a traced chat turn as a waterfall.")
+    parser.add_argument("thread_id")
+    parser.add_argument("--turn", type=int, default=-1, help="Kept turn of the thread, 1-based; negative counts from the latest (default).")
+    parser.add_argument("--trace", help="Select the turn by trace id instead.")
+    parser.add_argument("--list", action="store_true", help="List the thread's kept turns.")
+    parser.add_argument("--path", default=TRACE_EXPORT_PATH)
+    parser.add_argument("--width", type=int, default=48)
+    args = parser.parse_args(argv)
+
+    turns = load_turns(args.thread_id, args.path)
+    if not turns:
+        print(f"No kept turns for thread {args.thread_id} in {args.path}.", file=sys.stderr)
+        return 1
+
+    if args.list:
+        for number, spans in enumerate(turns, start=1):
+            root = next(span for span in spans if span["parent_id"] is None)
+            attributes = root["attributes"]
+            print(f"{number:>4}  {root['started_at']}  {root['duration_ms']:>9.1f} ms  "
+                  f"{attributes.get('outcome', ''):<10} {root['trace_id']}  agents={attributes.get('agents', '-')}")
+        return 0
+
+    if args.trace:
+        selected = [spans for spans in turns if spans[0]["trace_id"] == args.trace]
+        if not selected:
+            print(f"Trace {args.trace} not found for thread {args.thread_id}.", file=sys.stderr)
+            return 1
+        spans = selected[0]
+    else:
+        index = args.turn - 1 if args.turn > 0 else args.turn
+        if not -len(turns) <= index < len(turns):
+            print(f"Thread {args.thread_id} has {len(turns)} kept turns.", file=sys.stderr)
+            return 1
+        spans = turns[index]
+
+    print(render_waterfall(spans, args.width))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,191 @@
+import os
+import json
+import time
+import asyncio
+import threading
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field, asdict
+from collections import Counter
+from typing import Dict, Optional, Set
+from uuid import uuid4
+
+from Agents.tax_analysis import ingest_statement, invalidate_analysis
+from statement_store import STATEMENT_STORE_DIR
+from workers import get_process_pool
+
+# -------------------------------------------------------
+# Configuration
+# -------------------------------------------------------
+
+UPLOAD_JOB_DIR = os.getenv("UPLOAD_JOB_DIR", os.path.join(STATEMENT_STORE_DIR, "jobs"))
+UPLOAD_JOB_TTL_SECONDS = float(os.getenv("UPLOAD_JOB_TTL_SECONDS", "3600"))
+UPLOAD_MAX_PENDING_JOBS = int(os.getenv("UPLOAD_MAX_PENDING_JOBS", "64"))
+# An unfinished job not updated for this long was lost with the worker that ran it (e.g. a restart)
+UPLOAD_JOB_STALE_SECONDS = float(os.getenv("UPLOAD_JOB_STALE_SECONDS", "600"))
+
+# Progress reported for each processing stage.
+_STAGE_PROGRESS = {"queued": 0.0, "parsing": 0.1, "done": 1.0, "failed": 1.0}
+
+
+class UploadQueueFull(Exception):
+    """Raised when too many uploads are already waiting to be processed."""
+
+
+@dataclass
+class UploadJob:
+    job_id: str
+    thread_id: str
+    filename: str
+    append: bool
+    status: str = "queued"
+    progress: float = 0.0
+    rows: Optional[int] = None
+    rows_added: Optional[int] = None
+    duplicates_skipped: Optional[int] = None
+    total_rows: Optional[int] = None
+    report: Dict = field(default_factory=dict)
+    error: Optional[str] = None
+    created_at: float = field(default_factory=time.time)
+    updated_at: float = field(default_factory=time.time)
+    finished_at: Optional[float] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("done", "failed")
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+_jobs: Dict[str, UploadJob] = {}
+_jobs_lock = threading.Lock()
+# Strong references so running job tasks are not garbage collected.
+_running_tasks: Set[asyncio.Task] = set()
+# Uploads for one thread queue here, rather than each holding a pool worker while it waits
+# for the statement's file lock (which is what serialises them across workers).
+# Entries are dropped once no job for the thread is running or waiting.
+_thread_locks: Dict[str, asyncio.Lock] = {}
+_thread_lock_users: Counter = Counter()
+
+os.makedirs(UPLOAD_JOB_DIR, exist_ok=True)
+
+
+def _job_path(job_id: str) -> str:
+    return os.path.join(UPLOAD_JOB_DIR, f"{job_id}.json")
+
+
+def _persist(job: UploadJob) -> None:
+    """Writes the job status to disk so a status request on another worker can see it."""
+    path = _job_path(job.job_id)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(job.to_dict(), f)
+    os.replace(tmp_path, path)
+
+
+def _set_status(job: UploadJob, status: str, **fields) -> None:
+    job.status = status
+    job.progress = _STAGE_PROGRESS[status]
+    for key, value in fields.items():
+        setattr(job, key, value)
+    job.updated_at = time.time()
+    if job.finished:
+        job.finished_at = job.updated_at
+    _persist(job)
+
+
+@asynccontextmanager
+async def _thread_turn(thread_id: str):
+    lock = _thread_locks.setdefault(thread_id, asyncio.Lock())
+    _thread_lock_users[thread_id] += 1
+    try:
+        async with lock:
+            yield
+    finally:
+        _thread_lock_users[thread_id] -= 1
+        if not _thread_lock_users[thread_id]:
+            del _thread_lock_users[thread_id]
+            del _thread_locks[thread_id]
+
+
+def _prune_finished() -> None:
+    cutoff = time.time() - UPLOAD_JOB_TTL_SECONDS
+    with _jobs_lock:
+        expired = [job_id for job_id, job in _jobs.items() if job.finished and job.finished_at < cutoff]
+        for job_id in expired:
+            del _jobs[job_id]
+    for job_id in expired:
+        try:
+            os.remove(_job_path(job_id))
+        except FileNotFoundError:
+            pass
+
+
+# -------------------------------------------------------
+# Public API
+# -------------------------------------------------------
+
+def submit_upload_job(thread_id: str, filename: str, content: bytes, append: bool) -> UploadJob:
+    """Registers an upload and schedules its processing; returns immediately."""
+    _prune_finished()
+    with _jobs_lock:
+        pending = sum(1 for job in _jobs.values() if not job.finished)
+        if pending >= UPLOAD_MAX_PENDING_JOBS:
+            raise UploadQueueFull()
+        job = UploadJob(job_id=str(uuid4()), thread_id=thread_id, filename=filename, append=append)
+        _jobs[job.job_id] = job
+    _persist(job)
+
+    task = asyncio.create_task(_run_upload_job(job, content))
+    _running_tasks.add(task)
+    task.add_done_callback(_running_tasks.discard)
+    return job
+
+
+def get_upload_job(job_id: str) -> Optional[dict]:
+    """Status of a job started on this or any other worker, or None if unknown."""
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+        if job is not None:
+            return job.to_dict()
+    try:
+        with open(_job_path(job_id)) as f:
+            data = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+    # Nobody will finish a job whose worker went away; report it instead of leaving clients polling
+    updated_at = data.get("updated_at", data.get("created_at", 0))
+    if data.get("status") not in ("done", "failed") and time.time() - updated_at > UPLOAD_JOB_STALE_SECONDS:
+        job = UploadJob(**{key: value for key, value in data.items() if key in UploadJob.__dataclass_fields__})
+        _set_status(job, "failed", error="Processing was interrupted. Please upload the statement again.")
+        data = job.to_dict()
+    return data
+
+
+async def _run_upload_job(job: UploadJob, content: bytes) -> None:
+    loop = asyncio.get_running_loop()
+    try:
+        async with _thread_turn(job.thread_id):
+            _set_status(job, "parsing")
+            # Parsing, classification, the merge and the write all run in a separate process
+            report, result = await loop.run_in_executor(
+                get_process_pool(), ingest_statement, job.thread_id, content, job.append
+            )
+            del content
+            invalidate_analysis(job.thread_id)
+
+        _set_status(
+            job,
+            "done",
+            rows=report["rows"],
+            report=report,
+            rows_added=result["rows_added"],
+            duplicates_skipped=result["duplicates_skipped"],
+            total_rows=result["total_rows"],
+        )
+    except ValueError as e:
+        _set_status(job, "failed", error=str(e))
+    except Exception as e:
+        print(f"Upload job {job.job_id} failed: {e}")
+        _set_status(job, "failed", error=f"Error processing statement: {e}")
@@ -0,0 +1,110 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+# -------------------------------------------------------
+# Configuration
+# -------------------------------------------------------
+
+USER_CACHE_MAX_ENTRIES = int(os.getenv("USER_CACHE_MAX_ENTRIES", "10000"))
+# Bounds how long another worker's profile update can go unseen.
+USER_CACHE_TTL_SECONDS = float(os.getenv("USER_CACHE_TTL_SECONDS", "60"))
+
+
+@dataclass(frozen=True)
+class CachedUser:
+    """Detached, read-only snapshot of a `models.User` row (without the password hash)."""
+    id: int
+    username: str
+    email: str
+    thread_id: str
+    age: Optional[int]
+    risk_tolerance: Optional[str]
+    notification_preference: Optional[str]
+
+    @classmethod
+    def from_model(cls, user) -> "CachedUser":
+        return cls(
+            id=user.id,
+            username=user.username,
+            email=user.email,
+            thread_id=user.thread_id,
+            age=user.age,
+            risk_tolerance=user.risk_tolerance,
+            notification_preference=user.notification_preference,
+        )
+
+
+class UserCache:
+    """
+    Small TTL + LRU cache of user snapshots, addressable by email (auth
+    dependency) and by thread_id (agent tools). Entries are replaced or
+    dropped whenever this process writes to the user's row.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._by_email: "OrderedDict[str, Tuple[CachedUser, float]]" = OrderedDict()
+        self._email_by_thread: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def get_by_email(self, email: str) -> Optional[CachedUser]:
+        with self._lock:
+            return self._get(email)
+
+    def get_by_thread_id(self, thread_id: str) -> Optional[CachedUser]:
+        with self._lock:
+            email = self._email_by_thread.get(thread_id)
+            if email is None:
+                self._misses += 1
+                return None
+            return self._get(email)
+
+    def put(self, user) -> CachedUser:
+        """Caches a snapshot of a `models.User` (or an existing snapshot) and returns it."""
+        snapshot = user if isinstance(user, CachedUser) else CachedUser.from_model(user)
+        with self._lock:
+            self._remove(snapshot.email)
+            self._by_email[snapshot.email] = (snapshot, time.monotonic() + self.ttl_seconds)
+            self._email_by_thread[snapshot.thread_id] = snapshot.email
+            while len(self._by_email) > self.max_entries:
+                self._remove(next(iter(self._by_email)))
+        return snapshot
+
+    def invalidate(self, email: Optional[str] = None, thread_id: Optional[str] = None) -> None:
+        with self._lock:
+            if email is None and thread_id is not None:
+                email = self._email_by_thread.get(thread_id)
+            if email is not None:
+                self._remove(email)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": self._hits, "misses": self._misses, "entries": len(self._by_email)}
+
+    # The helpers below expect the caller to hold self._lock.
+
+    def _get(self, email: str) -> Optional[CachedUser]:
+        entry = self._by_email.get(email)
+        if entry is None or entry[1] < time.monotonic():
+            if entry is not None:
+                self._remove(email)
+            self._misses += 1
+            return None
+        self._by_email.move_to_end(email)
+        self._hits += 1
+        return entry[0]
+
+    def _remove(self, email: str) -> None:
+        entry = self._by_email.pop(email, None)
+        if entry is not None and self._email_by_thread.get(entry[0].thread_id) == email:
+            del self._email_by_thread[entry[0].thread_id]
+
+
+user_cache = UserCache(USER_CACHE_MAX_ENTRIES, USER_CACHE_TTL_SECONDS)
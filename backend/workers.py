@@ -0,0 +1,36 @@
+import os
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+# -------------------------------------------------------
+# Shared process pool for CPU-heavy pandas work
+# -------------------------------------------------------
+
+WORKER_PROCESSES = int(os.getenv("WORKER_PROCESSES", str(max((os.cpu_count() or 2) - 1, 1))))
+
+_process_pool: Optional[ProcessPoolExecutor] = None
+_process_pool_lock = threading.Lock()
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    """Returns the shared process pool, creating it on first use."""
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            # "spawn" keeps children from inheriting the event loop and the
+            # LLM/DB client threads of the API process.
+            _process_pool = ProcessPoolExecutor(
+                max_workers=WORKER_PROCESSES,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _process_pool
+
+
+def shutdown_process_pool() -> None:
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is not None:
+            _process_pool.shutdown(wait=False, cancel_futures=True)
+            _process_pool = None
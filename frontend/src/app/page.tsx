@@ -38,12 +38,14 @@ interface InputBarProps {
 }
 
 interface StreamedEvent {
-    type: 'content' | 'tool_start' | 'tool_end' | 'error' | 'end';
+    type: 'content' | 'tool_start' | 'tool_end' | 'error' | 'end' | 'cancelled' | 'gap' | 'queued';
     content?: string;
+    position?: number;
 }
 
 // --- CONSTANTS ---
 const API_URL = process.env.NEXT_PUBLIC_API_URL || "http://127.0.0.1:8000";
+const MAX_RESUME_ATTEMPTS = 3;
 
 // --- Authentication Context ---
 const AuthContext = createContext<AuthContextType | null>(null);
@@ -281,25 +283,32 @@ const ChatPage = () => {
         setCurrentMessage("");
         setIsStreaming(true);
 
-        try {
-            const response = await fetch(`${API_URL}/chat-stream`, {
-                method: 'POST',
-                headers: { 'Content-Type': 'application/json', 'Authorization': `Bearer ${token}` },
-                body: JSON.stringify({ message: userMessageContent }),
-            });
+        // Frames carry ids, so a dropped connection can reattach to the running answer instead of re-sending
+        let lastEventId: string | null = null;
 
-            if (!response.body) return;
+        // Reads one SSE response; resolves true once the answer is complete
+        const readStream = async (response: Response): Promise<boolean> => {
+            if (!response.ok || !response.body) return false;
             const reader = response.body.getReader();
             const decoder = new TextDecoder();
+            let buffer = "";
 
             while (true) {
                 const { done, value } = await reader.read();
-                if (done) break;
-                const chunk = decoder.decode(value, { stream: true });
-                const lines = chunk.split('\n\n').filter(line => line.trim().startsWith('data:'));
+                if (done) return false;
+                buffer += decoder.decode(value, { stream: true });
+                // A frame can span two reads; keep the trailing partial frame for the next one
+                const frames = buffer.split('\n\n');
+                buffer = frames.pop() ?? "";
+
+                for (const frame of frames) {
+                    let jsonStr = "";
+                    for (const line of frame.split('\n')) {
+                        if (line.startsWith('id:')) lastEventId = line.substring(3).trim();
+                        else if (line.startsWith('data:')) jsonStr = line.substring(5).trim();
+                    }
+                    if (!jsonStr) continue; // heartbeat comment
 
-                for (const line of lines) {
-                    const jsonStr = line.substring(6);
                     try {
                         const data: StreamedEvent = JSON.parse(jsonStr);
 
@@ -311,25 +320,66 @@ const ChatPage = () => {
                                 ? { ...msg, content: msg.content + data.content, isLoading: true, toolStatus: null } 
                                 : msg
                             ));
+                        } else if (data.type === 'queued') {
+                            // Waiting for a free slot on a busy server
+                            setMessages(prev => prev.map(msg => 
+                                msg.id === aiResponsePlaceholder.id 
+                                ? { ...msg, isLoading: true, toolStatus: `Waiting in line (position ${data.position})...` } 
+                                : msg
+                            ));
                         } else if (data.type === 'tool_start' && data.content) {
                             setMessages(prev => prev.map(msg => 
                                 msg.id === aiResponsePlaceholder.id 
                                 ? { ...msg, isLoading: true, toolStatus: data.content } 
                                 : msg
                             ));
-                        } else if (data.type === 'end') {
-                            // The 'end' event signals the stream is fully complete.
+                        } else if (data.type === 'end' || data.type === 'cancelled') {
+                            // 'end' signals the stream is fully complete; 'cancelled' that a newer message replaced it.
                             setIsStreaming(false);
                             setMessages(prev => prev.map(msg => 
                                 msg.id === aiResponsePlaceholder.id 
                                 ? { ...msg, isLoading: false, toolStatus: null } 
                                 : msg
                             ));
-                            return; // Exit the loop
+                            return true;
                         }
                     } catch (e) { console.error("Error parsing JSON:", e, jsonStr); }
                 }
             }
+        };
+
+        try {
+            let finished = false;
+            try {
+                const response = await fetch(`${API_URL}/chat-stream`, {
+                    method: 'POST',
+                    headers: { 'Content-Type': 'application/json', 'Authorization': `Bearer ${token}` },
+                    body: JSON.stringify({ message: userMessageContent }),
+                });
+                if (response.status === 429) {
+                    // The server's wait queue is full; nothing is running, so there is nothing to resume
+                    const data = await response.json();
+                    setMessages(prev => prev.map(msg => 
+                        msg.id === aiResponsePlaceholder.id 
+                        ? { ...msg, content: data.detail || "The assistant is busy right now. Please try again shortly.", isLoading: false } 
+                        : msg
+                    ));
+                    return;
+                }
+                finished = await readStream(response);
+            } catch (error) { console.error("Stream interrupted:", error); }
+
+            for (let attempt = 0; !finished && attempt < MAX_RESUME_ATTEMPTS; attempt++) {
+                await new Promise(resolve => setTimeout(resolve, 1000 * (attempt + 1)));
+                try {
+                    const headers: Record<string, string> = { 'Authorization': `Bearer ${token}` };
+                    if (lastEventId) headers['Last-Event-ID'] = lastEventId;
+                    const response = await fetch(`${API_URL}/chat-stream/resume`, { headers });
+                    if (response.status === 404) break;
+                    finished = await readStream(response);
+                } catch (error) { console.error("Resume failed:", error); }
+            }
+            if (!finished) throw new Error("The chat stream ended before the answer was complete.");
         } catch (error) {
             console.error("Fetch error:", error);
             setMessages(prev => prev.map(msg => 
@@ -366,9 +416,20 @@ const ChatPage = () => {
                 body: formData,
             });
 
-            const data = await response.json();
+            let data = await response.json();
 
             if (response.ok) {
+                // The statement is processed in the background; poll until it is done, for up to five minutes
+                let polls = 0;
+                while (data.status_url && data.status !== 'done' && data.status !== 'failed') {
+                    if (++polls > 300) throw new Error("Timed out waiting for the upload to be processed.");
+                    await new Promise(resolve => setTimeout(resolve, 1000));
+                    const statusResponse = await fetch(`${API_URL}${data.status_url}`, {
+                        headers: { 'Authorization': `Bearer ${token}` },
+                    });
+                    if (!statusResponse.ok) throw new Error("Failed to fetch upload status.");
+                    data = { ...(await statusResponse.json()), status_url: data.status_url };
+                }
                 setMessages(prev => prev.map(msg => 
                     msg.id === aiResponsePlaceholder.id 
                     ? { ...msg, content: data.message, isLoading: false } 